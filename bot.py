@@ -18,8 +18,8 @@ from telegram.ext import (
 # Импорты модулей
 import config
 from database import DatabaseManager
-from services import SpotifyService, DownloadService
-from services.telegram_storage_service import TelegramStorageService
+from services import SpotifyService, DownloadService, http_clients
+from services.telegram_storage_service import AsyncTelegramStorageService
 from services.db_backup_service import DatabaseBackupService
 from handlers import (
     start_command,
@@ -42,7 +42,8 @@ from handlers.playlist import (
     WAITING_PLAYLIST_DESCRIPTION
 )
 # Новые обработчики (Функции 3, 5, 8, 18)
-from handlers.history import history_command, clear_history_command
+from handlers.history import history_command, clear_history_command, history_page_callback
+from handlers.favorites import favorites_command, favorites_page_callback
 from handlers.settings import (
     settings_command,
     quality_settings_callback,
@@ -58,17 +59,17 @@ from handlers.settings import (
 )
 # Обработчик кнопок меню
 from handlers.menu import handle_menu_buttons
+from utils.update_processor import PerChatUpdateProcessor
 
 async def post_init(application: Application) -> None:
     """Функция для инициализации после запуска бота (восстановление БД и backup)."""
     try:
         print("📦 Phase 1: Database Restoration...")
-        storage_service = TelegramStorageService()
-        db_path = config.DATABASE_URL.replace('sqlite+aiosqlite:///', '')
-        
+        storage_service = AsyncTelegramStorageService()
         backup_service = DatabaseBackupService(
             storage_service=storage_service,
-            db_path=db_path
+            db_path=config.SQLITE_DB_PATH,
+            database_dsn=config.DATABASE_DSN
         )
         
         # 1. Сначала пробуем восстановить БД из Telegram
@@ -83,16 +84,22 @@ async def post_init(application: Application) -> None:
         # 2. Теперь инициализируем БД (создаем таблицы, если их нет)
         db = DatabaseManager()
         await db.init_db()
+        # Все записи бота идут через одного писателя с групповой фиксацией
+        db.start_writer()
+        # Отложенные last_active и история пишутся по таймеру, а не только при следующем запросе
+        db.start_write_behind()
         application.bot_data['db'] = db
         
         # Подключаем менеджер БД к сервису бэкапов для персистентной очистки
         backup_service.db = db
+        # Старые file_id из кэша проверяются через getFile в фоне
+        db.file_id_validator = storage_service.check_file_id
         
         # 3. Инициализация остальных сервисов
         spotify = SpotifyService()
         application.bot_data['spotify'] = spotify
         
-        download_service = DownloadService()
+        download_service = DownloadService(db_manager=db, storage_service=storage_service)
         application.bot_data['download_service'] = download_service
         
         # 4. Запускаем периодический backup
@@ -119,11 +126,21 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+async def post_stop(application: Application):
+    """Дообработать принятые апдейты, пока бот еще может отвечать"""
+    processor = application.update_processor
+    if isinstance(processor, PerChatUpdateProcessor):
+        await processor.drain()
+
+
 async def post_shutdown(application: Application):
     """Очистка при остановке бота"""
     db = application.bot_data.get('db')
     if db:
+        # close() дописывает отложенную историю и счетчики до закрытия соединений
         await db.close()
+    # Закрываем пулы HTTP соединений
+    await http_clients.aclose()
     logger.info("👋 Бот остановлен")
 
 
@@ -143,7 +160,10 @@ def main():
         Application.builder()
         .token(config.TELEGRAM_BOT_TOKEN)
         .post_init(post_init)
+        .post_stop(post_stop)
         .post_shutdown(post_shutdown)
+        # Разные чаты обрабатываются параллельно, внутри чата - по порядку
+        .concurrent_updates(PerChatUpdateProcessor(config.BOT_CONCURRENT_UPDATES))
         .build()
     )
     
@@ -167,6 +187,7 @@ def main():
     
     application.add_handler(CommandHandler("history", history_command))
     application.add_handler(CommandHandler("clearhistory", clear_history_command))
+    application.add_handler(CommandHandler("favorites", favorites_command))
     application.add_handler(CommandHandler("settings", settings_command))
     
     # ========== CONVERSATION HANDLER ДЛЯ СОЗДАНИЯ ПЛЕЙЛИСТА ==========
@@ -211,6 +232,7 @@ def main():
     
     # Обработчик Spotify ссылок
     spotify_link_filter = filters.TEXT & filters.Regex(r'(https?://)?(open\.)?spotify\.com/(track|album|playlist)/[a-zA-Z0-9]+')
+    # Скачивание обработчик сам запускает в фоне (run_in_background), порядок апдейтов чата сохраняется
     application.add_handler(MessageHandler(spotify_link_filter, handle_spotify_link))
     
     # ========== ОБРАБОТЧИКИ CALLBACK ЗАПРОСОВ ==========
@@ -233,6 +255,10 @@ def main():
     application.add_handler(CallbackQueryHandler(create_playlist_for_track_callback, pattern=r'^plnew_'))
     application.add_handler(CallbackQueryHandler(cancel_playlist_selection_callback, pattern=r'^plcancel_'))
     
+    # Страницы истории и избранного
+    application.add_handler(CallbackQueryHandler(history_page_callback, pattern=r'^history_page_'))
+    application.add_handler(CallbackQueryHandler(favorites_page_callback, pattern=r'^favorites_page_'))
+    
     # Общий обработчик callback'ов (для остальных)
     application.add_handler(CallbackQueryHandler(handle_callback))
     
@@ -18,6 +18,58 @@ if not TELEGRAM_BOT_TOKEN:
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # Используем абсолютный путь для SQLite (в папке data для Railway)
 DATABASE_URL = os.getenv('DATABASE_URL', f'sqlite+aiosqlite:///{os.path.join(BASE_DIR, "data", "spotify_bot.db")}')
+# PostgreSQL (для нескольких реплик бота/веба): postgres:// и postgresql:// переводим на драйвер asyncpg
+for _pg_prefix in ('postgres://', 'postgresql://'):
+    if DATABASE_URL.startswith(_pg_prefix):
+        DATABASE_URL = 'postgresql+asyncpg://' + DATABASE_URL[len(_pg_prefix):]
+IS_SQLITE = DATABASE_URL.startswith('sqlite')
+# Путь к файлу SQLite (None для PostgreSQL) - для файлового бэкапа
+SQLITE_DB_PATH = DATABASE_URL.split(':///', 1)[1] if IS_SQLITE else None
+# Строка подключения для pg_dump/pg_restore (libpq не знает "+asyncpg")
+DATABASE_DSN = DATABASE_URL.replace('postgresql+asyncpg://', 'postgresql://', 1)
+# Пул соединений PostgreSQL на процесс (у каждого воркера gunicorn свой пул):
+# сумма (DB_POOL_SIZE + DB_MAX_OVERFLOW) по всем процессам должна быть меньше max_connections сервера
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 5))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+# Настройки соединений SQLite (применяются к каждому соединению пула)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 20000))
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', 16384))
+SQLITE_MMAP_SIZE_MB = int(os.getenv('SQLITE_MMAP_SIZE_MB', 256))
+# Максимум операций в одной транзакции единого писателя
+DB_WRITER_MAX_BATCH = int(os.getenv('DB_WRITER_MAX_BATCH', 50))
+# Ожидание блокировки записи дольше этого (секунды) пишется в лог
+DB_LOCK_WAIT_WARN = float(os.getenv('DB_LOCK_WAIT_WARN', 1.0))
+
+# Кэш file_id: записи старше FILE_ID_REVALIDATE_DAYS отдаются сразу и проверяются через getFile в фоне;
+# FILE_ID_MAX_AGE_DAYS > 0 - жесткий предел возраста (0 - без ограничения)
+FILE_ID_REVALIDATE_DAYS = int(os.getenv('FILE_ID_REVALIDATE_DAYS', 7))
+FILE_ID_MAX_AGE_DAYS = int(os.getenv('FILE_ID_MAX_AGE_DAYS', 0))
+# Сколько секунд не отдавать file_id, который Telegram не узнал
+FILE_ID_NEGATIVE_TTL = int(os.getenv('FILE_ID_NEGATIVE_TTL', 3600))
+FILE_ID_REVALIDATE_CONCURRENCY = int(os.getenv('FILE_ID_REVALIDATE_CONCURRENCY', 4))
+# Сколько секунд доверять пути из getFile (Telegram гарантирует не меньше часа)
+TELEGRAM_FILE_PATH_TTL = int(os.getenv('TELEGRAM_FILE_PATH_TTL', 3000))
+
+# Размер страницы списков в боте (история, избранное, треки плейлиста) и библиотеки в вебе
+BOT_PAGE_SIZE = int(os.getenv('BOT_PAGE_SIZE', 10))
+LIBRARY_PAGE_SIZE = int(os.getenv('LIBRARY_PAGE_SIZE', 100))
+# Сколько секунд веб доверяет версии библиотеки в памяти (записи бота идут из другого процесса)
+LIBRARY_VERSION_TTL = float(os.getenv('LIBRARY_VERSION_TTL', 5))
+# Сколько готовых ответов /api/library держать в памяти
+LIBRARY_RESPONSE_CACHE_SIZE = int(os.getenv('LIBRARY_RESPONSE_CACHE_SIZE', 64))
+
+# Поиск по собственному каталогу (FTS5 на SQLite)
+SEARCH_RESULTS_LIMIT = int(os.getenv('SEARCH_RESULTS_LIMIT', 10))
+
+# Фоновые задания веба: сколько хранить завершенные (сек) и период keep-alive в SSE
+WEB_JOB_TTL = int(os.getenv('WEB_JOB_TTL', 600))
+WEB_SSE_HEARTBEAT = int(os.getenv('WEB_SSE_HEARTBEAT', 15))
+# Сколько секунд запрос веба ждет операцию в фоновом цикле событий, после чего получает 504
+WEB_LOOP_TIMEOUT = float(os.getenv('WEB_LOOP_TIMEOUT', 60))
+# То же для восстановления, инициализации и бэкапа БД (файл целиком идет через Telegram)
+WEB_DB_INIT_TIMEOUT = float(os.getenv('WEB_DB_INIT_TIMEOUT', 600))
 
 # Web App URL (для авторизации через Telegram)
 WEB_APP_URL = os.getenv('WEB_APP_URL', 'http://localhost:5000')
@@ -39,6 +91,38 @@ MAX_PLAYLIST_NAME_LENGTH = 100
 MAX_TRACKS_PER_PLAYLIST = 500
 MAX_SEARCH_RESULTS = 10
 
+# Скачивание (пул воркеров yt-dlp/ffmpeg)
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '2'))  # Одновременных скачиваний/конвертаций
+DOWNLOAD_QUEUE_LIMIT = int(os.getenv('DOWNLOAD_QUEUE_LIMIT', '100'))  # Всего заданий в очереди
+DOWNLOAD_QUEUE_PER_USER = int(os.getenv('DOWNLOAD_QUEUE_PER_USER', '20'))  # Заданий в очереди на пользователя
+SOURCE_CACHE_MAX_MB = int(os.getenv('SOURCE_CACHE_MAX_MB', '2048'))  # Лимит кэша исходников bestaudio
+DOWNLOAD_CACHE_MAX_MB = int(os.getenv('DOWNLOAD_CACHE_MAX_MB', '1024'))  # Лимит готовых файлов и обложек в downloads/
+STREAM_CACHE_MAX_MB = int(os.getenv('STREAM_CACHE_MAX_MB', '512'))  # Лимит кэша фрагментов для стриминга в вебе
+STREAM_CHUNK_KB = int(os.getenv('STREAM_CHUNK_KB', '1024'))  # Размер фрагмента стриминга
+BULK_DOWNLOAD_CONCURRENCY = int(os.getenv('BULK_DOWNLOAD_CONCURRENCY', '3'))  # Параллельных треков при скачивании плейлиста
+BULK_MAX_TRACKS = int(os.getenv('BULK_MAX_TRACKS', '200'))  # Максимум треков из одного плейлиста/альбома
+
+# Обработка апдейтов бота
+BOT_CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', '32'))  # Апдейтов разных чатов одновременно
+
+# Кэш пользователей и отложенная запись в БД
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '60'))  # Секунд хранения пользователя в памяти (веб меняет настройки в другом процессе)
+WRITE_BEHIND_INTERVAL = int(os.getenv('WRITE_BEHIND_INTERVAL', '30'))  # Как часто записывать накопленные изменения
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '50'))  # Записей истории, после которых запись не ждет интервала
+WRITE_BEHIND_MAX_PENDING = int(os.getenv('WRITE_BEHIND_MAX_PENDING', '5000'))  # Предел очереди истории, если БД недоступна
+
+# HTTP клиенты (пулы соединений по хостам)
+HTTP_TELEGRAM_MAX_CONNECTIONS = int(os.getenv('HTTP_TELEGRAM_MAX_CONNECTIONS', '20'))
+HTTP_SPOTIFY_MAX_CONNECTIONS = int(os.getenv('HTTP_SPOTIFY_MAX_CONNECTIONS', '10'))
+HTTP_DEFAULT_MAX_CONNECTIONS = int(os.getenv('HTTP_DEFAULT_MAX_CONNECTIONS', '10'))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '60'))
+# Качества, которые готовятся в фоне после первого скачивания трека, например "mp3:128,mp3:320,flac:1411"
+PREFETCH_RENDITIONS = [
+    tuple(item.strip().split(':', 1))
+    for item in os.getenv('PREFETCH_RENDITIONS', '').split(',')
+    if ':' in item
+]
+
 # Сообщения
 WELCOME_MESSAGE = """
 🎵 <b>Добро пожаловать в Music Download Bot!</b>
@@ -1,48 +1,400 @@
-from __future__ import annotations
 """
-Менеджер базы данных для работы с SQLite
+Менеджер базы данных (SQLite или PostgreSQL через asyncpg)
 """
+from __future__ import annotations
+
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy import select, delete
-from typing import Optional, List
+from sqlalchemy import select, delete, update, insert, func, event, text, and_, or_, DateTime
+from sqlalchemy.exc import IntegrityError
+from typing import Optional, List, Dict, Tuple
 from datetime import datetime, timedelta
+import asyncio
+import re
+import threading
+import time
 
-from .models import Base, User, Playlist, Track, PlaylistTrack, Album, DownloadHistory, Favorite, TrackCache, AuthToken, TelegramFile, BackupLog
+from .models import Base, User, Playlist, Track, PlaylistTrack, Album, DownloadHistory, Favorite, TrackCache, AuthToken, TelegramFile, BackupLog, YouTubeMatch, TelegramFilePath
+from .migrations import run_migrations
+from .writer import DatabaseWriter, WriteStats
 import config
 
 
+# Строк истории в одном многострочном INSERT (лимит параметров SQLite)
+HISTORY_INSERT_CHUNK = 150
+# Строк в одном пакетном INSERT ... ON CONFLICT
+BULK_CHUNK = 100
+# Не больше стольких слов запроса уходит в поиск по каталогу
+SEARCH_MAX_TERMS = 8
+# Не больше стольких путей getFile держится в памяти процесса
+FILE_PATH_MEMORY_LIMIT = 5000
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def encode_cursor(direction: str, sort_value, row_id) -> str:
+    """
+    Курсор keyset-пагинации: направление ('a' - после, 'b' - до) и ключ строки.
+    Время кодируется микросекундами, чтобы курсор помещался в callback_data (64 байта).
+    """
+    if isinstance(sort_value, datetime):
+        sort_value = (sort_value - _EPOCH) // timedelta(microseconds=1)
+    return f"{direction}{sort_value}:{row_id}"
+
+
+def decode_cursor(cursor: str, sort_is_datetime: bool, id_type: type = int):
+    """Разобрать курсор в (направление, значение сортировки, id); ValueError для мусора"""
+    if not cursor or cursor[0] not in ('a', 'b') or ':' not in cursor:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    sort_raw, row_id = cursor[1:].split(':', 1)
+    sort_value = int(sort_raw)
+    if sort_is_datetime:
+        sort_value = _EPOCH + timedelta(microseconds=sort_value)
+    return cursor[0], sort_value, id_type(row_id)
+
+
 class DatabaseManager:
     """Менеджер для асинхронной работы с базой данных"""
     
     def __init__(self, database_url: str = None):
         self.database_url = database_url or config.DATABASE_URL
-        # Добавляем таймаут для SQLite чтобы избежать "database is locked" в многопроцессной среде
-        connect_args = {"timeout": 20} if "sqlite" in self.database_url else {}
+        self.is_sqlite = self.database_url.startswith("sqlite")
+        if self.is_sqlite:
+            # Добавляем таймаут для SQLite чтобы избежать "database is locked" в многопроцессной среде
+            engine_args = {"connect_args": {"timeout": config.SQLITE_BUSY_TIMEOUT_MS / 1000}}
+        else:
+            # PostgreSQL (asyncpg): пул на процесс, мертвые соединения отбрасываются перед выдачей
+            engine_args = {
+                "pool_size": config.DB_POOL_SIZE,
+                "max_overflow": config.DB_MAX_OVERFLOW,
+                "pool_timeout": config.DB_POOL_TIMEOUT,
+                "pool_recycle": config.DB_POOL_RECYCLE,
+                "pool_pre_ping": True,
+            }
         self.engine = create_async_engine(
             self.database_url, 
             echo=False,
-            connect_args=connect_args
+            **engine_args
         )
+        if self.is_sqlite:
+            # PRAGMA действуют на соединение, поэтому применяются к каждому новому из пула
+            event.listen(self.engine.sync_engine, "connect", self._apply_sqlite_pragmas)
         self.async_session = async_sessionmaker(
             self.engine, 
             class_=AsyncSession, 
             expire_on_commit=False
         )
+        # Кэш пользователей: user_id -> (User, время истечения)
+        self._user_cache: Dict[int, tuple] = {}
+        # Отложенные обновления last_active/профиля: user_id -> {поле: значение}
+        self._pending_user_updates: Dict[int, dict] = {}
+        # Отложенные записи истории скачиваний (счетчики считаются при записи)
+        self._pending_history: List[dict] = []
+        self._write_behind_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        # Фоновая запись отложенных изменений по таймеру (start_write_behind)
+        self._write_behind_task: Optional[asyncio.Task] = None
+        # Единый писатель процесса (запускается явно через start_writer)
+        self._writer = DatabaseWriter(self, max_batch=config.DB_WRITER_MAX_BATCH)
+        self.write_stats = WriteStats(warn_after=config.DB_LOCK_WAIT_WARN)
+        # Проверка file_id через getFile: async (file_id) -> True/False/None (неизвестно).
+        # Подключается снаружи (bot.py), без нее старые записи просто отдаются.
+        self.file_id_validator = None
+        # Негативный кэш мертвых file_id: file_id -> время окончания
+        self._dead_file_ids: Dict[str, float] = {}
+        self._revalidating: set = set()
+        self._revalidate_tasks: set = set()
+        self._revalidate_semaphore = asyncio.Semaphore(config.FILE_ID_REVALIDATE_CONCURRENCY)
+        # Пути getFile в памяти процесса: file_id -> (file_path, истекает)
+        self._file_paths: Dict[str, Tuple[str, datetime]] = {}
+        # Версия библиотеки (последний uploaded_at, число файлов) и время ее чтения
+        self._library_version: Optional[Tuple[Optional[datetime], int]] = None
+        self._library_version_at = 0.0
+    
+    @staticmethod
+    def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+        """WAL, Foreign Keys и настройки производительности для соединения SQLite"""
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            # В режиме WAL NORMAL не теряет целостность, но не делает fsync на каждый COMMIT
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
+            # Отрицательное значение - размер в KiB, а не в страницах
+            cursor.execute(f"PRAGMA cache_size=-{config.SQLITE_CACHE_SIZE_KB}")
+            cursor.execute(f"PRAGMA mmap_size={config.SQLITE_MMAP_SIZE_MB * 1024 * 1024}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+        finally:
+            cursor.close()
     
     async def init_db(self):
         """Инициализация базы данных и создание таблиц"""
         async with self.engine.begin() as conn:
-            # Включаем WAL mode и Foreign Keys для лучшей параллельности и целостности в SQLite
-            if "sqlite" in self.database_url:
-                await conn.exec_driver_sql("PRAGMA journal_mode=WAL")
-                await conn.exec_driver_sql("PRAGMA foreign_keys = ON")
             await conn.run_sync(Base.metadata.create_all)
-        print("✅ База данных инициализирована (WAL mode enabled)")
+            # Индексы и ограничения для существующих (восстановленных) баз
+            await run_migrations(conn)
+        if self.is_sqlite:
+            print("✅ База данных инициализирована (WAL mode enabled)")
+        else:
+            print(f"✅ База данных инициализирована ({self.engine.dialect.name}, pool {config.DB_POOL_SIZE}+{config.DB_MAX_OVERFLOW})")
     
     async def close(self):
-        """Закрытие соединения с БД"""
+        """Закрытие соединения с БД (с записью отложенных изменений)"""
+        await self.stop_write_behind()
+        try:
+            await self.flush_write_behind()
+        except Exception as e:
+            print(f"⚠️ Не удалось записать отложенные изменения: {e}")
+        await self.stop_writer()
         await self.engine.dispose()
     
+    async def checkpoint(self):
+        """Перенести записи из WAL в основной файл SQLite (перед копированием файла в бэкап)"""
+        if not self.is_sqlite:
+            return
+        async with self.engine.connect() as conn:
+            await conn.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)")
+    
+    # ========== ПУТЬ ЗАПИСИ ==========
+    
+    def start_writer(self):
+        """Направлять записи через единого писателя с групповой фиксацией (в текущем event loop)"""
+        self._writer.start()
+    
+    async def stop_writer(self):
+        """Дописать очередь писателя и вернуться к прямой записи"""
+        await self._writer.stop()
+        if self.write_stats.transactions:
+            print(f"📊 DB write stats: {self.write_stats.snapshot()}")
+    
+    async def begin_write(self, session: AsyncSession):
+        """
+        Начать пишущую транзакцию. В SQLite блокировка записи берется сразу
+        (BEGIN IMMEDIATE), чтобы время ожидания других процессов попадало в метрику
+        и транзакция не падала с "database is locked" посреди работы.
+        """
+        if not self.is_sqlite:
+            return
+        started = time.monotonic()
+        await session.execute(text("BEGIN IMMEDIATE"))
+        self.write_stats.record_lock_wait(time.monotonic() - started)
+    
+    async def run_write(self, operation):
+        """
+        Выполнить operation(session) в пишущей транзакции и зафиксировать.
+        Если писатель запущен в этом цикле - через его очередь, иначе (в том числе
+        пока писатель останавливается) напрямую.
+        """
+        if self._writer.running and self._writer.loop is asyncio.get_running_loop():
+            return await self._writer.submit(operation)
+        async with self.async_session() as session:
+            await self.begin_write(session)
+            result = await operation(session)
+            await session.commit()
+        self.write_stats.record_operations(1)
+        return result
+    
+    # ========== KEYSET-ПАГИНАЦИЯ ==========
+    
+    async def _keyset_page(self, stmt, sort_col, id_col, limit: int, cursor: Optional[str] = None,
+                           descending: bool = True):
+        """
+        Страница выборки по ключу (sort_col, id_col) без OFFSET: запрос идет по индексу
+        от границы курсора, поэтому любая страница стоит как первая.
+        
+        Args:
+            stmt: select(...) без ORDER BY/LIMIT
+            sort_col, id_col: колонки ключа сортировки (id - для уникальности)
+            cursor: next_cursor/prev_cursor предыдущей страницы или None для первой
+        
+        Returns:
+            (строки, next_cursor, prev_cursor); в строках нет служебных колонок ключа
+        """
+        forward = True
+        if cursor:
+            direction, sort_value, row_id = decode_cursor(
+                cursor, isinstance(sort_col.type, DateTime), id_col.type.python_type
+            )
+            forward = direction == 'a'
+            # Назад по убыванию - это вперед по возрастанию, и наоборот
+            if descending == forward:
+                boundary = or_(sort_col < sort_value, and_(sort_col == sort_value, id_col < row_id))
+            else:
+                boundary = or_(sort_col > sort_value, and_(sort_col == sort_value, id_col > row_id))
+            stmt = stmt.where(boundary)
+        
+        if descending == forward:
+            stmt = stmt.order_by(sort_col.desc(), id_col.desc())
+        else:
+            stmt = stmt.order_by(sort_col.asc(), id_col.asc())
+        stmt = stmt.add_columns(sort_col, id_col).limit(limit + 1)
+        
+        async with self.async_session() as session:
+            rows = (await session.execute(stmt)).all()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not forward:
+            rows.reverse()
+        if not rows:
+            return [], None, None
+        
+        first, last = rows[0], rows[-1]
+        if forward:
+            next_cursor = encode_cursor('a', last[-2], last[-1]) if has_more else None
+            prev_cursor = encode_cursor('b', first[-2], first[-1]) if cursor else None
+        else:
+            next_cursor = encode_cursor('a', last[-2], last[-1])
+            prev_cursor = encode_cursor('b', first[-2], first[-1]) if has_more else None
+        return [tuple(row[:-2]) for row in rows], next_cursor, prev_cursor
+    
+    # ========== ОТЛОЖЕННАЯ ЗАПИСЬ ==========
+    
+    async def flush_write_behind(self):
+        """
+        Записать накопленные изменения одной транзакцией: обновления пользователей,
+        историю скачиваний (многострочный INSERT) и агрегированные счетчики.
+        Каждая часть идет в своем SAVEPOINT: строки истории, нарушающие внешний ключ
+        (трек или пользователь удалены после постановки в очередь), пропускаются
+        и не мешают записать остальное.
+        """
+        with self._write_behind_lock:
+            user_updates = self._pending_user_updates
+            history = self._pending_history
+            self._pending_user_updates = {}
+            self._pending_history = []
+            self._last_flush = time.monotonic()
+        
+        if not user_updates and not history:
+            return
+        
+        async def _write(session):
+            if user_updates:
+                try:
+                    async with session.begin_nested():
+                        for user_id, values in user_updates.items():
+                            await session.execute(update(User).where(User.id == user_id).values(**values))
+                except IntegrityError as e:
+                    print(f"⚠️ Отложенные обновления пользователей отброшены: {e.orig}")
+            
+            saved = []
+            for start in range(0, len(history), HISTORY_INSERT_CHUNK):
+                chunk = history[start:start + HISTORY_INSERT_CHUNK]
+                try:
+                    async with session.begin_nested():
+                        await session.execute(insert(DownloadHistory).values(chunk))
+                    saved.extend(chunk)
+                except IntegrityError:
+                    # В пачке есть битая строка - пишем по одной, чтобы найти и отбросить ее
+                    saved.extend(await self._insert_history_rows(session, chunk))
+            
+            # Счетчики суммируются, чтобы обновить каждую строку один раз (x = x + n)
+            user_counters: Dict[int, list] = {}
+            track_counters: Dict[str, int] = {}
+            for event in saved:
+                counter = user_counters.setdefault(event['user_id'], [0, 0])
+                counter[0] += 1
+                counter[1] += event['file_size_mb']
+                track_counters[event['track_id']] = track_counters.get(event['track_id'], 0) + 1
+            for user_id, (count, size_mb) in user_counters.items():
+                await session.execute(
+                    update(User).where(User.id == user_id).values(
+                        total_downloads=User.total_downloads + count,
+                        total_size_mb=User.total_size_mb + size_mb
+                    )
+                )
+            for track_id, count in track_counters.items():
+                await session.execute(
+                    update(Track).where(Track.id == track_id).values(download_count=Track.download_count + count)
+                )
+        
+        try:
+            await self.run_write(_write)
+        except Exception:
+            # Транзакция не прошла целиком (блокировка, сбой соединения) - возвращаем изменения
+            # в очередь, более новые значения не перетираем
+            with self._write_behind_lock:
+                for user_id, values in user_updates.items():
+                    self._pending_user_updates[user_id] = {**values, **self._pending_user_updates.get(user_id, {})}
+                self._pending_history = history + self._pending_history
+                overflow = len(self._pending_history) - config.WRITE_BEHIND_MAX_PENDING
+                if overflow > 0:
+                    # БД долго недоступна - старейшие записи истории отбрасываем, чтобы не расти без предела
+                    del self._pending_history[:overflow]
+                    print(f"⚠️ Очередь истории переполнена, отброшено записей: {overflow}")
+            raise
+    
+    @staticmethod
+    async def _insert_history_rows(session, rows: List[dict]) -> List[dict]:
+        """Вставить записи истории по одной; нарушающие ограничения отбрасываются"""
+        saved = []
+        for row in rows:
+            try:
+                async with session.begin_nested():
+                    await session.execute(insert(DownloadHistory).values(row))
+                saved.append(row)
+            except IntegrityError as e:
+                print(f"⚠️ Запись истории отброшена (user {row['user_id']}, track {row['track_id']}): {e.orig}")
+        return saved
+    
+    def start_write_behind(self):
+        """
+        Записывать отложенные изменения каждые WRITE_BEHIND_INTERVAL секунд в текущем event loop.
+        Без этого они пишутся только при следующем обращении к БД и на тихом боте
+        остаются в памяти: теряются при падении и не попадают в бэкап.
+        """
+        if self._write_behind_task is not None and not self._write_behind_task.done():
+            return
+        self._write_behind_task = asyncio.get_running_loop().create_task(self._write_behind_loop())
+    
+    async def stop_write_behind(self):
+        """Остановить фоновую запись (сами изменения дописывает flush_write_behind)"""
+        task, self._write_behind_task = self._write_behind_task, None
+        if task is None or task.done():
+            return
+        if task.get_loop() is not asyncio.get_running_loop():
+            task.get_loop().call_soon_threadsafe(task.cancel)
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    
+    async def _write_behind_loop(self):
+        while True:
+            await asyncio.sleep(config.WRITE_BEHIND_INTERVAL)
+            await self._maybe_flush_write_behind()
+    
+    async def _maybe_flush_write_behind(self):
+        """Периодическая запись отложенных изменений (не чаще WRITE_BEHIND_INTERVAL)"""
+        if time.monotonic() - self._last_flush < config.WRITE_BEHIND_INTERVAL:
+            return
+        try:
+            await self.flush_write_behind()
+        except Exception as e:
+            print(f"⚠️ Ошибка отложенной записи в БД: {e}")
+    
+    def _queue_user_update(self, user_id: int, **values):
+        with self._write_behind_lock:
+            self._pending_user_updates.setdefault(user_id, {}).update(values)
+    
+    def _cache_user(self, user: User):
+        self._user_cache[user.id] = (user, time.monotonic() + config.USER_CACHE_TTL)
+    
+    def _get_cached_user(self, user_id: int) -> Optional[User]:
+        entry = self._user_cache.get(user_id)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            self._user_cache.pop(user_id, None)
+            return None
+        return entry[0]
+    
+    def invalidate_user(self, user_id: int):
+        """Сбросить пользователя из кэша (после изменения его данных в БД)"""
+        self._user_cache.pop(user_id, None)
+    
     # ========== ПОЛЬЗОВАТЕЛИ ==========
     
     async def get_or_create_user(self, user_id: int, tg_user_or_username: any = None, 
@@ -59,46 +411,69 @@ class DatabaseManager:
         else:
             username = tg_user_or_username
 
+        # Обновление last_active и профиля копится и пишется пачкой
+        changes = {'last_active': datetime.utcnow()}
+        if username: changes['username'] = username
+        if first_name: changes['first_name'] = first_name
+        if last_name: changes['last_name'] = last_name
+        
+        # Горячий путь: пользователь в кэше - без обращения к БД
+        user = self._get_cached_user(user_id)
+        if user is not None:
+            for field, value in changes.items():
+                setattr(user, field, value)
+            self._queue_user_update(user_id, **changes)
+            await self._maybe_flush_write_behind()
+            return user
+
         async with self.async_session() as session:
             result = await session.execute(select(User).where(User.id == user_id))
             user = result.scalar_one_or_none()
-            
-            if not user:
-                user = User(
+        
+        if not user:
+            async def _write(session):
+                # Пользователь мог появиться, пока запись ждала в очереди
+                existing = await session.get(User, user_id)
+                if existing:
+                    return existing, False
+                new_user = User(
                     id=user_id,
                     username=username,
                     first_name=first_name,
                     last_name=last_name
                 )
-                session.add(user)
-                await session.commit()
-                await session.refresh(user)
-                print(f"✅ Создан новый пользователь: {user_id}")
-            else:
-                # Обновляем last_active
-                user.last_active = datetime.utcnow()
-                # Также обновляем информацию о пользователе, если она изменилась
-                if username: user.username = username
-                if first_name: user.first_name = first_name
-                if last_name: user.last_name = last_name
-                await session.commit()
+                session.add(new_user)
+                await session.flush()
+                return new_user, True
             
-            return user
+            user, created = await self.run_write(_write)
+            if created:
+                print(f"✅ Создан новый пользователь: {user_id}")
+        else:
+            # Обновляем last_active и информацию о пользователе (отложенно)
+            for field, value in changes.items():
+                setattr(user, field, value)
+            self._queue_user_update(user_id, **changes)
+        
+        self._cache_user(user)
+        await self._maybe_flush_write_behind()
+        return user
     
     # ========== ПЛЕЙЛИСТЫ ==========
     
     async def create_playlist(self, user_id: int, name: str, description: str = None) -> Playlist:
         """Создать новый плейлист"""
-        async with self.async_session() as session:
+        async def _write(session):
             playlist = Playlist(
                 user_id=user_id,
                 name=name,
                 description=description
             )
             session.add(playlist)
-            await session.commit()
-            await session.refresh(playlist)
+            await session.flush()
             return playlist
+
+        return await self.run_write(_write)
     
     async def get_user_playlists(self, user_id: int) -> List[Playlist]:
         """Получить все плейлисты пользователя"""
@@ -110,6 +485,31 @@ class DatabaseManager:
             )
             return list(result.scalars().all())
     
+    async def get_user_playlists_with_counts(self, user_id: int) -> List[Tuple[Playlist, int, Optional[datetime]]]:
+        """
+        Плейлисты пользователя с числом треков одним сгруппированным запросом
+        
+        Returns:
+            Список (плейлист, количество треков, время последнего добавления трека)
+        """
+        async with self.async_session() as session:
+            counts = (
+                select(
+                    PlaylistTrack.playlist_id.label('playlist_id'),
+                    func.count(PlaylistTrack.id).label('track_count'),
+                    func.max(PlaylistTrack.added_at).label('last_added_at'),
+                )
+                .group_by(PlaylistTrack.playlist_id)
+                .subquery()
+            )
+            result = await session.execute(
+                select(Playlist, func.coalesce(counts.c.track_count, 0), counts.c.last_added_at)
+                .outerjoin(counts, counts.c.playlist_id == Playlist.id)
+                .where(Playlist.user_id == user_id)
+                .order_by(Playlist.created_at.desc())
+            )
+            return [(playlist, count, last_added_at) for playlist, count, last_added_at in result.all()]
+    
     async def get_playlist(self, playlist_id: int) -> Optional[Playlist]:
         """Получить плейлист по ID"""
         async with self.async_session() as session:
@@ -118,27 +518,38 @@ class DatabaseManager:
     
     async def delete_playlist(self, playlist_id: int) -> bool:
         """Удалить плейлист"""
-        async with self.async_session() as session:
+        async def _write(session):
             result = await session.execute(delete(Playlist).where(Playlist.id == playlist_id))
-            await session.commit()
             return result.rowcount > 0
+
+        return await self.run_write(_write)
     
     # ========== ТРЕКИ ==========
     
     async def get_or_create_track(self, track_data: dict) -> Track:
         """Получить или создать трек"""
+        track_id = track_data['id']
         async with self.async_session() as session:
-            track_id = track_data['id']
             result = await session.execute(select(Track).where(Track.id == track_id))
             track = result.scalar_one_or_none()
-            
-            if not track:
-                track = Track(**track_data)
-                session.add(track)
-                await session.commit()
-                await session.refresh(track)
-            
+        if track:
             return track
+        
+        async def _write(session):
+            # Трек мог появиться, пока запись ждала в очереди
+            existing = await session.get(Track, track_id)
+            if existing:
+                return existing
+            new_track = Track(**track_data)
+            session.add(new_track)
+            await session.flush()
+            return new_track
+
+        return await self.run_write(_write)
+    
+    async def get_or_create_tracks(self, tracks_data: List[dict]):
+        """Создать недостающие треки одной транзакцией (существующие не меняются)"""
+        await self.upsert_tracks(tracks_data, update_existing=False)
     
     async def get_track(self, track_id: str) -> Optional[Track]:
         """Получить трек по ID"""
@@ -150,7 +561,7 @@ class DatabaseManager:
     
     async def add_track_to_playlist(self, playlist_id: int, track_id: str) -> bool:
         """Добавить трек в плейлист"""
-        async with self.async_session() as session:
+        async def _write(session):
             # Проверяем, не добавлен ли уже трек
             result = await session.execute(
                 select(PlaylistTrack)
@@ -185,8 +596,9 @@ class DatabaseManager:
             if playlist:
                 playlist.updated_at = datetime.utcnow()
             
-            await session.commit()
             return True
+
+        return await self.run_write(_write)
     
     async def get_playlist_tracks(self, playlist_id: int) -> List[Track]:
         """Получить все треки плейлиста"""
@@ -199,94 +611,135 @@ class DatabaseManager:
             )
             return list(result.scalars().all())
     
+    async def get_playlist_tracks_page(self, playlist_id: int, limit: int = 10, cursor: str = None):
+        """
+        Страница треков плейлиста в порядке позиций
+        
+        Returns:
+            (треки, next_cursor, prev_cursor)
+        """
+        rows, next_cursor, prev_cursor = await self._keyset_page(
+            select(Track)
+            .join(PlaylistTrack)
+            .where(PlaylistTrack.playlist_id == playlist_id),
+            PlaylistTrack.position, PlaylistTrack.id, limit, cursor, descending=False
+        )
+        return [track for (track,) in rows], next_cursor, prev_cursor
+    
     async def remove_track_from_playlist(self, playlist_id: int, track_id: str) -> bool:
         """Удалить трек из плейлиста"""
-        async with self.async_session() as session:
+        async def _write(session):
             result = await session.execute(
                 delete(PlaylistTrack)
                 .where(PlaylistTrack.playlist_id == playlist_id)
                 .where(PlaylistTrack.track_id == track_id)
             )
-            await session.commit()
             return result.rowcount > 0
+
+        return await self.run_write(_write)
     
     async def get_playlist_track_count(self, playlist_id: int) -> int:
         """Получить количество треков в плейлисте"""
         async with self.async_session() as session:
             result = await session.execute(
-                select(PlaylistTrack)
+                select(func.count(PlaylistTrack.id))
                 .where(PlaylistTrack.playlist_id == playlist_id)
             )
-            return len(list(result.scalars().all()))
+            return result.scalar() or 0
     
     # ========== ИСТОРИЯ СКАЧИВАНИЙ (Функция 5) ==========
     
     async def add_download_to_history(self, user_id: int, track_id: str, quality: str = '192', file_size: int = 0):
-        """Добавить запись в историю скачиваний"""
-        async with self.async_session() as session:
-            history_entry = DownloadHistory(
-                user_id=user_id,
-                track_id=track_id,
-                quality=quality,
-                file_size_mb=file_size // (1024 * 1024)  # Конвертируем в MB
-            )
-            session.add(history_entry)
-            
-            # Обновляем статистику пользователя
-            user_result = await session.execute(select(User).where(User.id == user_id))
-            user = user_result.scalar_one_or_none()
-            if user:
-                user.total_downloads += 1
-                user.total_size_mb += file_size // (1024 * 1024)
-            
-            # Обновляем счётчик скачиваний трека
-            track_result = await session.execute(select(Track).where(Track.id == track_id))
-            track = track_result.scalar_one_or_none()
-            if track:
-                track.download_count += 1
-            
-            await session.commit()
+        """
+        Добавить запись в историю скачиваний.
+        Запись и счетчики пользователя/трека пишутся отложенно пачкой (flush_write_behind).
+        """
+        with self._write_behind_lock:
+            self._pending_history.append({
+                'user_id': user_id,
+                'track_id': track_id,
+                'quality': quality,
+                'file_size_mb': file_size // (1024 * 1024),  # Конвертируем в MB
+                'downloaded_at': datetime.utcnow()
+            })
+            batch_full = len(self._pending_history) >= config.HISTORY_BATCH_SIZE
+        
+        if batch_full:
+            try:
+                await self.flush_write_behind()
+            except Exception as e:
+                print(f"⚠️ Ошибка записи истории скачиваний: {e}")
+        else:
+            await self._maybe_flush_write_behind()
+    
+    async def _flush_pending_history(self):
+        """Записать отложенную историю перед чтением, чтобы пользователь видел свежие данные"""
+        if self._pending_history:
+            try:
+                await self.flush_write_behind()
+            except Exception as e:
+                print(f"⚠️ Ошибка записи истории скачиваний: {e}")
     
     async def get_download_history(self, user_id: int, limit: int = 10):
         """Получить историю скачиваний пользователя"""
+        history, _, _ = await self.get_download_history_page(user_id, limit=limit)
+        return history
+    
+    async def get_download_history_page(self, user_id: int, limit: int = 10, cursor: str = None):
+        """
+        Страница истории скачиваний (новые сверху)
+        
+        Returns:
+            (записи, next_cursor, prev_cursor)
+        """
+        await self._flush_pending_history()
+        rows, next_cursor, prev_cursor = await self._keyset_page(
+            select(DownloadHistory, Track)
+            .join(Track, DownloadHistory.track_id == Track.id)
+            .where(DownloadHistory.user_id == user_id),
+            DownloadHistory.downloaded_at, DownloadHistory.id, limit, cursor
+        )
+        
+        history = []
+        for download, track in rows:
+            history.append({
+                'track': {
+                    'id': track.id,
+                    'name': track.name,
+                    'artist': track.artist,
+                    'spotify_url': track.spotify_url
+                },
+                'downloaded_at': download.downloaded_at,
+                'quality': download.quality,
+                'file_size_mb': download.file_size_mb
+            })
+        
+        return history, next_cursor, prev_cursor
+    
+    async def count_download_history(self, user_id: int) -> int:
+        """Количество записей в истории пользователя"""
+        await self._flush_pending_history()
         async with self.async_session() as session:
             result = await session.execute(
-                select(DownloadHistory, Track)
-                .join(Track, DownloadHistory.track_id == Track.id)
-                .where(DownloadHistory.user_id == user_id)
-                .order_by(DownloadHistory.downloaded_at.desc())
-                .limit(limit)
+                select(func.count(DownloadHistory.id)).where(DownloadHistory.user_id == user_id)
             )
-            
-            history = []
-            for download, track in result.all():
-                history.append({
-                    'track': {
-                        'id': track.id,
-                        'name': track.name,
-                        'artist': track.artist,
-                        'spotify_url': track.spotify_url
-                    },
-                    'downloaded_at': download.downloaded_at,
-                    'quality': download.quality,
-                    'file_size_mb': download.file_size_mb
-                })
-            
-            return history
+            return result.scalar() or 0
     
     async def clear_download_history(self, user_id: int):
         """Очистить историю скачиваний пользователя"""
-        async with self.async_session() as session:
+        await self._flush_pending_history()
+        async def _write(session):
             await session.execute(
                 delete(DownloadHistory).where(DownloadHistory.user_id == user_id)
             )
-            await session.commit()
+
+        return await self.run_write(_write)
     
     # ========== ИЗБРАННОЕ (Функция 8) ==========
     
     async def add_to_favorites(self, user_id: int, track_id: str):
         """Добавить трек в избранное"""
-        async with self.async_session() as session:
+        async def _write(session):
             # Проверяем, не добавлен ли уже
             result = await session.execute(
                 select(Favorite)
@@ -300,19 +753,21 @@ class DatabaseManager:
             
             favorite = Favorite(user_id=user_id, track_id=track_id)
             session.add(favorite)
-            await session.commit()
             return True
+
+        return await self.run_write(_write)
     
     async def remove_from_favorites(self, user_id: int, track_id: str):
         """Удалить трек из избранного"""
-        async with self.async_session() as session:
+        async def _write(session):
             result = await session.execute(
                 delete(Favorite)
                 .where(Favorite.user_id == user_id)
                 .where(Favorite.track_id == track_id)
             )
-            await session.commit()
             return result.rowcount > 0
+
+        return await self.run_write(_write)
     
     async def get_favorites(self, user_id: int):
         """Получить избранные треки пользователя"""
@@ -323,21 +778,43 @@ class DatabaseManager:
                 .where(Favorite.user_id == user_id)
                 .order_by(Favorite.added_at.desc())
             )
-            
-            favorites = []
-            for fav, track in result.all():
-                favorites.append({
-                    'track': {
-                        'id': track.id,
-                        'name': track.name,
-                        'artist': track.artist,
-                        'spotify_url': track.spotify_url,
-                        'image_url': track.image_url
-                    },
-                    'added_at': fav.added_at
-                })
-            
-            return favorites
+            return [self._favorite_dict(fav, track) for fav, track in result.all()]
+    
+    async def get_favorites_page(self, user_id: int, limit: int = 10, cursor: str = None):
+        """
+        Страница избранного (новые сверху)
+        
+        Returns:
+            (записи, next_cursor, prev_cursor)
+        """
+        rows, next_cursor, prev_cursor = await self._keyset_page(
+            select(Favorite, Track)
+            .join(Track, Favorite.track_id == Track.id)
+            .where(Favorite.user_id == user_id),
+            Favorite.added_at, Favorite.id, limit, cursor
+        )
+        return [self._favorite_dict(fav, track) for fav, track in rows], next_cursor, prev_cursor
+    
+    async def count_favorites(self, user_id: int) -> int:
+        """Количество избранных треков пользователя"""
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(func.count(Favorite.id)).where(Favorite.user_id == user_id)
+            )
+            return result.scalar() or 0
+    
+    @staticmethod
+    def _favorite_dict(fav: Favorite, track: Track) -> dict:
+        return {
+            'track': {
+                'id': track.id,
+                'name': track.name,
+                'artist': track.artist,
+                'spotify_url': track.spotify_url,
+                'image_url': track.image_url
+            },
+            'added_at': fav.added_at
+        }
     
     async def is_favorite(self, user_id: int, track_id: str) -> bool:
         """Проверить, находится ли трек в избранном"""
@@ -353,18 +830,24 @@ class DatabaseManager:
     
     async def update_user_setting(self, user_id: int, setting_name: str, value):
         """Обновить настройку пользователя"""
-        async with self.async_session() as session:
+        async def _write(session):
             result = await session.execute(select(User).where(User.id == user_id))
             user = result.scalar_one_or_none()
-            
-            if user:
-                setattr(user, setting_name, value)
-                await session.commit()
-                return True
-            return False
+            if not user:
+                return False
+            setattr(user, setting_name, value)
+            return True
+
+        updated = await self.run_write(_write)
+        if updated:
+            self.invalidate_user(user_id)
+        return updated
     
     async def get_user_quality(self, user_id: int) -> str:
         """Получить предпочитаемое качество пользователя"""
+        user = self._get_cached_user(user_id)
+        if user is not None:
+            return user.preferred_quality
         async with self.async_session() as session:
             result = await session.execute(select(User).where(User.id == user_id))
             user = result.scalar_one_or_none()
@@ -372,6 +855,7 @@ class DatabaseManager:
     
     async def get_user_stats(self, user_id: int):
         """Получить статистику пользователя"""
+        await self._flush_pending_history()
         async with self.async_session() as session:
             result = await session.execute(select(User).where(User.id == user_id))
             user = result.scalar_one_or_none()
@@ -391,8 +875,18 @@ class DatabaseManager:
     async def update_track_cache(self, track_id: str, telegram_file_id: str, 
                                  file_format: str = 'mp3', quality: str = '192'):
         """Обновить кэш трека (сохранить telegram_file_id в TrackCache)"""
+        await self.upsert_track_caches([{
+            'track_id': track_id,
+            'telegram_file_id': telegram_file_id,
+            'file_format': file_format,
+            'quality': quality,
+        }])
+        return True
+    
+    async def get_cached_file_id(self, track_id: str, file_format: str = 'mp3', 
+                                 quality: str = '192') -> Optional[str]:
+        """Получить telegram_file_id из кэша для конкретного формата и качества"""
         async with self.async_session() as session:
-            # Проверяем, есть ли уже такой кэш (чтобы не дублировать)
             result = await session.execute(
                 select(TrackCache)
                 .where(TrackCache.track_id == track_id)
@@ -400,53 +894,108 @@ class DatabaseManager:
                 .where(TrackCache.quality == quality)
             )
             cache_entry = result.scalars().first()
-            
-            if cache_entry:
-                cache_entry.telegram_file_id = telegram_file_id
-                cache_entry.created_at = datetime.utcnow()
-            else:
-                cache_entry = TrackCache(
-                    track_id=track_id,
-                    telegram_file_id=telegram_file_id,
-                    file_format=file_format,
-                    quality=quality
-                )
-                session.add(cache_entry)
-            
-            # Также обновляем время кэширования в основном треке для статистики
-            track_result = await session.execute(select(Track).where(Track.id == track_id))
-            track = track_result.scalar_one_or_none()
-            if track:
-                track.telegram_file_id = telegram_file_id # Совместимость со старым кодом
-                track.cached_at = datetime.utcnow()
+        
+        if cache_entry and self._is_file_id_servable(cache_entry):
+            return cache_entry.telegram_file_id
+        return None
 
-            await session.commit()
-            return True
-    
-    async def get_cached_file_id(self, track_id: str, file_format: str = 'mp3', 
-                                 quality: str = '192') -> Optional[str]:
-        """Получить telegram_file_id из кэша для конкретного формата и качества"""
+    async def get_cached_file_ids(self, track_ids: List[str], file_format: str = 'mp3',
+                                  quality: str = '192') -> Dict[str, str]:
+        """Получить telegram_file_id из кэша сразу для многих треков (один запрос)"""
+        if not track_ids:
+            return {}
         async with self.async_session() as session:
             result = await session.execute(
                 select(TrackCache)
-                .where(TrackCache.track_id == track_id)
+                .where(TrackCache.track_id.in_(list(set(track_ids))))
                 .where(TrackCache.file_format == file_format)
                 .where(TrackCache.quality == quality)
             )
-            cache_entry = result.scalars().first()
-            
-            if cache_entry:
-                # Проверяем, не устарел ли кэш (7 дней)
-                age = (datetime.utcnow() - cache_entry.created_at).days
-                if age < 7:
-                    return cache_entry.telegram_file_id
-                else:
-                    # Удаляем устаревший кэш
-                    await session.delete(cache_entry)
-                    await session.commit()
-            
-            return None
+            entries = result.scalars().all()
+        return {entry.track_id: entry.telegram_file_id for entry in entries if self._is_file_id_servable(entry)}
+    
+    # ========== ПРОВЕРКА FILE_ID (stale-while-revalidate) ==========
+    
+    def _is_file_id_servable(self, entry: TrackCache) -> bool:
+        """
+        Можно ли отдать file_id из кэша. Старые записи отдаются сразу,
+        а их проверка через getFile запускается в фоне.
+        """
+        file_id = entry.telegram_file_id
+        dead_until = self._dead_file_ids.get(file_id)
+        if dead_until is not None:
+            if dead_until > time.monotonic():
+                return False
+            self._dead_file_ids.pop(file_id, None)
+        
+        age = datetime.utcnow() - (entry.created_at or datetime.utcnow())
+        if config.FILE_ID_MAX_AGE_DAYS and age > timedelta(days=config.FILE_ID_MAX_AGE_DAYS):
+            return False
+        if age > timedelta(days=config.FILE_ID_REVALIDATE_DAYS):
+            self.schedule_file_id_revalidation(file_id)
+        return True
+    
+    def schedule_file_id_revalidation(self, file_id: str):
+        """Проверить file_id в фоне (например, после ошибки отправки из кэша)"""
+        if self.file_id_validator is None or file_id in self._revalidating:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._revalidating.add(file_id)
+        task = loop.create_task(self._revalidate_file_id(file_id))
+        self._revalidate_tasks.add(task)
+        task.add_done_callback(self._revalidate_tasks.discard)
+    
+    async def _revalidate_file_id(self, file_id: str):
+        try:
+            async with self._revalidate_semaphore:
+                alive = await self.file_id_validator(file_id)
+            if alive is None:
+                # Сеть или лимиты Telegram - проверим при следующем обращении
+                return
+            if alive:
+                # Продлеваем запись, чтобы не проверять ее при каждом запросе
+                async def _write(session):
+                    await session.execute(
+                        update(TrackCache).where(TrackCache.telegram_file_id == file_id)
+                        .values(created_at=datetime.utcnow())
+                    )
+                await self.run_write(_write)
+            else:
+                self.mark_file_id_dead(file_id)
+                async def _write(session):
+                    await session.execute(delete(TrackCache).where(TrackCache.telegram_file_id == file_id))
+                    await session.execute(delete(TelegramFilePath).where(TelegramFilePath.file_id == file_id))
+                    await session.execute(
+                        update(Track).where(Track.telegram_file_id == file_id).values(telegram_file_id=None)
+                    )
+                await self.run_write(_write)
+                print(f"🗑️ Dead file_id removed from cache: {file_id[:20]}...")
+        except Exception as e:
+            print(f"⚠️ Ошибка проверки file_id: {e}")
+        finally:
+            self._revalidating.discard(file_id)
+    
+    def mark_file_id_dead(self, file_id: str):
+        """Не отдавать file_id из кэша в течение FILE_ID_NEGATIVE_TTL"""
+        self._dead_file_ids[file_id] = time.monotonic() + config.FILE_ID_NEGATIVE_TTL
+        self._file_paths.pop(file_id, None)
 
+    async def get_library_tracks_page(self, limit: int = 100, cursor: str = None):
+        """
+        Страница библиотеки канала (последние загруженные сверху)
+        
+        Returns:
+            (треки, next_cursor, prev_cursor)
+        """
+        rows, next_cursor, prev_cursor = await self._keyset_page(
+            select(Track).join(TelegramFile, Track.id == TelegramFile.track_id),
+            TelegramFile.uploaded_at, TelegramFile.track_id, limit, cursor
+        )
+        return [track for (track,) in rows], next_cursor, prev_cursor
+    
     async def get_library_tracks(self, limit: int = 500) -> List[Track]:
         """Получить все треки, которые есть в Telegram Storage (библиотека канала)"""
         async with self.async_session() as session:
@@ -458,12 +1007,383 @@ class DatabaseManager:
                 .limit(limit)
             )
             return list(result.scalars().all())
+    
+    async def get_library_tracks_since(self, since: datetime, limit: int = 100) -> Tuple[List[Track], bool]:
+        """
+        Треки библиотеки, загруженные после since (последние сверху)
+        
+        Returns:
+            (треки, есть_еще) - если есть еще, дельта неполная и клиенту проще перечитать список
+        """
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(Track)
+                .join(TelegramFile, Track.id == TelegramFile.track_id)
+                .where(TelegramFile.uploaded_at > since)
+                .order_by(TelegramFile.uploaded_at.desc(), TelegramFile.track_id.desc())
+                .limit(limit + 1)
+            )
+            tracks = list(result.scalars().all())
+        return tracks[:limit], len(tracks) > limit
+    
+    async def get_library_version(self) -> Tuple[Optional[datetime], int]:
+        """
+        Версия библиотеки: (последний uploaded_at, число файлов).
+        Меняется при каждой загрузке, перезаливке и удалении; держится в памяти
+        LIBRARY_VERSION_TTL секунд, записи этого процесса сбрасывают ее сразу.
+        """
+        now = time.monotonic()
+        if self._library_version is not None and now - self._library_version_at < config.LIBRARY_VERSION_TTL:
+            return self._library_version
+        async with self.async_session() as session:
+            latest, count = (await session.execute(
+                select(func.max(TelegramFile.uploaded_at), func.count(TelegramFile.track_id))
+            )).one()
+        self._library_version, self._library_version_at = (latest, count), now
+        return self._library_version
+    
+    def invalidate_library_version(self):
+        """Библиотека изменилась в этом процессе"""
+        self._library_version = None
 
+    # ========== ПОИСК ПО КАТАЛОГУ ==========
+    
+    @staticmethod
+    def _search_terms(query: str) -> List[str]:
+        """Слова запроса без служебных символов FTS5"""
+        return re.findall(r'\w+', query.lower())[:SEARCH_MAX_TERMS]
+    
+    async def search_catalog(self, query: str, limit: int = 10,
+                             file_format: Optional[str] = None,
+                             quality: Optional[str] = None) -> List[Dict]:
+        """
+        Поиск треков по исполнителю, названию и альбому в собственном каталоге.
+        На SQLite - FTS5 с ранжированием bm25 и поиском по началу слов,
+        на других СУБД - ILIKE по всем словам.
+        
+        Поле cached у результата означает, что трек можно отправить сразу
+        из Telegram: для file_format/quality, если они заданы, иначе - в любом формате.
+        """
+        terms = self._search_terms(query)
+        if not terms:
+            return []
+        
+        async with self.async_session() as session:
+            if self.is_sqlite:
+                # Каждое слово - префиксный запрос в кавычках, слова через AND
+                match = ' '.join(f'"{term}"*' for term in terms)
+                result = await session.execute(text(
+                    "SELECT t.id, t.name, t.artist, t.album, t.duration_ms, t.image_url, "
+                    "COALESCE(f.file_id, t.telegram_file_id) "
+                    "FROM catalog_fts "
+                    "JOIN catalog_rowids k ON k.id = catalog_fts.rowid "
+                    "JOIN tracks t ON t.id = k.track_id "
+                    "LEFT JOIN telegram_files f ON f.track_id = t.id "
+                    "WHERE catalog_fts MATCH :match "
+                    # Веса колонок: artist, name, album, extra
+                    "ORDER BY bm25(catalog_fts, 3.0, 4.0, 1.0, 1.0) "
+                    "LIMIT :limit"
+                ), {'match': match, 'limit': limit})
+            else:
+                conditions = [
+                    or_(Track.artist.ilike(f"%{term}%"),
+                        Track.name.ilike(f"%{term}%"),
+                        Track.album.ilike(f"%{term}%"))
+                    for term in terms
+                ]
+                result = await session.execute(
+                    select(Track.id, Track.name, Track.artist, Track.album, Track.duration_ms,
+                           Track.image_url, func.coalesce(TelegramFile.file_id, Track.telegram_file_id))
+                    .outerjoin(TelegramFile, TelegramFile.track_id == Track.id)
+                    .where(and_(*conditions))
+                    .order_by(Track.download_count.desc(), Track.id)
+                    .limit(limit)
+                )
+            rows = result.all()
+        
+        tracks = [{
+            'id': row[0],
+            'name': row[1],
+            'artist': row[2],
+            'album': row[3],
+            'duration_ms': row[4] or 0,
+            'image_url': row[5],
+            'cached': bool(row[6]) and row[6] not in self._dead_file_ids,
+        } for row in rows]
+        
+        if file_format and quality and tracks:
+            cached = await self.get_cached_file_ids([t['id'] for t in tracks], file_format=file_format, quality=quality)
+            for track in tracks:
+                track['cached'] = track['id'] in cached
+        return tracks
+    
+    # ========== ПАКЕТНЫЕ ОПЕРАЦИИ ==========
+    
+    def _insert(self, model):
+        """INSERT с поддержкой ON CONFLICT для диалекта текущей БД"""
+        if self.engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        return dialect_insert(model)
+    
+    async def upsert_tracks(self, tracks_data: List[dict], update_existing: bool = True):
+        """
+        Вставить или обновить много треков одной транзакцией (INSERT ... ON CONFLICT)
+        
+        Args:
+            tracks_data: Словари с полями модели Track (id, name, artist, spotify_url, ...)
+            update_existing: Обновлять метаданные существующих треков (счетчики не трогаются)
+        """
+        rows = list({t['id']: self._track_row(t) for t in tracks_data}.values())
+        if not rows:
+            return
+        async def _write(session):
+            for start in range(0, len(rows), BULK_CHUNK):
+                stmt = self._insert(Track).values(rows[start:start + BULK_CHUNK])
+                if update_existing:
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[Track.id],
+                        set_={
+                            'name': stmt.excluded.name,
+                            'artist': stmt.excluded.artist,
+                            'album': func.coalesce(stmt.excluded.album, Track.album),
+                            'image_url': func.coalesce(stmt.excluded.image_url, Track.image_url),
+                            'duration_ms': func.coalesce(stmt.excluded.duration_ms, Track.duration_ms),
+                        }
+                    )
+                else:
+                    stmt = stmt.on_conflict_do_nothing(index_elements=[Track.id])
+                await session.execute(stmt)
+
+        return await self.run_write(_write)
+    
+    @staticmethod
+    def _track_row(track_data: dict) -> dict:
+        """Строка для многострочного INSERT: у всех строк одинаковый набор колонок"""
+        return {
+            'id': track_data['id'],
+            'name': track_data.get('name') or '',
+            'artist': track_data.get('artist') or '',
+            'album': track_data.get('album'),
+            'duration_ms': track_data.get('duration_ms'),
+            'spotify_url': track_data.get('spotify_url') or f"https://open.spotify.com/track/{track_data['id']}",
+            'image_url': track_data.get('image_url'),
+            'created_at': datetime.utcnow(),
+            'download_count': 0,
+        }
+    
+    async def upsert_track_caches(self, entries: List[dict]):
+        """
+        Сохранить много file_id в TrackCache одной транзакцией
+        
+        Args:
+            entries: Словари track_id, telegram_file_id, file_format, quality
+        """
+        if not entries:
+            return
+        now = datetime.utcnow()
+        rows = list({
+            (e['track_id'], e['file_format'], e['quality']): {
+                'track_id': e['track_id'],
+                'telegram_file_id': e['telegram_file_id'],
+                'file_format': e['file_format'],
+                'quality': e['quality'],
+                'created_at': now,
+            }
+            for e in entries
+        }.values())
+        async def _write(session):
+            for start in range(0, len(rows), BULK_CHUNK):
+                stmt = self._insert(TrackCache).values(rows[start:start + BULK_CHUNK])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[TrackCache.track_id, TrackCache.file_format, TrackCache.quality],
+                    set_={
+                        'telegram_file_id': stmt.excluded.telegram_file_id,
+                        'created_at': stmt.excluded.created_at,
+                    }
+                )
+                await session.execute(stmt)
+            # Совместимость со старым кодом: последний file_id и время кэширования в самом треке
+            for row in rows:
+                await session.execute(
+                    update(Track).where(Track.id == row['track_id'])
+                    .values(telegram_file_id=row['telegram_file_id'], cached_at=now)
+                )
+
+        return await self.run_write(_write)
+    
+    async def upsert_telegram_files(self, entries: List[dict], overwrite: bool = True):
+        """
+        Сохранить много файлов Telegram Storage одной транзакцией
+        
+        Args:
+            entries: Словари track_id, file_id и необязательные file_path, file_size, artist, track_name
+            overwrite: Перезаписывать существующие записи (иначе только добавлять новые)
+        """
+        if not entries:
+            return
+        rows = list({
+            e['track_id']: {
+                'track_id': e['track_id'],
+                'file_id': e['file_id'],
+                'telegram_file_path': e.get('file_path'),
+                'file_size': e.get('file_size'),
+                'artist': e.get('artist'),
+                'track_name': e.get('track_name'),
+                'uploaded_at': e.get('uploaded_at') or datetime.utcnow(),
+            }
+            for e in entries
+        }.values())
+        async def _write(session):
+            for start in range(0, len(rows), BULK_CHUNK):
+                stmt = self._insert(TelegramFile).values(rows[start:start + BULK_CHUNK])
+                if overwrite:
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[TelegramFile.track_id],
+                        set_={
+                            'file_id': stmt.excluded.file_id,
+                            'telegram_file_path': stmt.excluded.telegram_file_path,
+                            'file_size': stmt.excluded.file_size,
+                            'uploaded_at': stmt.excluded.uploaded_at,
+                            'artist': func.coalesce(stmt.excluded.artist, TelegramFile.artist),
+                            'track_name': func.coalesce(stmt.excluded.track_name, TelegramFile.track_name),
+                        }
+                    )
+                else:
+                    stmt = stmt.on_conflict_do_nothing(index_elements=[TelegramFile.track_id])
+                await session.execute(stmt)
+
+        result = await self.run_write(_write)
+        self.invalidate_library_version()
+        return result
+    
+    async def get_telegram_file_ids(self, track_ids: List[str]) -> Dict[str, str]:
+        """Получить file_id из Telegram Storage сразу для многих треков (один запрос)"""
+        if not track_ids:
+            return {}
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(TelegramFile.track_id, TelegramFile.file_id)
+                .where(TelegramFile.track_id.in_(list(set(track_ids))))
+            )
+            return {track_id: file_id for track_id, file_id in result.all()}
+    
+    async def delete_telegram_files(self, track_ids: List[str]) -> int:
+        """Удалить записи Telegram Storage для списка треков"""
+        if not track_ids:
+            return 0
+        async def _write(session):
+            result = await session.execute(
+                delete(TelegramFile).where(TelegramFile.track_id.in_(list(set(track_ids))))
+            )
+            return result.rowcount
+
+        deleted = await self.run_write(_write)
+        self.invalidate_library_version()
+        return deleted
+    
+    # ========== YOUTUBE MATCH CACHE ==========
+    
+    async def get_youtube_match(self, match_keys: List[str]) -> Optional[YouTubeMatch]:
+        """Найти сохраненное видео YouTube по первому подходящему ключу"""
+        if not match_keys:
+            return None
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(YouTubeMatch).where(YouTubeMatch.match_key.in_(match_keys))
+            )
+            matches = {m.match_key: m for m in result.scalars().all()}
+            for key in match_keys:
+                if key in matches:
+                    return matches[key]
+            return None
+    
+    async def save_youtube_match(self, match_keys: List[str], video_id: str,
+                                 title: str = None, duration: int = None):
+        """Сохранить найденное видео YouTube для всех ключей трека"""
+        async def _write(session):
+            now = datetime.utcnow()
+            for key in match_keys:
+                match = await session.get(YouTubeMatch, key)
+                if match:
+                    match.video_id = video_id
+                    match.title = title
+                    match.duration = duration
+                    match.last_used_at = now
+                else:
+                    session.add(YouTubeMatch(
+                        match_key=key,
+                        video_id=video_id,
+                        title=title,
+                        duration=duration
+                    ))
+
+        await self.run_write(_write)
+    
+    async def delete_youtube_match(self, video_id: str):
+        """Удалить все соответствия с недоступным видео"""
+        async def _write(session):
+            await session.execute(
+                delete(YouTubeMatch).where(YouTubeMatch.video_id == video_id)
+            )
+
+        await self.run_write(_write)
+
+    # ========== ПУТИ ФАЙЛОВ TELEGRAM (getFile) ==========
+    
+    async def get_telegram_file_path(self, file_id: str) -> Optional[str]:
+        """
+        Путь файла из кэша getFile: сначала память процесса, затем общая
+        для всех процессов таблица. Истекшие записи не отдаются.
+        """
+        now = datetime.utcnow()
+        entry = self._file_paths.get(file_id)
+        if entry is not None:
+            if entry[1] > now:
+                return entry[0]
+            self._file_paths.pop(file_id, None)
+        
+        async with self.async_session() as session:
+            cached = await session.get(TelegramFilePath, file_id)
+        if cached is None or cached.expires_at <= now:
+            return None
+        self._remember_file_path(file_id, cached.file_path, cached.expires_at)
+        return cached.file_path
+    
+    async def save_telegram_file_path(self, file_id: str, file_path: str, ttl: int = None):
+        """Запомнить ответ getFile на ttl секунд (по умолчанию TELEGRAM_FILE_PATH_TTL)"""
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=ttl or config.TELEGRAM_FILE_PATH_TTL)
+        self._remember_file_path(file_id, file_path, expires_at)
+        
+        async def _write(session):
+            stmt = self._insert(TelegramFilePath).values(
+                file_id=file_id, file_path=file_path, expires_at=expires_at
+            )
+            await session.execute(stmt.on_conflict_do_update(
+                index_elements=[TelegramFilePath.file_id],
+                set_={'file_path': stmt.excluded.file_path, 'expires_at': stmt.excluded.expires_at}
+            ))
+            # Заодно убираем истекшие записи (по индексу expires_at)
+            await session.execute(delete(TelegramFilePath).where(TelegramFilePath.expires_at <= now))
+        await self.run_write(_write)
+    
+    def _remember_file_path(self, file_id: str, file_path: str, expires_at: datetime):
+        if len(self._file_paths) >= FILE_PATH_MEMORY_LIMIT and file_id not in self._file_paths:
+            now = datetime.utcnow()
+            for key in [k for k, (_, exp) in self._file_paths.items() if exp <= now]:
+                del self._file_paths[key]
+            if len(self._file_paths) >= FILE_PATH_MEMORY_LIMIT:
+                # Самая старая запись (словарь хранит порядок вставки)
+                self._file_paths.pop(next(iter(self._file_paths)))
+        self._file_paths[file_id] = (file_path, expires_at)
+    
     # ========== АУТЕНТИФИКАЦИЯ (WEB) ==========
 
     async def create_auth_token(self, user_id: int, token: str, expires_in_seconds: Optional[int] = None) -> AuthToken:
         """Создать токен для веб-авторизации (постоянный или временный)"""
-        async with self.async_session() as session:
+        async def _write(session):
             # Сначала проверяем, есть ли уже токен у этого пользователя
             result = await session.execute(select(AuthToken).where(AuthToken.user_id == user_id).order_by(AuthToken.created_at.desc()))
             existing_token = result.scalars().first()
@@ -472,10 +1392,8 @@ class DatabaseManager:
                 # Если токен не истек, возвращаем его
                 if not existing_token.expires_at or existing_token.expires_at > datetime.utcnow():
                     return existing_token
-                else:
-                    # Удаляем истекший токен
-                    await session.delete(existing_token)
-                    await session.commit()
+                # Удаляем истекший токен
+                await session.delete(existing_token)
 
             expires_at = None
             if expires_in_seconds:
@@ -487,9 +1405,10 @@ class DatabaseManager:
                 expires_at=expires_at
             )
             session.add(new_token)
-            await session.commit()
             return new_token
 
+        return await self.run_write(_write)
+
     async def verify_auth_token(self, token: str) -> Optional[User]:
         """Проверить токен и вернуть пользователя (без удаления токена)"""
         async with self.async_session() as session:
@@ -501,8 +1420,9 @@ class DatabaseManager:
             if auth_token:
                 # Если у токена есть срок годности, проверяем его
                 if auth_token.expires_at and auth_token.expires_at < datetime.utcnow():
-                    await session.delete(auth_token)
-                    await session.commit()
+                    await self.run_write(
+                        lambda write_session: write_session.execute(delete(AuthToken).where(AuthToken.token == token))
+                    )
                     return None
                     
                 user_result = await session.execute(select(User).where(User.id == auth_token.user_id))
@@ -518,7 +1438,7 @@ class DatabaseManager:
     async def save_telegram_file(self, track_id: str, file_id: str, file_path: str = None, 
                                  file_size: int = None, artist: str = None, track_name: str = None) -> TelegramFile:
         """Сохранить file_id в кеш"""
-        async with self.async_session() as session:
+        async def _write(session):
             # Проверяем, есть ли уже запись
             result = await session.execute(
                 select(TelegramFile).where(TelegramFile.track_id == track_id)
@@ -535,7 +1455,6 @@ class DatabaseManager:
                     existing.artist = artist
                 if track_name:
                     existing.track_name = track_name
-                await session.commit()
                 return existing
             else:
                 # Создаем новую запись
@@ -548,8 +1467,11 @@ class DatabaseManager:
                     track_name=track_name
                 )
                 session.add(telegram_file)
-                await session.commit()
                 return telegram_file
+
+        result = await self.run_write(_write)
+        self.invalidate_library_version()
+        return result
     
     async def get_telegram_file(self, track_id: str) -> Optional[TelegramFile]:
         """Получить file_id из кеша"""
@@ -568,14 +1490,16 @@ class DatabaseManager:
     
     async def save_backup_log(self, message_id: int, file_id: str) -> BackupLog:
         """Сохранить лог бэкапа"""
-        async with self.async_session() as session:
+        async def _write(session):
             log = BackupLog(
                 message_id=message_id,
                 file_id=file_id
             )
             session.add(log)
-            await session.commit()
+            await session.flush()
             return log
+
+        return await self.run_write(_write)
             
     async def get_backup_logs(self, limit: int = 10) -> List[BackupLog]:
         """Получить последние логи бэкапов"""
@@ -587,8 +1511,9 @@ class DatabaseManager:
 
     async def delete_backup_log(self, message_id: int):
         """Удалить лог бэкапа"""
-        async with self.async_session() as session:
+        async def _write(session):
             await session.execute(
                 delete(BackupLog).where(BackupLog.message_id == message_id)
             )
-            await session.commit()
+
+        await self.run_write(_write)
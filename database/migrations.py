@@ -0,0 +1,191 @@
+"""
+Версионные миграции схемы для уже существующих баз данных
+
+create_all создает только отсутствующие таблицы и не меняет существующие,
+поэтому индексы и ограничения для БД, восстановленной из Telegram,
+добавляются здесь. Каждая миграция применяется один раз и записывается
+в таблицу schema_migrations. Новые миграции добавляются в конец MIGRATIONS.
+
+Миграции из SQLITE_ONLY (полнотекстовый индекс FTS5) на других СУБД
+пропускаются и не записываются.
+"""
+from datetime import datetime
+from typing import List, Tuple
+
+from sqlalchemy import text
+
+
+# Текст для колонки extra индекса каталога: метаданные из telegram_files
+_FILE_EXTRA = "COALESCE({row}.artist, '') || ' ' || COALESCE({row}.track_name, '')"
+_TRACK_EXTRA = (
+    "COALESCE((SELECT " + _FILE_EXTRA.format(row="f") +
+    " FROM telegram_files f WHERE f.track_id = new.id), '')"
+)
+# rowid строки индекса каталога для трека (catalog_rowids.id не меняется при VACUUM)
+_CATALOG_ROWID = "(SELECT id FROM catalog_rowids WHERE track_id = {track_id})"
+
+# (версия, описание, SQL-команды). Команды должны быть идемпотентными (IF NOT EXISTS),
+# так как на новой БД те же индексы уже созданы через create_all
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "track_cache: unique (track_id, file_format, quality)", [
+        # Оставляем самую свежую запись для каждой комбинации
+        "DELETE FROM track_cache WHERE id NOT IN ("
+        "SELECT MAX(id) FROM track_cache GROUP BY track_id, file_format, quality)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_track_cache_track_format_quality "
+        "ON track_cache (track_id, file_format, quality)",
+    ]),
+    (2, "download_history: index (user_id, downloaded_at)", [
+        "CREATE INDEX IF NOT EXISTS ix_download_history_user_downloaded "
+        "ON download_history (user_id, downloaded_at)",
+    ]),
+    (3, "favorites: unique (user_id, track_id)", [
+        "DELETE FROM favorites WHERE id NOT IN ("
+        "SELECT MIN(id) FROM favorites GROUP BY user_id, track_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_favorites_user_track "
+        "ON favorites (user_id, track_id)",
+    ]),
+    (4, "playlist_tracks: unique (playlist_id, track_id), index (playlist_id, position)", [
+        "DELETE FROM playlist_tracks WHERE id NOT IN ("
+        "SELECT MIN(id) FROM playlist_tracks GROUP BY playlist_id, track_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_playlist_tracks_playlist_track "
+        "ON playlist_tracks (playlist_id, track_id)",
+        "CREATE INDEX IF NOT EXISTS ix_playlist_tracks_playlist_position "
+        "ON playlist_tracks (playlist_id, position)",
+    ]),
+    (5, "auth_tokens: index (user_id)", [
+        "CREATE INDEX IF NOT EXISTS ix_auth_tokens_user ON auth_tokens (user_id)",
+    ]),
+    (6, "catalog_fts: FTS5 index over tracks and telegram_files", [
+        # rowid строки индекса = rowid трека (ненадежно, см. миграцию 8); prefix ускоряет поиск по началу слова
+        "CREATE VIRTUAL TABLE IF NOT EXISTS catalog_fts USING fts5("
+        "artist, name, album, extra, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+        "CREATE TRIGGER IF NOT EXISTS catalog_fts_tracks_ai AFTER INSERT ON tracks BEGIN "
+        "INSERT INTO catalog_fts (rowid, artist, name, album, extra) "
+        "VALUES (new.rowid, new.artist, new.name, COALESCE(new.album, ''), " + _TRACK_EXTRA + "); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS catalog_fts_tracks_au AFTER UPDATE OF artist, name, album ON tracks BEGIN "
+        "DELETE FROM catalog_fts WHERE rowid = old.rowid; "
+        "INSERT INTO catalog_fts (rowid, artist, name, album, extra) "
+        "VALUES (new.rowid, new.artist, new.name, COALESCE(new.album, ''), " + _TRACK_EXTRA + "); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS catalog_fts_tracks_ad AFTER DELETE ON tracks BEGIN "
+        "DELETE FROM catalog_fts WHERE rowid = old.rowid; "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS catalog_fts_files_ai AFTER INSERT ON telegram_files BEGIN "
+        "UPDATE catalog_fts SET extra = " + _FILE_EXTRA.format(row="new") + " "
+        "WHERE rowid = (SELECT rowid FROM tracks WHERE id = new.track_id); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS catalog_fts_files_au AFTER UPDATE OF artist, track_name ON telegram_files BEGIN "
+        "UPDATE catalog_fts SET extra = " + _FILE_EXTRA.format(row="new") + " "
+        "WHERE rowid = (SELECT rowid FROM tracks WHERE id = new.track_id); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS catalog_fts_files_ad AFTER DELETE ON telegram_files BEGIN "
+        "UPDATE catalog_fts SET extra = '' "
+        "WHERE rowid = (SELECT rowid FROM tracks WHERE id = old.track_id); "
+        "END",
+        # Заполняем индекс уже существующими треками
+        "DELETE FROM catalog_fts",
+        "INSERT INTO catalog_fts (rowid, artist, name, album, extra) "
+        "SELECT t.rowid, t.artist, t.name, COALESCE(t.album, ''), " + _FILE_EXTRA.format(row="f") + " "
+        "FROM tracks t LEFT JOIN telegram_files f ON f.track_id = t.id",
+    ]),
+    (7, "telegram_files: index (uploaded_at, track_id)", [
+        "CREATE INDEX IF NOT EXISTS ix_telegram_files_uploaded "
+        "ON telegram_files (uploaded_at, track_id)",
+    ]),
+    # У tracks строковый первичный ключ, поэтому tracks.rowid - не алиас и VACUUM
+    # может его перенумеровать. Индекс переводится на собственный INTEGER PRIMARY KEY.
+    (8, "catalog_fts: stable rowids via catalog_rowids", [
+        "DROP TRIGGER IF EXISTS catalog_fts_tracks_ai",
+        "DROP TRIGGER IF EXISTS catalog_fts_tracks_au",
+        "DROP TRIGGER IF EXISTS catalog_fts_tracks_ad",
+        "DROP TRIGGER IF EXISTS catalog_fts_files_ai",
+        "DROP TRIGGER IF EXISTS catalog_fts_files_au",
+        "DROP TRIGGER IF EXISTS catalog_fts_files_ad",
+        "DROP TABLE IF EXISTS catalog_fts",
+        "CREATE TABLE IF NOT EXISTS catalog_rowids ("
+        "id INTEGER PRIMARY KEY, "
+        "track_id VARCHAR(255) NOT NULL UNIQUE)",
+        "CREATE VIRTUAL TABLE catalog_fts USING fts5("
+        "artist, name, album, extra, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+        "CREATE TRIGGER catalog_fts_tracks_ai AFTER INSERT ON tracks BEGIN "
+        "INSERT OR IGNORE INTO catalog_rowids (track_id) VALUES (new.id); "
+        "INSERT INTO catalog_fts (rowid, artist, name, album, extra) "
+        "VALUES (" + _CATALOG_ROWID.format(track_id="new.id") + ", "
+        "new.artist, new.name, COALESCE(new.album, ''), " + _TRACK_EXTRA + "); "
+        "END",
+        "CREATE TRIGGER catalog_fts_tracks_au AFTER UPDATE OF id, artist, name, album ON tracks BEGIN "
+        "DELETE FROM catalog_fts WHERE rowid = " + _CATALOG_ROWID.format(track_id="old.id") + "; "
+        "UPDATE catalog_rowids SET track_id = new.id WHERE track_id = old.id; "
+        "INSERT INTO catalog_fts (rowid, artist, name, album, extra) "
+        "VALUES (" + _CATALOG_ROWID.format(track_id="new.id") + ", "
+        "new.artist, new.name, COALESCE(new.album, ''), " + _TRACK_EXTRA + "); "
+        "END",
+        "CREATE TRIGGER catalog_fts_tracks_ad AFTER DELETE ON tracks BEGIN "
+        "DELETE FROM catalog_fts WHERE rowid = " + _CATALOG_ROWID.format(track_id="old.id") + "; "
+        "DELETE FROM catalog_rowids WHERE track_id = old.id; "
+        "END",
+        "CREATE TRIGGER catalog_fts_files_ai AFTER INSERT ON telegram_files BEGIN "
+        "UPDATE catalog_fts SET extra = " + _FILE_EXTRA.format(row="new") + " "
+        "WHERE rowid = " + _CATALOG_ROWID.format(track_id="new.track_id") + "; "
+        "END",
+        "CREATE TRIGGER catalog_fts_files_au AFTER UPDATE OF artist, track_name ON telegram_files BEGIN "
+        "UPDATE catalog_fts SET extra = " + _FILE_EXTRA.format(row="new") + " "
+        "WHERE rowid = " + _CATALOG_ROWID.format(track_id="new.track_id") + "; "
+        "END",
+        "CREATE TRIGGER catalog_fts_files_ad AFTER DELETE ON telegram_files BEGIN "
+        "UPDATE catalog_fts SET extra = '' "
+        "WHERE rowid = " + _CATALOG_ROWID.format(track_id="old.track_id") + "; "
+        "END",
+        # Заполняем индекс уже существующими треками
+        "DELETE FROM catalog_rowids",
+        "INSERT INTO catalog_rowids (track_id) SELECT id FROM tracks",
+        "INSERT INTO catalog_fts (rowid, artist, name, album, extra) "
+        "SELECT k.id, t.artist, t.name, COALESCE(t.album, ''), " + _FILE_EXTRA.format(row="f") + " "
+        "FROM tracks t JOIN catalog_rowids k ON k.track_id = t.id "
+        "LEFT JOIN telegram_files f ON f.track_id = t.id",
+    ]),
+]
+
+# Версии, которые имеют смысл только на SQLite
+SQLITE_ONLY = {6, 8}
+
+
+async def run_migrations(conn) -> int:
+    """
+    Применить недостающие миграции внутри открытой транзакции
+
+    Args:
+        conn: AsyncConnection (engine.begin())
+
+    Returns:
+        Количество примененных миграций
+    """
+    await conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "description VARCHAR(255), "
+        "applied_at TIMESTAMP)"
+    ))
+    result = await conn.execute(text("SELECT version FROM schema_migrations"))
+    applied = {row[0] for row in result}
+    is_sqlite = conn.dialect.name == 'sqlite'
+
+    count = 0
+    for version, description, statements in MIGRATIONS:
+        if version in applied:
+            continue
+        if version in SQLITE_ONLY and not is_sqlite:
+            continue
+        for statement in statements:
+            await conn.execute(text(statement))
+        await conn.execute(
+            text("INSERT INTO schema_migrations (version, description, applied_at) "
+                 "VALUES (:version, :description, :applied_at)"),
+            {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+        )
+        print(f"🛠️ Migration {version} applied: {description}")
+        count += 1
+    return count
@@ -2,7 +2,7 @@
 Модели базы данных SQLAlchemy
 """
 from datetime import datetime
-from sqlalchemy import BigInteger, String, Integer, DateTime, ForeignKey, Text
+from sqlalchemy import BigInteger, Boolean, Float, String, Integer, DateTime, ForeignKey, Text, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from typing import List, Optional
 
@@ -26,13 +26,14 @@ class User(Base):
     # Настройки (Функция 3, 18)
     preferred_quality: Mapped[str] = mapped_column(String(10), default='192')  # 128, 192, 320
     language: Mapped[str] = mapped_column(String(5), default='ru')  # ru, en
-    auto_delete: Mapped[bool] = mapped_column(Integer, default=0)  # SQLite не поддерживает Boolean
+    # В SQLite Boolean хранится как INTEGER 0/1, поэтому старые базы совместимы
+    auto_delete: Mapped[bool] = mapped_column(Boolean, default=False)
     format: Mapped[str] = mapped_column(String(10), default='mp3')  # mp3, flac
-    notifications: Mapped[bool] = mapped_column(Integer, default=1)
+    notifications: Mapped[bool] = mapped_column(Boolean, default=True)
     
     # Статистика (Функция 9)
     total_downloads: Mapped[int] = mapped_column(Integer, default=0)
-    total_size_mb: Mapped[float] = mapped_column(Integer, default=0)  # Используем Integer для SQLite
+    total_size_mb: Mapped[float] = mapped_column(Float, default=0)
     
     # Связи
     playlists: Mapped[List["Playlist"]] = relationship(back_populates="user", cascade="all, delete-orphan")
@@ -96,6 +97,10 @@ class Track(Base):
 class PlaylistTrack(Base):
     """Связь многие-ко-многим между плейлистами и треками"""
     __tablename__ = 'playlist_tracks'
+    __table_args__ = (
+        Index('uq_playlist_tracks_playlist_track', 'playlist_id', 'track_id', unique=True),
+        Index('ix_playlist_tracks_playlist_position', 'playlist_id', 'position'),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     playlist_id: Mapped[int] = mapped_column(Integer, ForeignKey('playlists.id', ondelete='CASCADE'))
@@ -131,6 +136,9 @@ class Album(Base):
 class DownloadHistory(Base):
     """История скачиваний (Функция 5)"""
     __tablename__ = 'download_history'
+    __table_args__ = (
+        Index('ix_download_history_user_downloaded', 'user_id', 'downloaded_at'),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('users.id', ondelete='CASCADE'))
@@ -150,6 +158,9 @@ class DownloadHistory(Base):
 class Favorite(Base):
     """Избранные треки (Функция 8)"""
     __tablename__ = 'favorites'
+    __table_args__ = (
+        Index('uq_favorites_user_track', 'user_id', 'track_id', unique=True),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('users.id', ondelete='CASCADE'))
@@ -165,6 +176,9 @@ class Favorite(Base):
 class TrackCache(Base):
     """Таблица для кэширования аудиофайлов разных форматов и качеств"""
     __tablename__ = 'track_cache'
+    __table_args__ = (
+        Index('uq_track_cache_track_format_quality', 'track_id', 'file_format', 'quality', unique=True),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     track_id: Mapped[str] = mapped_column(String(255), ForeignKey('tracks.id', ondelete='CASCADE'))
@@ -187,6 +201,9 @@ Track.caches = relationship("TrackCache", back_populates="track", cascade="all,
 class AuthToken(Base):
     """Модель для временных токенов авторизации"""
     __tablename__ = 'auth_tokens'
+    __table_args__ = (
+        Index('ix_auth_tokens_user', 'user_id'),
+    )
     
     token: Mapped[str] = mapped_column(String(64), primary_key=True)
     user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('users.id', ondelete='CASCADE'))
@@ -202,6 +219,9 @@ class AuthToken(Base):
 class TelegramFile(Base):
     """Модель для кеширования файлов в Telegram Storage"""
     __tablename__ = 'telegram_files'
+    __table_args__ = (
+        Index('ix_telegram_files_uploaded', 'uploaded_at', 'track_id'),
+    )
     
     track_id: Mapped[str] = mapped_column(String(255), ForeignKey('tracks.id', ondelete='CASCADE'), primary_key=True)
     file_id: Mapped[str] = mapped_column(String(255), nullable=False)
@@ -231,3 +251,34 @@ class BackupLog(Base):
     
     def __repr__(self):
         return f"<BackupLog(id={self.id}, message_id={self.message_id})>"
+
+
+class YouTubeMatch(Base):
+    """Кэш соответствия трека видео на YouTube (чтобы не искать его повторно)"""
+    __tablename__ = 'youtube_matches'
+    
+    # "spotify:<track_id>" или "q:<нормализованное artist name>"
+    match_key: Mapped[str] = mapped_column(String(500), primary_key=True)
+    video_id: Mapped[str] = mapped_column(String(32), nullable=False)
+    title: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
+    duration: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)  # Секунды
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_used_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<YouTubeMatch(key={self.match_key}, video_id={self.video_id})>"
+
+
+class TelegramFilePath(Base):
+    """Кэш ответов getFile: путь файла на серверах Telegram действует около часа"""
+    __tablename__ = 'telegram_file_paths'
+    __table_args__ = (
+        Index('ix_telegram_file_paths_expires', 'expires_at'),
+    )
+    
+    file_id: Mapped[str] = mapped_column(String(255), primary_key=True)
+    file_path: Mapped[str] = mapped_column(String(500), nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f"<TelegramFilePath(file_id={self.file_id}, expires={self.expires_at})>"
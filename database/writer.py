@@ -0,0 +1,154 @@
+"""
+Единственный писатель БД в процессе с групповой фиксацией (group commit)
+
+SQLite допускает только одну пишущую транзакцию на файл. Когда каждый
+обработчик открывает свою транзакцию, они ждут друг друга на блокировке
+(busy_timeout) и каждый платит за свой fsync. Здесь записи процесса
+выстраиваются в очередь, а одна фоновая задача выполняет накопившиеся
+операции в одной транзакции и фиксирует их одним COMMIT.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Операция записи: получает открытую сессию, commit делает писатель
+WriteOperation = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class WriteStats:
+    """Метрики пути записи: ожидание блокировки SQLite и размер пачек"""
+
+    def __init__(self, warn_after: float = 1.0):
+        self.warn_after = warn_after
+        self.transactions = 0
+        self.operations = 0
+        self.lock_wait_total = 0.0
+        self.lock_wait_max = 0.0
+        self.queue_wait_total = 0.0
+
+    def record_lock_wait(self, seconds: float):
+        self.transactions += 1
+        self.lock_wait_total += seconds
+        self.lock_wait_max = max(self.lock_wait_max, seconds)
+        if seconds >= self.warn_after:
+            print(f"⏳ SQLite lock wait: {seconds:.2f}s")
+
+    def record_operations(self, count: int, queue_wait: float = 0.0):
+        self.operations += count
+        self.queue_wait_total += queue_wait
+
+    def snapshot(self) -> dict:
+        transactions = self.transactions or 1
+        return {
+            'transactions': self.transactions,
+            'operations': self.operations,
+            'ops_per_commit': round(self.operations / transactions, 2),
+            'lock_wait_avg_ms': round(self.lock_wait_total / transactions * 1000, 2),
+            'lock_wait_max_ms': round(self.lock_wait_max * 1000, 2),
+            'queue_wait_total_ms': round(self.queue_wait_total * 1000, 2),
+        }
+
+
+class DatabaseWriter:
+    """
+    Очередь записей с одной задачей-писателем.
+
+    Каждая операция выполняется в своем SAVEPOINT, поэтому ошибка одной
+    (например, нарушение уникальности) не откатывает остальные операции пачки.
+    """
+
+    def __init__(self, db_manager, max_batch: int = 50):
+        self.db = db_manager
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # После stop() новые операции не принимаются (их future некому было бы разрешить)
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        """Писатель принимает операции"""
+        return self._task is not None and not self._task.done() and not self._stopping
+
+    def start(self):
+        """Запустить писателя в текущем event loop"""
+        if self.running:
+            return
+        self.loop = asyncio.get_running_loop()
+        self._stopping = False
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        print(f"✍️ DB writer started (batch up to {self.max_batch})")
+
+    async def stop(self):
+        """Дописать очередь и остановить писателя"""
+        if not self.running:
+            return
+        self._stopping = True
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, operation: WriteOperation):
+        """
+        Поставить операцию в очередь и дождаться фиксации ее транзакции
+
+        Raises:
+            RuntimeError: писатель не запущен или уже останавливается
+        """
+        if not self.running:
+            raise RuntimeError("DB writer is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((operation, future, time.monotonic()))
+        return await future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            # Все, что накопилось, пока шла предыдущая фиксация, - в одну транзакцию
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._commit_batch(batch)
+
+    async def _commit_batch(self, batch: list):
+        started = time.monotonic()
+        results = []
+        try:
+            async with self.db.async_session() as session:
+                await self.db.begin_write(session)
+                for operation, future, _ in batch:
+                    try:
+                        async with session.begin_nested():
+                            result = await operation(session)
+                        results.append((future, result, None))
+                    except Exception as e:
+                        results.append((future, None, e))
+                await session.commit()
+        except Exception as e:
+            # Не удалось зафиксировать пачку целиком
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.db.write_stats.record_operations(
+            len(batch), sum(started - queued_at for _, _, queued_at in batch)
+        )
+        for future, result, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
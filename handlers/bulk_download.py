@@ -0,0 +1,249 @@
+"""
+Пакетное скачивание плейлистов и альбомов Spotify
+"""
+import asyncio
+import hashlib
+import html
+import os
+import time
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import config
+from utils.strings import get_string
+from utils.progress import create_download_progress_message
+
+# Не чаще одного редактирования статусного сообщения за этот интервал (секунды)
+PROGRESS_EDIT_INTERVAL = 3.0
+
+
+def _quality_display(file_format: str, quality: str) -> str:
+    """Подпись качества для caption"""
+    if file_format == 'mp3':
+        return f"{quality} kbps"
+    if quality == '1411': return "1411 kbps (CD)"
+    if quality == '2300': return "2300 kbps (48kHz/24bit)"
+    if quality == '4600': return "4600 kbps (96kHz/24bit)"
+    if quality == '9200': return "9200 kbps (192kHz/24bit)"
+    return "Lossless"
+
+
+def _track_record(track: dict) -> dict:
+    """Данные трека из плейлиста в формате модели Track"""
+    track_id = track.get('id')
+    if not track_id or track_id.startswith('idx_'):
+        unique_string = f"{track['artist']}_{track['name']}".lower()
+        track_id = hashlib.md5(unique_string.encode()).hexdigest()[:16]
+    return {
+        'id': track_id,
+        'name': track['name'],
+        'artist': track['artist'],
+        'album': track.get('album'),
+        'duration_ms': (track.get('duration') or 0) * 1000,
+        'spotify_url': f"https://open.spotify.com/track/{track_id}",
+        'image_url': track.get('image'),
+    }
+
+
+class _BulkProgress:
+    """Единое статусное сообщение пакетной загрузки с ограничением частоты правок"""
+
+    def __init__(self, status_msg, lang: str, total: int):
+        self.status_msg = status_msg
+        self.lang = lang
+        self.total = total
+        self.done = 0
+        self.sent = 0
+        self.cached = 0
+        self.failed = 0
+        self._last_edit = 0.0
+
+    async def step(self, track_name: str, status_key: str, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_edit < PROGRESS_EDIT_INTERVAL:
+            return
+        self._last_edit = now
+        text = create_download_progress_message(
+            html.escape(track_name), self.done, self.total,
+            status=get_string(status_key, self.lang), lang=self.lang
+        )
+        try:
+            await self.status_msg.edit_text(text, parse_mode='HTML')
+        except Exception:
+            # Сообщение не изменилось или удалено
+            pass
+
+    async def finish(self, name: str):
+        text = get_string(
+            "bulk_done", self.lang, name=html.escape(name), sent=self.sent, total=self.total,
+            cached=self.cached, failed=self.failed
+        )
+        try:
+            await self.status_msg.edit_text(text, parse_mode='HTML')
+        except Exception:
+            pass
+
+
+async def handle_collection_link(update: Update, context: ContextTypes.DEFAULT_TYPE, parsed: dict, user):
+    """
+    Скачать плейлист или альбом целиком:
+    треки из кэша отправляются сразу, остальные проходят через ограниченный
+    параллельный конвейер скачивание -> отправка с одним сообщением прогресса
+    """
+    spotify_service = context.bot_data.get('spotify')
+    download_service = context.bot_data.get('download_service')
+    db = context.bot_data.get('db')
+
+    user_id = update.effective_user.id
+    lang = user.language
+    quality = user.preferred_quality
+    file_format = user.format
+
+    status_msg = await update.message.reply_text(get_string("bulk_loading", lang))
+
+    url = update.message.text
+    if parsed['type'] == 'album':
+        collection = await spotify_service.get_album_info(url)
+    else:
+        collection = await spotify_service.get_playlist_info(url)
+
+    if not collection or not collection.get('tracks'):
+        await status_msg.edit_text(get_string("bulk_not_found", lang))
+        return
+
+    tracks = [_track_record(t) for t in collection['tracks']]
+    if len(tracks) > config.BULK_MAX_TRACKS:
+        await update.message.reply_text(
+            get_string("bulk_limited", lang, total=len(tracks), limit=config.BULK_MAX_TRACKS)
+        )
+        tracks = tracks[:config.BULK_MAX_TRACKS]
+
+    # Один запрос на создание треков и один на проверку кэша для всей подборки
+    cached = {}
+    if db:
+        await db.get_or_create_tracks(tracks)
+        cached = await db.get_cached_file_ids([t['id'] for t in tracks], file_format=file_format, quality=quality)
+
+    progress = _BulkProgress(status_msg, lang, len(tracks))
+    history_quality = f"{quality} kbps" if file_format == 'mp3' else f"Hi-Res FLAC ({quality} kbps)"
+    quality_display = _quality_display(file_format, quality)
+    # Отправляем по одному, чтобы не упираться в лимиты Telegram на сообщения в чат
+    send_lock = asyncio.Lock()
+
+    def caption_for(track: dict, from_cache: bool) -> str:
+        caption = get_string(
+            "bulk_track_caption", lang,
+            name=html.escape(track['name']), artist=html.escape(track['artist']),
+            format=file_format.upper(), quality=quality_display
+        )
+        if from_cache:
+            caption += "\n" + get_string("cached_label", lang)
+        return caption
+
+    # 1. Попадания в кэш - сразу
+    for track in tracks:
+        file_id = cached.get(track['id'])
+        if not file_id:
+            continue
+        try:
+            async with send_lock:
+                await update.message.reply_audio(
+                    audio=file_id,
+                    title=track['name'],
+                    performer=track['artist'],
+                    caption=caption_for(track, True),
+                    parse_mode='HTML'
+                )
+            progress.sent += 1
+            progress.cached += 1
+            if db:
+                await db.add_download_to_history(user_id, track['id'], history_quality, 0)
+        except Exception as e:
+            print(f"❌ Bulk: ошибка отправки из кэша {track['name']}: {e}")
+            if db:
+                db.schedule_file_id_revalidation(file_id)
+            # Попробуем скачать заново
+            cached.pop(track['id'], None)
+            continue
+        progress.done += 1
+        await progress.step(track['name'], "bulk_status_cache")
+
+    # 2. Промахи - ограниченный параллельный конвейер
+    misses = [t for t in tracks if t['id'] not in cached]
+    semaphore = asyncio.Semaphore(config.BULK_DOWNLOAD_CONCURRENCY)
+
+    async def process(track: dict):
+        result = None
+        try:
+            async with semaphore:
+                await progress.step(track['name'], "bulk_status_download")
+                result = await download_service.search_and_download_by_query(
+                    f"{track['artist']} {track['name']}",
+                    quality=quality,
+                    file_format=file_format,
+                    user_id=user_id,
+                    track_id=track['id']
+                )
+            if not result or not result.get('file_path') or not os.path.exists(result['file_path']):
+                progress.failed += 1
+                return
+            if result.get('file_size', 0) > 50 * 1024 * 1024:
+                progress.failed += 1
+                return
+
+            thumb_path = None
+            if track.get('image_url'):
+                thumb_path = await download_service.download_image(track['image_url'])
+
+            async with send_lock:
+                with open(result['file_path'], 'rb') as audio_file:
+                    thumb_file = open(thumb_path, 'rb') if thumb_path and os.path.exists(thumb_path) else None
+                    try:
+                        sent_message = await update.message.reply_audio(
+                            audio=audio_file,
+                            title=track['name'],
+                            performer=track['artist'],
+                            caption=caption_for(track, False),
+                            thumbnail=thumb_file,
+                            parse_mode='HTML',
+                            read_timeout=600,
+                            write_timeout=600
+                        )
+                    finally:
+                        if thumb_file:
+                            thumb_file.close()
+            progress.sent += 1
+
+            if db and sent_message.audio:
+                # file_id сохраняется сразу: прерванная подборка не теряет уже отправленные треки
+                try:
+                    await db.upsert_track_caches([{
+                        'track_id': track['id'],
+                        'telegram_file_id': sent_message.audio.file_id,
+                        'file_format': file_format,
+                        'quality': quality,
+                    }])
+                    await db.upsert_telegram_files([{
+                        'track_id': track['id'],
+                        'file_id': sent_message.audio.file_id,
+                        'artist': track['artist'],
+                        'track_name': track['name'],
+                        'file_size': result.get('file_size', 0),
+                    }])
+                except Exception as e:
+                    print(f"❌ Bulk: ошибка сохранения кэша {track['name']}: {e}")
+                await db.add_download_to_history(user_id, track['id'], history_quality, result.get('file_size', 0))
+        except Exception as e:
+            progress.failed += 1
+            print(f"❌ Bulk: ошибка обработки {track['name']}: {e}")
+        finally:
+            if result and result.get('file_path'):
+                download_service.cleanup_file(result['file_path'])
+            progress.done += 1
+            await progress.step(track['name'], "bulk_status_download")
+
+    if misses:
+        await progress.step(misses[0]['name'], "bulk_status_download", force=True)
+        await asyncio.gather(*(process(track) for track in misses))
+
+    await progress.finish(collection.get('name', ''))
@@ -4,10 +4,12 @@
 import os
 from telegram import Update
 from telegram.ext import ContextTypes
-from utils.keyboards import KeyboardBuilder, get_track_actions_keyboard
+from utils.keyboards import KeyboardBuilder, get_track_actions_keyboard, get_pagination_keyboard, parse_pagination_callback
 from services.message_builder import MessageBuilder
 from services.download_service import DownloadService
 from utils.strings import get_string
+from utils.progress import create_queue_position_reporter
+from utils.update_processor import run_in_background
 import config
 
 
@@ -40,7 +42,8 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif callback_data.startswith("preview_"):
         await send_preview(query, context, callback_data, lang)
     elif callback_data.startswith("download_"):
-        await download_track(query, context, callback_data, lang)
+        # Скачивание идет в фоне и не задерживает следующие апдейты чата
+        run_in_background(context, download_track(query, context, callback_data, lang))
     elif callback_data.startswith("open_"):
         await open_in_spotify(query, context, callback_data, lang)
     elif callback_data.startswith("add_to_playlist_"):
@@ -51,6 +54,8 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await add_track_to_playlist(query, context, callback_data, lang)
     elif callback_data.startswith("view_playlist_"):
         await view_playlist(query, context, callback_data, lang)
+    elif callback_data.startswith("pltracks_"):
+        await view_playlist_page(query, context, callback_data, lang)
     elif callback_data.startswith("delete_playlist_"):
         await confirm_delete_playlist(query, context, callback_data, lang)
     elif callback_data.startswith("confirm_delete_"):
@@ -235,6 +240,9 @@ async def download_track(query, context, callback_data, lang="ru"):
                 return
             except Exception as e:
                 print(f"❌ Ошибка отправки из кэша: {e}")
+                if db:
+                    # Мертвый file_id будет убран из кэша после проверки
+                    db.schedule_file_id_revalidation(cached_file_id)
                 # Если ошибка с кэшем, продолжаем обычное скачивание
         
         # Скачиваем трек
@@ -242,10 +250,17 @@ async def download_track(query, context, callback_data, lang="ru"):
             track.artist, 
             track.name, 
             quality=quality,
-            file_format=file_format
+            file_format=file_format,
+            user_id=query.from_user.id,
+            track_id=track_id,
+            on_queue_position=create_queue_position_reporter(status_msg, lang, track.name, track.artist)
         )
         
-        if not result or not os.path.exists(result['file_path']):
+        if result and result.get('queue_full'):
+            await status_msg.edit_text(get_string("queue_full", lang))
+            return
+        
+        if not result or not result.get('file_path') or not os.path.exists(result['file_path']):
             error_msg = get_string("error_download", lang)
             await status_msg.edit_text(
                 f"{error_msg}\n\nSpotify: {track.spotify_url}",
@@ -429,7 +444,8 @@ async def show_user_playlists(query, context, lang="ru"):
     user_id = query.from_user.id
     db = context.bot_data.get('db')
     
-    playlists = await db.get_user_playlists(user_id)
+    playlists_with_counts = await db.get_user_playlists_with_counts(user_id)
+    playlists = [playlist for playlist, _, _ in playlists_with_counts]
     
     if not playlists:
         keyboard = KeyboardBuilder.user_playlists([], lang=lang)
@@ -442,8 +458,7 @@ async def show_user_playlists(query, context, lang="ru"):
     
     message = get_string("playlists_my", lang) + "\n\n"
     
-    for i, playlist in enumerate(playlists, 1):
-        track_count = await db.get_playlist_track_count(playlist.id)
+    for i, (playlist, track_count, _) in enumerate(playlists_with_counts, 1):
         count_text = get_string("playlist_tracks_count", lang, count=track_count)
         message += f"{i}. <b>{playlist.name}</b> {count_text}\n"
     
@@ -459,10 +474,24 @@ async def show_user_playlists(query, context, lang="ru"):
 async def view_playlist(query, context, callback_data, lang="ru"):
     """Просмотр плейлиста"""
     playlist_id = int(callback_data.replace("view_playlist_", ""))
+    await _show_playlist_page(query, context, playlist_id, lang)
+
+
+async def view_playlist_page(query, context, callback_data, lang="ru"):
+    """Страница треков плейлиста (pltracks_{playlist_id}_page_{номер}_{курсор})"""
+    prefix, page, cursor = parse_pagination_callback(callback_data)
+    playlist_id = int(prefix.replace("pltracks_", ""))
+    await _show_playlist_page(query, context, playlist_id, lang, page, cursor)
+
+
+async def _show_playlist_page(query, context, playlist_id: int, lang="ru", page: int = 1, cursor: str = None):
+    """Плейлист со страницей треков (keyset-пагинация по позиции)"""
     db = context.bot_data.get('db')
     
     playlist = await db.get_playlist(playlist_id)
-    tracks = await db.get_playlist_tracks(playlist_id)
+    tracks, next_cursor, prev_cursor = await db.get_playlist_tracks_page(
+        playlist_id, limit=config.BOT_PAGE_SIZE, cursor=cursor
+    )
     
     if not playlist:
         await query.message.edit_text(get_string("playlist_not_found", lang))
@@ -482,8 +511,17 @@ async def view_playlist(query, context, callback_data, lang="ru"):
         )
         return
     
-    message = MessageBuilder.build_user_playlist_message(playlist, len(tracks), lang=lang)
-    keyboard = KeyboardBuilder.playlist_tracks(playlist_id, tracks, lang=lang)
+    track_count = await db.get_playlist_track_count(playlist_id)
+    total_pages = max(1, -(-track_count // config.BOT_PAGE_SIZE))
+    pagination = None
+    if total_pages > 1:
+        pagination = get_pagination_keyboard(
+            page, total_pages, f"pltracks_{playlist_id}",
+            next_cursor=next_cursor, prev_cursor=prev_cursor, lang=lang
+        )
+    
+    message = MessageBuilder.build_user_playlist_message(playlist, track_count, lang=lang)
+    keyboard = KeyboardBuilder.playlist_tracks(playlist_id, tracks, lang=lang, pagination=pagination)
     
     await query.message.edit_text(
         message,
@@ -3,8 +3,43 @@
 """
 from telegram import Update
 from telegram.ext import ContextTypes
-from utils.keyboards import get_track_actions_keyboard
+from utils.keyboards import get_track_actions_keyboard, get_pagination_keyboard, parse_pagination_callback
 from utils.strings import get_string
+import config
+
+
+async def _build_favorites_page(db, user_id: int, lang: str, page: int = 1, cursor: str = None):
+    """Текст и клавиатура одной страницы избранного; None, если избранное пусто"""
+    favorites, next_cursor, prev_cursor = await db.get_favorites_page(
+        user_id, limit=config.BOT_PAGE_SIZE, cursor=cursor
+    )
+    if not favorites:
+        return None
+    
+    total = await db.count_favorites(user_id)
+    total_pages = max(1, -(-total // config.BOT_PAGE_SIZE))
+    
+    # Формируем сообщение
+    title = "⭐ <b>Избранные треки</b>" if lang == "ru" else "⭐ <b>Favorite Tracks</b>"
+    count_text = f"Всего: {total}" if lang == "ru" else f"Total: {total}"
+    message = f"{title}\n\n{count_text}\n\n"
+    
+    start = (page - 1) * config.BOT_PAGE_SIZE + 1
+    for i, fav in enumerate(favorites, start):
+        track = fav['track']
+        added_at = fav['added_at'].strftime('%d.%m.%Y')
+        added_text = "Добавлено" if lang == "ru" else "Added"
+        
+        message += f"{i}. 🎵 <b>{track['name']}</b>\n"
+        message += f"   👤 {track['artist']}\n"
+        message += f"   📅 {added_text}: {added_at}\n\n"
+    
+    keyboard = None
+    if total_pages > 1:
+        keyboard = get_pagination_keyboard(
+            page, total_pages, "favorites", next_cursor=next_cursor, prev_cursor=prev_cursor, lang=lang
+        )
+    return message, keyboard
 
 
 async def favorites_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -21,40 +56,48 @@ async def favorites_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lang = user.language
     
     try:
-        favorites = await db.get_favorites(user_id)
+        page = await _build_favorites_page(db, user_id, lang)
         
-        if not favorites:
+        if not page:
             await update.message.reply_text(
                 get_string("favorites_empty", lang),
                 parse_mode='HTML'
             )
             return
         
-        # Формируем сообщение
-        title = "⭐ <b>Избранные треки</b>" if lang == "ru" else "⭐ <b>Favorite Tracks</b>"
-        count_text = f"Всего: {len(favorites)}" if lang == "ru" else f"Total: {len(favorites)}"
-        message = f"{title}\n\n{count_text}\n\n"
-        
-        for i, fav in enumerate(favorites[:10], 1):  # Показываем первые 10
-            track = fav['track']
-            added_at = fav['added_at'].strftime('%d.%m.%Y')
-            added_text = "Добавлено" if lang == "ru" else "Added"
-            
-            message += f"{i}. 🎵 <b>{track['name']}</b>\n"
-            message += f"   👤 {track['artist']}\n"
-            message += f"   📅 {added_text}: {added_at}\n\n"
-        
-        if len(favorites) > 10:
-            more_text = f"ещё {len(favorites) - 10} треков" if lang == "ru" else f"{len(favorites) - 10} more tracks"
-            message += f"\n... и {more_text}"
-        
-        await update.message.reply_text(message, parse_mode='HTML')
+        message, keyboard = page
+        await update.message.reply_text(message, reply_markup=keyboard, parse_mode='HTML')
         
     except Exception as e:
         print(f"❌ Ошибка получения избранного: {e}")
         await update.message.reply_text("❌ Error getting favorites" if lang == "en" else "❌ Ошибка при получении избранного")
 
 
+async def favorites_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Переход по страницам избранного (favorites_page_{номер}_{курсор})"""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = update.effective_user.id
+    db = context.bot_data.get('db')
+    if not db:
+        return
+    
+    user = await db.get_or_create_user(user_id, update.effective_user)
+    lang = user.language
+    
+    try:
+        _, page_number, cursor = parse_pagination_callback(query.data)
+        page = await _build_favorites_page(db, user_id, lang, page_number, cursor)
+        if not page:
+            await query.message.edit_text(get_string("favorites_empty", lang), parse_mode='HTML')
+            return
+        message, keyboard = page
+        await query.message.edit_text(message, reply_markup=keyboard, parse_mode='HTML')
+    except Exception as e:
+        print(f"❌ Ошибка получения избранного: {e}")
+
+
 async def add_to_favorites_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Добавить трек в избранное (callback)"""
     query = update.callback_query
@@ -4,8 +4,41 @@
 import os
 from telegram import Update
 from telegram.ext import ContextTypes
-from utils.keyboards import get_track_actions_keyboard, get_pagination_keyboard
+from utils.keyboards import get_track_actions_keyboard, get_pagination_keyboard, parse_pagination_callback
 from utils.strings import get_string
+import config
+
+
+async def _build_history_page(db, user_id: int, lang: str, page: int = 1, cursor: str = None):
+    """Текст и клавиатура одной страницы истории; None, если история пуста"""
+    history, next_cursor, prev_cursor = await db.get_download_history_page(
+        user_id, limit=config.BOT_PAGE_SIZE, cursor=cursor
+    )
+    if not history:
+        return None
+    
+    total = await db.count_download_history(user_id)
+    total_pages = max(1, -(-total // config.BOT_PAGE_SIZE))
+    
+    # Формируем сообщение
+    message = get_string("history_title", lang, count=total)
+    
+    start = (page - 1) * config.BOT_PAGE_SIZE + 1
+    for i, item in enumerate(history, start):
+        track = item['track']
+        downloaded_at = item['downloaded_at'].strftime('%d.%m.%Y %H:%M')
+        quality = item['quality']
+        
+        message += f"{i}. 🎵 <b>{track['name']}</b>\n"
+        message += f"   👤 {track['artist']}\n"
+        message += f"   📅 {downloaded_at} | {quality}\n\n"
+    
+    keyboard = None
+    if total_pages > 1:
+        keyboard = get_pagination_keyboard(
+            page, total_pages, "history", next_cursor=next_cursor, prev_cursor=prev_cursor, lang=lang
+        )
+    return message, keyboard
 
 
 async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -23,35 +56,48 @@ async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Получаем историю из БД
     try:
-        # TODO: Реализовать метод get_download_history в db_manager
-        history = await db.get_download_history(user_id, limit=10)
+        page = await _build_history_page(db, user_id, lang)
         
-        if not history:
+        if not page:
             await update.message.reply_text(
                 get_string("history_empty", lang),
                 parse_mode='HTML'
             )
             return
         
-        # Формируем сообщение
-        message = get_string("history_title", lang, count=len(history))
-        
-        for i, item in enumerate(history, 1):
-            track = item['track']
-            downloaded_at = item['downloaded_at'].strftime('%d.%m.%Y %H:%M')
-            quality = item['quality']
-            
-            message += f"{i}. 🎵 <b>{track['name']}</b>\n"
-            message += f"   👤 {track['artist']}\n"
-            message += f"   📅 {downloaded_at} | {quality}\n\n"
-        
-        await update.message.reply_text(message, parse_mode='HTML')
+        message, keyboard = page
+        await update.message.reply_text(message, reply_markup=keyboard, parse_mode='HTML')
         
     except Exception as e:
         print(f"❌ Ошибка получения истории: {e}")
         await update.message.reply_text("❌ Error getting history" if lang == "en" else "❌ Ошибка при получении истории")
 
 
+async def history_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Переход по страницам истории (history_page_{номер}_{курсор})"""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = update.effective_user.id
+    db = context.bot_data.get('db')
+    if not db:
+        return
+    
+    user = await db.get_or_create_user(user_id, update.effective_user)
+    lang = user.language
+    
+    try:
+        _, page_number, cursor = parse_pagination_callback(query.data)
+        page = await _build_history_page(db, user_id, lang, page_number, cursor)
+        if not page:
+            await query.message.edit_text(get_string("history_empty", lang), parse_mode='HTML')
+            return
+        message, keyboard = page
+        await query.message.edit_text(message, reply_markup=keyboard, parse_mode='HTML')
+    except Exception as e:
+        print(f"❌ Ошибка получения истории: {e}")
+
+
 async def clear_history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Очистить историю скачиваний"""
     user_id = update.effective_user.id
@@ -20,8 +20,9 @@ async def my_playlists_command(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text("❌ База данных недоступна")
         return
     
-    # Получаем плейлисты пользователя
-    playlists = await db.get_user_playlists(user_id)
+    # Получаем плейлисты пользователя вместе с числом треков (один запрос)
+    playlists_with_counts = await db.get_user_playlists_with_counts(user_id)
+    playlists = [playlist for playlist, _, _ in playlists_with_counts]
     
     if not playlists:
         message = """
@@ -41,8 +42,7 @@ async def my_playlists_command(update: Update, context: ContextTypes.DEFAULT_TYP
     # Формируем сообщение со списком плейлистов
     message = "📋 <b>Мои плейлисты:</b>\n\n"
     
-    for i, playlist in enumerate(playlists, 1):
-        track_count = await db.get_playlist_track_count(playlist.id)
+    for i, (playlist, track_count, _) in enumerate(playlists_with_counts, 1):
         message += f"{i}. <b>{playlist.name}</b> ({track_count} треков)\n"
     
     keyboard = KeyboardBuilder.user_playlists(playlists)
@@ -6,10 +6,15 @@ import os
 import hashlib
 from telegram import Update
 from telegram.ext import ContextTypes
+
+import config
 from services.spotify_service import SpotifyService
 from services.download_service import DownloadService
 from services.message_builder import MessageBuilder
 from utils.strings import get_string
+from utils.progress import create_queue_position_reporter
+from utils.update_processor import run_in_background
+from handlers.bulk_download import handle_collection_link
 from utils.keyboards import (
     get_search_results_keyboard, 
     get_track_actions_keyboard,
@@ -44,15 +49,26 @@ async def handle_spotify_link(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return
     
-    if parsed['type'] != 'track':
-        await update.message.reply_text(
-            "⚠️ Only tracks are supported for now." if lang == "en" else "⚠️ Пока поддерживаются только треки.\nОтправьте ссылку на отдельный трек.",
-            parse_mode='HTML'
-        )
+    if parsed['type'] in ('playlist', 'album'):
+        # Плейлисты и альбомы скачиваются пакетно
+        user = await db.get_or_create_user(user_id, update.effective_user)
+        run_in_background(context, handle_collection_link(update, context, parsed, user))
         return
     
-    # Получаем настройки из модели пользователя (Функция 3, 18)
+    # Скачивание идет в фоне и не задерживает следующие апдейты чата
     user = await db.get_or_create_user(user_id, update.effective_user)
+    run_in_background(context, _download_track_link(update, context, user))
+
+
+async def _download_track_link(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
+    """Скачать и отправить трек по ссылке (из кэша, если он уже был отправлен)"""
+    message_text = update.message.text
+    spotify_service: SpotifyService = context.bot_data.get('spotify')
+    download_service: DownloadService = context.bot_data.get('download_service')
+    db = context.bot_data.get('db')
+    
+    # Получаем настройки из модели пользователя (Функция 3, 18)
+    user_id = user.id
     quality = user.preferred_quality
     file_format = user.format
     lang = user.language
@@ -146,6 +162,9 @@ async def handle_spotify_link(update: Update, context: ContextTypes.DEFAULT_TYPE
                 return
             except Exception as e:
                 print(f"❌ Ошибка отправки из кэша: {e}")
+                if db:
+                    # Мертвый file_id будет убран из кэша после проверки
+                    db.schedule_file_id_revalidation(cached_file_id)
                 # Продолжаем обычное скачивание
         
         # Шаг 2: Показываем информацию
@@ -174,9 +193,17 @@ async def handle_spotify_link(update: Update, context: ContextTypes.DEFAULT_TYPE
         result = await download_service.search_and_download_by_query(
             search_query, 
             quality=quality, 
-            file_format=file_format
+            file_format=file_format,
+            user_id=user_id,
+            track_id=track_id,
+            on_queue_position=create_queue_position_reporter(
+                status_msg, lang, track_info['name'], track_info['artist']
+            )
         )
-
+        
+        if result and result.get('queue_full'):
+            await status_msg.edit_text(get_string("queue_full", lang))
+            return
         
         if not result or not result.get('file_path'):
             await status_msg.edit_text(
@@ -196,6 +223,7 @@ async def handle_spotify_link(update: Update, context: ContextTypes.DEFAULT_TYPE
                 get_string("error_file_too_large", lang, size=f"{file_size_mb:.1f}"),
                 parse_mode='HTML'
             )
+            download_service.cleanup_file(result['file_path'])
             return
 
         # Шаг 4: Отправляем файл
@@ -297,6 +325,7 @@ async def handle_spotify_link(update: Update, context: ContextTypes.DEFAULT_TYPE
                 parse_mode='HTML'
             )
             print(f"❌ Ошибка отправки файла: {e}")
+            download_service.cleanup_file(result['file_path'])
 
     
     except Exception as e:
@@ -309,15 +338,36 @@ async def handle_spotify_link(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 
 async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /search"""
+    """
+    Обработчик команды /search
+    /search без аргументов - подсказка, /search <запрос> - поиск по своему каталогу
+    """
     user_id = update.effective_user.id
     db = context.bot_data.get('db')
     lang = "ru"
+    user = None
     if db:
         user = await db.get_or_create_user(user_id, update.effective_user)
         lang = user.language
-        
+    
+    query = ' '.join(context.args or []).strip()
+    if not query or not db:
+        await update.message.reply_text(
+            get_string("search_welcome", lang),
+            parse_mode='HTML'
+        )
+        return
+    
+    results = await db.search_catalog(
+        query, limit=config.SEARCH_RESULTS_LIMIT,
+        file_format=user.format, quality=user.preferred_quality
+    )
+    if not results:
+        await update.message.reply_text(get_string("search_no_results", lang))
+        return
+    
     await update.message.reply_text(
-        get_string("search_welcome", lang),
+        get_string("search_results", lang, count=len(results)),
+        reply_markup=get_search_results_keyboard(results, limit=len(results)),
         parse_mode='HTML'
     )
@@ -2,15 +2,22 @@
 Services package initialization
 """
 from .spotify_service import SpotifyService
-from .telegram_storage_service import TelegramStorageService
+from .telegram_storage_service import TelegramStorageService, AsyncTelegramStorageService
 from .download_service import DownloadService
+from .download_scheduler import DownloadScheduler, QueueFullError
 from .db_backup_service import DatabaseBackupService
 from .message_builder import MessageBuilder
+from .http_client import HttpClientRegistry, http_clients
 
 __all__ = [
     'SpotifyService',
     'TelegramStorageService', 
+    'AsyncTelegramStorageService',
     'DownloadService',
+    'DownloadScheduler',
+    'QueueFullError',
     'DatabaseBackupService',
-    'MessageBuilder'
+    'MessageBuilder',
+    'HttpClientRegistry',
+    'http_clients'
 ]
@@ -4,29 +4,84 @@ Database Backup Service - автоматический backup и восстан
 import os
 import asyncio
 import shutil
+import tempfile
 from datetime import datetime
-from typing import Optional
-import httpx
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit, urlunsplit
+
+# Расширения файлов бэкапа: копия файла SQLite и логический дамп PostgreSQL (pg_dump -Fc)
+SQLITE_BACKUP_EXT = '.db'
+PG_DUMP_EXT = '.dump'
+
+# Параметры строки подключения, которые понимает libpq (остальные - asyncpg/SQLAlchemy)
+LIBPQ_QUERY_PARAMS = {
+    'sslmode', 'sslrootcert', 'sslcert', 'sslkey', 'sslcrl', 'connect_timeout',
+    'application_name', 'options', 'target_session_attrs', 'channel_binding',
+}
+# Аналоги параметров asyncpg в libpq
+ASYNCPG_QUERY_ALIASES = {'ssl': 'sslmode', 'timeout': 'connect_timeout'}
+# asyncpg принимает ssl=true/false, libpq - только режимы sslmode
+SSL_BOOL_MODES = {'true': 'require', '1': 'require', 'false': 'disable', '0': 'disable'}
+
+
+def _libpq_connection(dsn: str) -> Tuple[str, Dict[str, str]]:
+    """
+    Разделить DSN на строку подключения для pg_dump/pg_restore и окружение процесса
+
+    Пароль убирается из строки подключения и передается через PGPASSWORD,
+    чтобы не светиться в списке процессов; параметры asyncpg (?ssl=require)
+    переводятся в имена libpq (sslmode), незнакомые libpq - отбрасываются.
+    """
+    parts = urlsplit(dsn)
+    env = {}
+    userinfo, _, hostinfo = parts.netloc.rpartition('@')
+    if userinfo:
+        user, _, password = userinfo.partition(':')
+        if password:
+            env['PGPASSWORD'] = unquote(password)
+        netloc = f"{user}@{hostinfo}" if user else hostinfo
+    else:
+        netloc = hostinfo
+
+    query = []
+    for key, value in parse_qsl(parts.query, keep_blank_values=True):
+        key = ASYNCPG_QUERY_ALIASES.get(key, key)
+        if key == 'sslmode':
+            value = SSL_BOOL_MODES.get(value.lower(), value)
+        if key in LIBPQ_QUERY_PARAMS:
+            query.append((key, value))
+    return urlunsplit((parts.scheme, netloc, parts.path, urlencode(query), '')), env
 
 
 class DatabaseBackupService:
     """Сервис для backup и восстановления БД через Telegram Storage"""
     
-    def __init__(self, storage_service, db_path: str, db_manager=None):
+    def __init__(self, storage_service, db_path: Optional[str], db_manager=None,
+                 database_dsn: Optional[str] = None):
         """
         Args:
-            storage_service: TelegramStorageService instance
-            db_path: Путь к файлу БД (например, 'spotify_bot.db')
+            storage_service: AsyncTelegramStorageService instance
+            db_path: Путь к файлу БД (например, 'spotify_bot.db'); None для PostgreSQL
             db_manager: DatabaseManager instance for persistent logging
+            database_dsn: Строка подключения libpq для pg_dump/pg_restore (режим PostgreSQL)
         """
         self.storage = storage_service
         self.db_path = db_path
+        self.database_dsn = database_dsn
         self.db = db_manager
         self.backup_file_id = None
         self.is_running = False
         self.backup_message_ids = []  # Список message_id созданных в сессии
         
-        print(f"📦 Database Backup Service initialized for: {db_path}")
+        if self.is_sqlite:
+            print(f"📦 Database Backup Service initialized for: {db_path}")
+        else:
+            print("📦 Database Backup Service initialized for PostgreSQL (pg_dump)")
+    
+    @property
+    def is_sqlite(self) -> bool:
+        """Файловый бэкап SQLite или логический дамп PostgreSQL"""
+        return self.db_path is not None
     
     async def restore_from_telegram(self) -> bool:
         """
@@ -43,6 +98,9 @@ class DatabaseBackupService:
                 print("ℹ️  No backup found in Telegram, using local database (if exists)")
                 return False
             
+            if not self.is_sqlite:
+                return await self._restore_postgres(backup_info)
+            
             # Если локальный файл существует, проверим, нужно ли его заменять
             if os.path.exists(self.db_path):
                 file_size = os.path.getsize(self.db_path)
@@ -78,19 +136,34 @@ class DatabaseBackupService:
         Returns:
             True если backup успешно создан
         """
+        dump_path = None
         try:
-            if not os.path.exists(self.db_path):
-                print(f"⚠️  Database file not found: {self.db_path}")
-                return False
+            if self.db:
+                # Отложенные last_active и история должны попасть в бэкап (и из WAL - в файл БД)
+                try:
+                    await self.db.flush_write_behind()
+                    await self.db.checkpoint()
+                except Exception as e:
+                    print(f"⚠️ Could not flush pending writes before backup: {e}")
+            if self.is_sqlite:
+                if not os.path.exists(self.db_path):
+                    print(f"⚠️  Database file not found: {self.db_path}")
+                    return False
+                backup_path = self.db_path
+            else:
+                dump_path = await self._dump_postgres()
+                if not dump_path:
+                    return False
+                backup_path = dump_path
             
-            file_size = os.path.getsize(self.db_path)
+            file_size = os.path.getsize(backup_path)
             print(f"💾 Creating database backup ({file_size / 1024:.2f} KB)...")
             
             # Загружаем БД как document в Telegram
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             caption = f"🗄️ Database Backup - {timestamp}"
             
-            result = self.storage.upload_document(self.db_path, caption)
+            result = await self.storage.upload_document(backup_path, caption)
             
             if result and result.get('file_id'):
                 self.backup_file_id = result['file_id']
@@ -98,7 +171,7 @@ class DatabaseBackupService:
                 
                 # Закрепляем сообщение, чтобы бот всегда мог его найти
                 if result.get('message_id'):
-                    pin_success = self.storage.pin_message(result['message_id'])
+                    pin_success = await self.storage.pin_message(result['message_id'])
                     if pin_success:
                         print(f"📌 Backup message pinned: {result['message_id']}")
                     
@@ -122,6 +195,9 @@ class DatabaseBackupService:
             import traceback
             traceback.print_exc()
             return False
+        finally:
+            if dump_path and os.path.exists(dump_path):
+                os.remove(dump_path)
     
     async def start_periodic_backup(self, interval: int = 300):
         """
@@ -162,7 +238,7 @@ class DatabaseBackupService:
         """
         try:
             # Получаем закрепленное сообщение из канала
-            message = self.storage.get_pinned_message()
+            message = await self.storage.get_pinned_message()
             
             if not message or not message.get('document'):
                 # Если закрепленного сообщения нет, попробуем поискать в последних сообщениях (но это менее надежно)
@@ -170,8 +246,9 @@ class DatabaseBackupService:
                 return None
             
             doc = message['document']
-            # Проверяем, что это файл БД
-            if doc.get('file_name', '').endswith('.db'):
+            # Проверяем, что это бэкап БД нашего типа (файл SQLite или дамп PostgreSQL)
+            expected_ext = SQLITE_BACKUP_EXT if self.is_sqlite else PG_DUMP_EXT
+            if doc.get('file_name', '').endswith(expected_ext):
                 print(f"✅ Found backup in pinned message: {doc.get('file_name')}")
                 return {
                     'file_id': doc['file_id'],
@@ -201,7 +278,7 @@ class DatabaseBackupService:
             temp_path = f"{self.db_path}.backup"
             
             # Скачиваем файл
-            success = self.storage.download_file(file_id, temp_path)
+            success = await self.storage.download_file(file_id, temp_path)
             
             if success and os.path.exists(temp_path):
                 # Заменяем текущую БД на backup
@@ -229,6 +306,81 @@ class DatabaseBackupService:
             print(f"❌ Error downloading backup: {e}")
             return False
     
+    # ========== POSTGRESQL ==========
+    
+    async def _run_pg_tool(self, *args: str) -> bool:
+        """Запустить pg_dump/pg_restore, не блокируя event loop"""
+        dsn, pg_env = _libpq_connection(self.database_dsn)
+        args = (args[0], f'--dbname={dsn}') + args[1:]
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                env={**os.environ, **pg_env},
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError:
+            print(f"❌ {args[0]} not found: install postgresql-client to back up PostgreSQL")
+            return False
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            print(f"❌ {args[0]} failed: {stderr.decode(errors='ignore').strip()[:500]}")
+            return False
+        return True
+    
+    async def _dump_postgres(self) -> Optional[str]:
+        """Логический дамп PostgreSQL во временный файл (custom format, сжатый)"""
+        fd, dump_path = tempfile.mkstemp(prefix="spotify_bot_", suffix=PG_DUMP_EXT)
+        os.close(fd)
+        ok = await self._run_pg_tool(
+            'pg_dump', '--format=custom', '--no-owner', '--no-privileges',
+            f'--file={dump_path}'
+        )
+        if not ok:
+            os.remove(dump_path)
+            return None
+        return dump_path
+    
+    async def _postgres_has_data(self) -> bool:
+        """Есть ли в PostgreSQL уже заполненная схема (тогда восстанавливать не нужно)"""
+        from sqlalchemy import text
+        from sqlalchemy.ext.asyncio import create_async_engine
+        import config
+        
+        engine = create_async_engine(config.DATABASE_URL)
+        try:
+            async with engine.connect() as conn:
+                exists = (await conn.execute(text("SELECT to_regclass('public.users')"))).scalar()
+                if not exists:
+                    return False
+                return bool((await conn.execute(text("SELECT EXISTS (SELECT 1 FROM users)"))).scalar())
+        finally:
+            await engine.dispose()
+    
+    async def _restore_postgres(self, backup_info: dict) -> bool:
+        """Восстановить дамп в пустую базу PostgreSQL (непустую не трогаем)"""
+        if await self._postgres_has_data():
+            print("✅ PostgreSQL database already has data. Skipping restoration.")
+            return False
+        
+        fd, dump_path = tempfile.mkstemp(prefix="spotify_bot_", suffix=PG_DUMP_EXT)
+        os.close(fd)
+        try:
+            print("📥 Downloading PostgreSQL dump from Telegram...")
+            if not await self.storage.download_file(backup_info['file_id'], dump_path):
+                print("❌ Failed to download backup file")
+                return False
+            ok = await self._run_pg_tool(
+                'pg_restore', '--no-owner', '--no-privileges', '--clean', '--if-exists', dump_path
+            )
+            if ok:
+                print("✅ PostgreSQL database restored from Telegram!")
+                self.backup_file_id = backup_info['file_id']
+            return ok
+        finally:
+            if os.path.exists(dump_path):
+                os.remove(dump_path)
+    
     async def cleanup_old_backups(self, keep_count: int = 2):
         """
         Удалить старые бэкапы БД, оставив только последние keep_count
@@ -263,16 +415,7 @@ class DatabaseBackupService:
             for message_id in backups_to_delete:
                 try:
                     # Удаляем сообщение
-                    delete_response = httpx.post(
-                        f"{self.storage.base_url}/deleteMessage",
-                        data={
-                            'chat_id': self.storage.channel_id,
-                            'message_id': message_id
-                        },
-                        timeout=10.0
-                    )
-                    
-                    if delete_response.status_code == 200 and delete_response.json().get('ok'):
+                    if await self.storage.delete_message(message_id):
                         deleted_count += 1
                         print(f"🗑️  Deleted old database backup: message {message_id}")
                         
@@ -284,7 +427,7 @@ class DatabaseBackupService:
                         if message_id in self.backup_message_ids:
                             self.backup_message_ids.remove(message_id)
                     else:
-                        print(f"⚠️  Could not delete message {message_id}: {delete_response.text}")
+                        print(f"⚠️  Could not delete message {message_id}")
                         
                 except Exception as e:
                     print(f"⚠️  Error deleting message {message_id}: {e}")
@@ -0,0 +1,195 @@
+"""
+Менеджер локального дискового кэша папки downloads/ с бюджетом по размеру
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+
+class DiskCacheManager:
+    """
+    Следит за файлами в папке скачиваний (готовые треки, обложки thumb_*.jpg)
+    и удерживает их общий размер в пределах бюджета.
+
+    Вытесняются давно не использованные файлы (LRU по последнему обращению).
+    Закрепленные файлы (идет отправка/загрузка) не удаляются, пока закрепление
+    не снято или не устарело - так зависший обработчик не держит файл вечно.
+    Потокобезопасен: файлы регистрируются из воркеров скачивания.
+
+    Папка общая для бота и веба, а индекс и закрепления видны только своему
+    процессу. Поэтому файл, который любой процесс создал или использовал
+    (touch/pin обновляют mtime) за последние busy_grace секунд, тоже не удаляется.
+    """
+
+    def __init__(self, root_dir: str, max_bytes: int, exclude_dirs: Iterable[str] = (),
+                 pin_ttl: int = 3600, busy_grace: int = 900):
+        self.root_dir = os.path.abspath(root_dir)
+        self.max_bytes = max_bytes
+        self.pin_ttl = pin_ttl
+        self.busy_grace = busy_grace
+        # Папки со своим учетом места (например, кэш исходников)
+        self.exclude_dirs = {os.path.abspath(d) for d in exclude_dirs}
+        # путь -> размер; порядок = от давно использованных к недавним
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        # путь -> [число закреплений, время последнего закрепления]
+        self._pins: Dict[str, list] = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.scan()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def scan(self):
+        """Перестроить индекс по файлам на диске (при старте)"""
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.root_dir):
+            dirnames[:] = [
+                d for d in dirnames
+                if os.path.join(os.path.abspath(dirpath), d) not in self.exclude_dirs
+            ]
+            for name in filenames:
+                if name.endswith('.part'):
+                    continue
+                path = os.path.join(os.path.abspath(dirpath), name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((max(stat.st_atime, stat.st_mtime), path, stat.st_size))
+
+        with self._lock:
+            self._index.clear()
+            self._total_bytes = 0
+            for _, path, size in sorted(entries):
+                self._index[path] = size
+                self._total_bytes += size
+            evicted = self._evict_locked()
+
+        self._remove(evicted)
+        print(f"🗄️ Disk cache: {len(self._index)} files, "
+              f"{self._total_bytes / 1024 / 1024:.1f} / {self.max_bytes / 1024 / 1024:.0f} MB")
+
+    def register(self, file_path: str):
+        """Учесть новый файл и освободить место, если бюджет превышен"""
+        path = os.path.abspath(file_path)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            old = self._index.pop(path, None)
+            if old is not None:
+                self._total_bytes -= old
+            self._index[path] = size
+            self._total_bytes += size
+            evicted = self._evict_locked()
+        self._remove(evicted)
+
+    def touch(self, file_path: str) -> bool:
+        """Отметить обращение к файлу; False, если файла нет в кэше"""
+        path = os.path.abspath(file_path)
+        with self._lock:
+            if path not in self._index:
+                return False
+            self._index.move_to_end(path)
+        self._mark_used(path)
+        return True
+
+    @staticmethod
+    def _mark_used(path: str):
+        """Обновить mtime: так использование файла видят и другие процессы"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def discard(self, file_path: str):
+        """Убрать из учета файл, удаленный снаружи"""
+        path = os.path.abspath(file_path)
+        with self._lock:
+            size = self._index.pop(path, None)
+            if size is not None:
+                self._total_bytes -= size
+            self._pins.pop(path, None)
+
+    def pin(self, file_path: str, count: int = 1):
+        """Закрепить файл (не вытеснять, пока он отправляется)"""
+        path = os.path.abspath(file_path)
+        with self._lock:
+            pin = self._pins.setdefault(path, [0, 0.0])
+            pin[0] += count
+            pin[1] = time.time()
+        self._mark_used(path)
+
+    def unpin(self, file_path: str):
+        path = os.path.abspath(file_path)
+        with self._lock:
+            pin = self._pins.get(path)
+            if pin is None:
+                return
+            pin[0] -= 1
+            if pin[0] <= 0:
+                del self._pins[path]
+
+    @contextmanager
+    def pinned(self, file_path: Optional[str]):
+        """Закрепить файл на время блока with"""
+        if not file_path:
+            yield
+            return
+        self.pin(file_path)
+        try:
+            yield
+        finally:
+            self.unpin(file_path)
+
+    def _is_pinned_locked(self, path: str, now: float) -> bool:
+        pin = self._pins.get(path)
+        if pin is None:
+            return False
+        if now - pin[1] > self.pin_ttl:
+            # Закрепление устарело - обработчик так и не освободил файл
+            del self._pins[path]
+            return False
+        return True
+
+    def _is_busy(self, path: str, now: float) -> bool:
+        """Файл недавно создан или использован (возможно, другим процессом)"""
+        try:
+            return now - os.path.getmtime(path) < self.busy_grace
+        except OSError:
+            # Файла уже нет - вытеснение просто уберет его из учета
+            return False
+
+    def _evict_locked(self) -> list:
+        """Выбрать файлы для удаления (вызывается под блокировкой)"""
+        evicted = []
+        if self._total_bytes <= self.max_bytes:
+            return evicted
+        now = time.time()
+        for path in list(self._index):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if self._is_pinned_locked(path, now) or self._is_busy(path, now):
+                continue
+            size = self._index.pop(path)
+            self._total_bytes -= size
+            evicted.append((path, size))
+        return evicted
+
+    def _remove(self, evicted: list):
+        for path, size in evicted:
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+                parent = os.path.dirname(path)
+                if parent != self.root_dir and not os.listdir(parent):
+                    os.rmdir(parent)
+                print(f"🗑️ Disk cache evicted: {os.path.basename(path)} ({size / 1024 / 1024:.1f} MB)")
+            except OSError as e:
+                print(f"⚠️ Disk cache eviction failed for {path}: {e}")
@@ -0,0 +1,194 @@
+"""
+Планировщик скачиваний: ограниченный пул воркеров yt-dlp/ffmpeg
+со справедливой (round robin) очередью между пользователями
+"""
+import asyncio
+import inspect
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import config
+
+
+class QueueFullError(Exception):
+    """Очередь скачиваний переполнена (общий лимит или лимит пользователя)"""
+
+
+class _Job:
+    """Задание в очереди планировщика"""
+
+    def __init__(self, user_id, func: Callable, args: tuple, loop: asyncio.AbstractEventLoop,
+                 on_position: Optional[Callable] = None):
+        self.user_id = user_id
+        self.func = func
+        self.args = args
+        self.loop = loop
+        self.future = loop.create_future()
+        self.on_position = on_position
+        self.position = None
+
+
+class DownloadScheduler:
+    """
+    Пул из фиксированного числа потоков для тяжелых заданий (yt-dlp + ffmpeg).
+
+    У каждого пользователя своя очередь, воркеры берут задания из очередей
+    по кругу, поэтому один пользователь с 50 ссылками не блокирует остальных.
+    Планировщик не привязан к event loop: результат возвращается в тот цикл,
+    из которого задание было поставлено (бот и веб используют разные циклы).
+    """
+
+    def __init__(self, max_workers: int = None, max_queued: int = None, max_queued_per_user: int = None):
+        self.max_workers = max_workers or config.DOWNLOAD_WORKERS
+        self.max_queued = max_queued or config.DOWNLOAD_QUEUE_LIMIT
+        self.max_queued_per_user = max_queued_per_user or config.DOWNLOAD_QUEUE_PER_USER
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="download")
+        # user_id -> очередь заданий; порядок ключей = порядок обхода round robin
+        self._queues: "OrderedDict[Any, deque]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        print(f"⚙️ Download scheduler: {self.max_workers} workers, queue limit {self.max_queued}")
+
+    @property
+    def queued_count(self) -> int:
+        """Количество заданий, ожидающих свободного воркера"""
+        return self._queued
+
+    async def run(self, user_id, func: Callable, *args, on_position: Optional[Callable] = None):
+        """
+        Поставить синхронную функцию в очередь и дождаться результата
+
+        Args:
+            user_id: Ключ справедливой очереди (ID пользователя Telegram, None для веба)
+            func: Синхронная функция, выполняемая в потоке воркера
+            on_position: Корутина/функция, получающая позицию в очереди (0 = задание запущено)
+
+        Raises:
+            QueueFullError: если очередь переполнена
+        """
+        job = _Job(user_id, func, args, asyncio.get_running_loop(), on_position)
+
+        with self._lock:
+            if self._queued >= self.max_queued:
+                raise QueueFullError(f"Download queue is full ({self.max_queued} jobs)")
+            user_queue = self._queues.get(user_id)
+            if user_queue is not None and len(user_queue) >= self.max_queued_per_user:
+                raise QueueFullError(f"Too many queued downloads for user ({self.max_queued_per_user})")
+            self._queues.setdefault(user_id, deque()).append(job)
+            self._queued += 1
+            started = self._dispatch_locked()
+            positions = self._positions_locked()
+
+        self._start(started)
+        self._report(positions)
+
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            # Если ожидающий отменен до запуска - убираем задание из очереди
+            with self._lock:
+                user_queue = self._queues.get(user_id)
+                if user_queue is not None and job in user_queue:
+                    user_queue.remove(job)
+                    self._queued -= 1
+                    if not user_queue:
+                        del self._queues[user_id]
+            raise
+
+    def shutdown(self):
+        """Остановить пул воркеров (не дожидаясь очереди)"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _dispatch_locked(self) -> List[_Job]:
+        """Выбрать задания для свободных воркеров (вызывается под блокировкой)"""
+        started = []
+        while self._active < self.max_workers and self._queues:
+            user_id, user_queue = next(iter(self._queues.items()))
+            job = user_queue.popleft()
+            if user_queue:
+                # Пользователь уходит в конец круга
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            self._queued -= 1
+            self._active += 1
+            job.position = 0
+            started.append(job)
+        return started
+
+    def _positions_locked(self) -> List[tuple]:
+        """Рассчитать позиции ожидающих заданий в порядке round robin"""
+        changed = []
+        queues = [list(q) for q in self._queues.values()]
+        position = 1
+        depth = 0
+        while True:
+            round_jobs = [q[depth] for q in queues if depth < len(q)]
+            if not round_jobs:
+                break
+            for job in round_jobs:
+                if job.position != position:
+                    job.position = position
+                    changed.append((job, position))
+                position += 1
+            depth += 1
+        return changed
+
+    def _start(self, jobs: List[_Job]):
+        for job in jobs:
+            self._report([(job, 0)])
+            self._executor.submit(self._execute, job)
+
+    def _execute(self, job: _Job):
+        """Выполнение задания в потоке воркера"""
+        try:
+            result = job.func(*job.args)
+            self._resolve(job, result=result)
+        except BaseException as e:
+            self._resolve(job, error=e)
+        finally:
+            with self._lock:
+                self._active -= 1
+                started = self._dispatch_locked()
+                positions = self._positions_locked()
+            self._start(started)
+            self._report(positions)
+
+    @staticmethod
+    def _resolve(job: _Job, result=None, error: BaseException = None):
+        """Передать результат в event loop, из которого задание было поставлено"""
+        def _set():
+            if job.future.done():
+                return
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+        try:
+            job.loop.call_soon_threadsafe(_set)
+        except RuntimeError:
+            # Цикл уже закрыт - ожидающего больше нет
+            pass
+
+    @staticmethod
+    def _report(positions: List[tuple]):
+        """Сообщить вызывающим об изменении позиции в очереди"""
+        for job, position in positions:
+            if not job.on_position:
+                continue
+            try:
+                if inspect.iscoroutinefunction(job.on_position):
+                    future = asyncio.run_coroutine_threadsafe(job.on_position(position), job.loop)
+                    future.add_done_callback(DownloadScheduler._log_callback_error)
+                else:
+                    job.loop.call_soon_threadsafe(job.on_position, position)
+            except RuntimeError:
+                pass
+
+    @staticmethod
+    def _log_callback_error(future):
+        if not future.cancelled() and future.exception():
+            print(f"⚠️ Queue position callback failed: {future.exception()}")
@@ -1,19 +1,85 @@
 import os
+import re
 import asyncio
-from typing import Optional, Dict
+import functools
+import hashlib
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from typing import Optional, Dict, Callable, Awaitable, List, Tuple
 import yt_dlp
-import httpx
+
+import config
+from .download_scheduler import DownloadScheduler, QueueFullError
+from .source_cache import SourceCache
+from .disk_cache import DiskCacheManager
+from .http_client import http_clients
+
+# Признаки того, что сохраненное видео больше недоступно на YouTube.
+# Только точные сообщения yt-dlp: "Requested format is not available" и сетевые ошибки
+# не должны стирать верное соответствие
+VIDEO_UNAVAILABLE_MARKERS = (
+    'video unavailable',
+    'private video',
+    'this video has been removed',
+    'account associated with this video has been terminated',
+)
+
+# Лимит Telegram Bot API на отправку файлов
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024
+
+# Папки заданий других процессов удаляются, только если в них ничего не менялось столько секунд
+STALE_JOB_DIR_AGE = 6 * 3600
 
 
 class DownloadService:
     """Сервис для поиска и скачивания музыки с YouTube"""
     
-    def __init__(self, download_dir: str = "downloads"):
+    def __init__(self, download_dir: str = "downloads", scheduler: DownloadScheduler = None,
+                 db_manager=None, storage_service=None):
         # Всегда используем абсолютный путь относительно корня проекта
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.download_dir = os.path.join(base_dir, download_dir)
         self.cookies_path = os.path.join(base_dir, "youtube_cookies.txt")
         os.makedirs(self.download_dir, exist_ok=True)
+        # Каждое задание пишет только в свою папку jobs/<pid>-<запуск>/<job_id>.
+        # У бота и веба свои корни: перезапуск одного не трогает задания другого
+        self.jobs_root = os.path.join(self.download_dir, "jobs")
+        self.jobs_dir = os.path.join(self.jobs_root, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        self._cleanup_stale_jobs()
+        # DatabaseManager для кэша соответствий трек -> видео YouTube (опционально)
+        self.db = db_manager
+        # AsyncTelegramStorageService для фоновой загрузки других качеств (опционально)
+        self.storage = storage_service
+        # Ограниченный пул воркеров с очередью по пользователям
+        self.scheduler = scheduler or DownloadScheduler()
+        # Исходники bestaudio: одно скачивание - любые форматы и качества
+        self.source_cache = SourceCache(
+            os.path.join(self.download_dir, "sources"),
+            max_bytes=config.SOURCE_CACHE_MAX_MB * 1024 * 1024
+        )
+        # Фрагменты файлов Telegram для стриминга в вебе (свой лимит, см. StreamCache)
+        self.stream_cache_dir = os.path.join(self.download_dir, "stream")
+        # Бюджет места для готовых файлов и обложек (исходники и стриминг считаются отдельно).
+        # Папки заданий при старте не индексируются: в них могут быть файлы другого процесса,
+        # а свои готовые файлы процесс регистрирует сам
+        self.disk_cache = DiskCacheManager(
+            self.download_dir,
+            max_bytes=config.DOWNLOAD_CACHE_MAX_MB * 1024 * 1024,
+            exclude_dirs=[self.source_cache.cache_dir, self.stream_cache_dir, self.jobs_root]
+        )
+        # Реестр скачиваний в процессе: (трек, формат, качество) -> общий результат
+        self._inflight: Dict[tuple, dict] = {}
+        # Сколько получателей ещё используют файл (файл удаляется последним cleanup_file)
+        self._file_refs: Dict[str, int] = {}
+        # cleanup_file вызывается и из потоков Flask (call_on_close), поэтому оба реестра под замком
+        self._refs_lock = threading.Lock()
+        # Фоновые задачи подготовки других качеств (держим ссылки, чтобы их не собрал GC)
+        self._prefetch_tasks = set()
+        # track_id, для которых подготовка других качеств уже идет
+        self._prefetching: set = set()
         if os.path.exists(self.cookies_path):
             print(f"🍪 YouTube cookie file found: {self.cookies_path}")
         else:
@@ -32,29 +98,12 @@ class DownloadService:
             return ['-af', 'aresample=192000', '-sample_fmt', 's32']
         return []
     
-    async def search_and_download(self, artist: str, track_name: str, quality: str = '192', file_format: str = 'mp3') -> Optional[Dict]:
-        """
-        Поиск и скачивание трека с YouTube
-        """
-        ffmpeg_args = self._get_ffmpeg_args(quality, file_format)
-        search_query = f"{artist} - {track_name}"
-        
-        # Модифицируем шаблон имени файла чтобы избежать коллизий качества
-        safe_name = "".join([c if c.isalnum() or c in " -_" else "_" for c in f"{artist} - {track_name}"])
-        out_tmpl = os.path.join(self.download_dir, f"{safe_name}_{quality}.%(ext)s")
-        
-        ydl_opts = {
+    def _build_ydl_opts(self, out_tmpl: str) -> dict:
+        """Опции yt-dlp для скачивания исходного bestaudio потока (без конвертации)"""
+        return {
             'format': 'bestaudio/best',
             'outtmpl': out_tmpl,
             'overwrites': True,
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': file_format,
-                'preferredquality': quality if file_format == 'mp3' else None,
-            }],
-            'postprocessor_args': {
-                'ffmpeg': ffmpeg_args
-            } if ffmpeg_args else {},
             'quiet': True,
             'no_warnings': True,
             'extract_flat': False,
@@ -76,141 +125,446 @@ class DownloadService:
             'age_limit': 99,  # Обход возрастных ограничений
             'cookiefile': self.cookies_path if os.path.exists(self.cookies_path) else None,
         }
+    
+    @staticmethod
+    def _track_key(text: str) -> str:
+        """Нормализованный ключ трека: "Artist - Name" и "artist name" дают один ключ"""
+        return " ".join(re.sub(r'[\W_]+', ' ', text.lower()).split())
+    
+    @staticmethod
+    def _output_name(name: str, quality: str, file_format: str) -> str:
+        """Имя готового файла нужного формата и качества"""
+        safe_name = "".join([c if c.isalnum() or c in " -_" else "_" for c in name])
+        return f"{safe_name}_{quality}.{file_format}"
+    
+    def _create_job_dir(self) -> str:
+        """Создать изолированную папку задания"""
+        job_dir = os.path.join(self.jobs_dir, uuid.uuid4().hex[:12])
+        os.makedirs(job_dir)
+        return job_dir
+    
+    def _remove_job_dir(self, job_dir: str):
+        """Удалить папку задания целиком (вместе с недокачанными файлами)"""
+        shutil.rmtree(job_dir, ignore_errors=True)
+    
+    def _cleanup_stale_jobs(self):
+        """
+        Удалить брошенные папки заданий (упавших процессов и старой раскладки jobs/<job_id>).
+        Папка удаляется, только если в ней ничего не менялось дольше STALE_JOB_DIR_AGE:
+        у живого процесса идущее задание постоянно обновляет свои файлы.
+        """
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        now = time.time()
+        for name in os.listdir(self.jobs_root):
+            path = os.path.join(self.jobs_root, name)
+            if path == self.jobs_dir or not os.path.isdir(path):
+                continue
+            if now - self._last_change(path) > STALE_JOB_DIR_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+    
+    @staticmethod
+    def _last_change(path: str) -> float:
+        """Время последнего изменения папки или любого файла в ней"""
+        latest = os.path.getmtime(path)
+        for dirpath, _, filenames in os.walk(path):
+            for name in [dirpath] + [os.path.join(dirpath, f) for f in filenames]:
+                try:
+                    latest = max(latest, os.path.getmtime(name))
+                except OSError:
+                    pass
+        return latest
+    
+    async def _single_flight(self, key: tuple, factory: Callable[[], Awaitable[Optional[Dict]]]) -> Optional[Dict]:
+        """
+        Выполнить скачивание один раз для всех одновременных запросов с одинаковым ключом.
+        Остальные вызывающие ждут результат первого задания вместо повторной работы.
+        """
+        loop = asyncio.get_running_loop()
+        with self._refs_lock:
+            entry = self._inflight.get(key)
+            # Future привязан к event loop, поэтому делимся только в пределах одного цикла
+            shared = entry is not None and entry['future'].get_loop() is loop
+            if shared:
+                entry['waiters'] += 1
+            else:
+                entry = {'future': loop.create_future(), 'waiters': 0}
+                self._inflight[key] = entry
         
+        if shared:
+            print(f"🔁 Ожидаем уже идущее скачивание: {key[0]} ({key[1]} {key[2]})")
+            try:
+                result = await asyncio.shield(entry['future'])
+            except asyncio.CancelledError:
+                self._release_waiter(key, entry)
+                raise
+            return dict(result) if result else result
+        
+        result = None
         try:
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None, 
-                self._download_sync, 
-                search_query, 
-                ydl_opts,
-                file_format
+            result = await factory()
+        except asyncio.CancelledError:
+            result = {'error': 'Download cancelled'}
+            raise
+        finally:
+            path = result.get('file_path') if result else None
+            with self._refs_lock:
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+                entry['result'] = result
+                # Каждый получатель результата держит ссылку на файл до cleanup_file
+                if path:
+                    self._file_refs[path] = self._file_refs.get(path, 0) + 1 + entry['waiters']
+                    # Файл закреплен, пока все получатели не вызовут cleanup_file
+                    self.disk_cache.pin(path, 1 + entry['waiters'])
+            if path:
+                self.disk_cache.register(path)
+            if not entry['future'].done():
+                entry['future'].set_result(result)
+        return dict(result) if result else result
+    
+    def _release_waiter(self, key: tuple, entry: dict):
+        """Ожидающий отменен и результат не получит - его ссылка на файл не нужна"""
+        with self._refs_lock:
+            if self._inflight.get(key) is entry:
+                # Скачивание еще идет - просто не считаем этого получателя
+                entry['waiters'] -= 1
+                return
+            result = entry.get('result')
+        # Ссылка уже выдана вместе с результатом - освобождаем ее, как сделал бы cleanup_file
+        if result and result.get('file_path'):
+            self.cleanup_file(result['file_path'])
+    
+    async def search_and_download(self, artist: str, track_name: str, quality: str = '192', file_format: str = 'mp3',
+                                  user_id: int = None, on_queue_position: Callable = None,
+                                  track_id: str = None, on_phase: Callable = None) -> Optional[Dict]:
+        """
+        Поиск и скачивание трека с YouTube
+        
+        Args:
+            user_id: ID пользователя для справедливой очереди воркеров
+            on_queue_position: Колбэк с позицией в очереди (0 - скачивание началось)
+            track_id: Spotify ID трека для кэша соответствий с YouTube
+            on_phase: Колбэк этапа ('searching', 'downloading', 'transcoding'),
+                вызывается из потока воркера
+        """
+        search_query = f"{artist} - {track_name}"
+        return await self._download_track(
+            search_query, quality, file_format, user_id, on_queue_position, track_id,
+            caption=f"🎵 {artist} - {track_name}", on_phase=on_phase
+        )
+    
+    async def search_and_download_by_query(self, search_query: str, quality: str = '192', file_format: str = 'mp3',
+                                           user_id: int = None, on_queue_position: Callable = None,
+                                           track_id: str = None, on_phase: Callable = None) -> Optional[Dict]:
+        return await self._download_track(
+            search_query, quality, file_format, user_id, on_queue_position, track_id,
+            caption=f"🎵 {search_query}", on_phase=on_phase
+        )
+    
+    async def _download_track(self, search_query: str, quality: str, file_format: str,
+                              user_id: int = None, on_queue_position: Callable = None,
+                              track_id: str = None, caption: str = None,
+                              on_phase: Callable = None) -> Optional[Dict]:
+        """Общий путь скачивания: дедупликация, кэш YouTube, исходник и конвертация"""
+        output_name = self._output_name(search_query, quality, file_format)
+        key = (self._track_key(search_query), file_format, quality)
+        match_keys = self._match_keys(search_query, track_id)
+        
+        async def lead():
+            # Этапы видит только вызывающий, запустивший скачивание; остальные ждут результат
+            result = await self._resolve_and_download(
+                search_query, match_keys, output_name, quality, file_format, user_id, on_queue_position,
+                on_phase
             )
+            # Другие качества готовит только первый вызывающий, а не каждый ждущий
+            if track_id and result and result.get('video_id') and not result.get('error'):
+                self.schedule_renditions(track_id, result['video_id'], caption, skip=[(file_format, quality)])
             return result
-        except Exception as e:
-            print(f"❌ Ошибка скачивания {search_query}: {e}")
-            return {'error': str(e)}
+        
+        return await self._single_flight(key, lead)
     
-    def _download_sync(self, query: str, ydl_opts: dict, file_format: str = 'mp3') -> Optional[Dict]:
-        """Синхронное скачивание (для запуска в executor)"""
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(query, download=True)
-                
-                if not info:
-                    return None
-                
-                title = info.get('title', 'Unknown')
-                duration = info.get('duration', 0)
-                
-                import glob
-                import time
-                
-                # 1. Пробуем предсказанный путь
-                base_path = ydl.prepare_filename(info)
-                file_path = os.path.splitext(base_path)[0] + f'.{file_format}'
-                
-                # 2. Если не найден, пробуем путь из метаданных yt-dlp
-                if not os.path.exists(file_path):
-                    actual_filename = info.get('_filename')
-                    if actual_filename:
-                        potential_path = os.path.splitext(actual_filename)[0] + f'.{file_format}'
-                        if os.path.exists(potential_path):
-                            file_path = potential_path
-                
-                # 3. Если всё еще не найден (самый надежный способ для сложных имен), 
-                # ищем файл с нужным форматом, созданный в последние 60 секунд
-                if not os.path.exists(file_path):
-                    pattern = os.path.join(self.download_dir, f'*.{file_format}')
-                    files = glob.glob(pattern)
-                    now = time.time()
-                    # Берем те, что созданы недавно
-                    recent_files = [f for f in files if now - os.path.getctime(f) < 60]
-                    if recent_files:
-                        # Берем самый новый из недавних
-                        file_path = max(recent_files, key=os.path.getctime)
-                
-                # 4. Проверяем финальный путь
-                file_size = 0
-                if os.path.exists(file_path):
-                    file_size = os.path.getsize(file_path)
-                else:
-                    # Логируем неудачу для отладки
-                    print(f"⚠️ Файл не найден после всех попыток: {file_path}")
-                    # Попробуем взять просто самый последний файл этого формата (крайняя мера)
-                    pattern = os.path.join(self.download_dir, f'*.{file_format}')
-                    all_files = glob.glob(pattern)
-                    if all_files:
-                        file_path = max(all_files, key=os.path.getctime)
-                        file_size = os.path.getsize(file_path)
-                
-                return {
-                    'file_path': file_path,
-                    'title': title,
-                    'duration': duration,
-                    'artist': info.get('artist', ''),
-                    'thumbnail': info.get('thumbnail', ''),
-                    'file_size': file_size
-                }
-        except Exception as e:
-            print(f"❌ Ошибка в _download_sync: {e}")
-            return {'error': str(e)}
-
+    def _match_keys(self, search_query: str, track_id: str = None) -> list:
+        """Ключи кэша соответствий: сначала Spotify ID, затем нормализованное название"""
+        keys = []
+        if track_id:
+            keys.append(f"spotify:{track_id}")
+        keys.append(f"q:{self._track_key(search_query)}")
+        return keys
     
-    async def search_and_download_by_query(self, search_query: str, quality: str = '192', file_format: str = 'mp3') -> Optional[Dict]:
-        ffmpeg_args = self._get_ffmpeg_args(quality, file_format)
+    async def _resolve_and_download(self, search_query: str, match_keys: list, output_name: str,
+                                    quality: str, file_format: str,
+                                    user_id: int = None, on_queue_position: Callable = None,
+                                    on_phase: Callable = None) -> Optional[Dict]:
+        """
+        Скачать трек по ранее найденному видео YouTube, а при его отсутствии - через ytsearch.
+        Найденное видео запоминается в БД, недоступное - удаляется из кэша.
+        """
+        match = None
+        if self.db:
+            try:
+                match = await self.db.get_youtube_match(match_keys)
+            except Exception as e:
+                print(f"⚠️ Ошибка чтения кэша YouTube: {e}")
         
-        # Модифицируем шаблон имени файла чтобы избежать коллизий качества
-        safe_query = "".join([c if c.isalnum() or c in " -_" else "_" for c in search_query])
-        out_tmpl = os.path.join(self.download_dir, f"{safe_query}_{quality}.%(ext)s")
+        if match:
+            print(f"🎯 Видео из кэша: {search_query} -> {match.video_id}")
+            meta = {'title': match.title, 'duration': match.duration}
+            result = await self._run_download(
+                search_query, output_name, quality, file_format, user_id, on_queue_position,
+                video_id=match.video_id, meta=meta, on_phase=on_phase
+            )
+            if result and not result.get('error'):
+                return result
+            if result and result.get('queue_full'):
+                return result
+            error = (result or {}).get('error', '').lower()
+            if any(marker in error for marker in VIDEO_UNAVAILABLE_MARKERS):
+                print(f"🗑️ Видео {match.video_id} недоступно, удаляем из кэша")
+                try:
+                    await self.db.delete_youtube_match(match.video_id)
+                except Exception as e:
+                    print(f"⚠️ Ошибка очистки кэша YouTube: {e}")
+            # Повторяем через обычный поиск
         
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': out_tmpl,
-            'overwrites': True,
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': file_format,
-                'preferredquality': quality if file_format == 'mp3' else None,
-            }],
-            'postprocessor_args': {
-                'ffmpeg': ffmpeg_args
-            } if ffmpeg_args else {},
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,
-            'default_search': 'ytsearch1',
-            # Обход блокировки YouTube "Sign in to confirm you're not a bot"
-            # Удаляем жесткий user_agent для автоматического подбора под клиента
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android'],
-                    'skip': ['hls', 'dash', 'translated_subs'],
-                    'include_dash_manifest': False,
-                    'include_hls_manifest': False,
-                }
-            },
-            'socket_timeout': 30,
-            'retries': 5,
-            'geo_bypass': True,
-            'nocheckcertificate': True,
-            'age_limit': 99,  # Обход возрастных ограничений
-            'cookiefile': self.cookies_path if os.path.exists(self.cookies_path) else None,
-        }
+        result = await self._run_download(
+            search_query, output_name, quality, file_format, user_id, on_queue_position,
+            on_phase=on_phase
+        )
         
+        if self.db and result and not result.get('error') and result.get('video_id'):
+            try:
+                await self.db.save_youtube_match(
+                    match_keys,
+                    result['video_id'],
+                    title=result.get('title'),
+                    duration=result.get('duration')
+                )
+            except Exception as e:
+                print(f"⚠️ Ошибка сохранения кэша YouTube: {e}")
+        return result
+    
+    async def _run_download(self, query: str, output_name: str, quality: str, file_format: str,
+                            user_id: int = None, on_queue_position: Callable = None,
+                            video_id: str = None, meta: dict = None,
+                            on_phase: Callable = None) -> Optional[Dict]:
+        """Запуск синхронного скачивания в пуле воркеров"""
         try:
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None, 
-                self._download_sync, 
-                search_query, 
-                ydl_opts,
-                file_format
+            result = await self.scheduler.run(
+                user_id,
+                functools.partial(
+                    self._download_sync, query, output_name, quality, file_format,
+                    video_id=video_id, meta=meta, on_phase=on_phase
+                ),
+                on_position=on_queue_position
             )
             return result
+        except QueueFullError as e:
+            print(f"⏳ Очередь скачиваний переполнена: {e}")
+            return {'error': str(e), 'queue_full': True}
+        except Exception as e:
+            print(f"❌ Ошибка скачивания {query}: {e}")
+            return {'error': str(e)}
+    
+    @staticmethod
+    def _report_phase(on_phase: Optional[Callable], phase: str):
+        """Сообщить этап скачивания; ошибка колбэка не должна сорвать загрузку"""
+        if on_phase is None:
+            return
+        try:
+            on_phase(phase)
+        except Exception as e:
+            print(f"⚠️ Ошибка колбэка этапа {phase}: {e}")
+    
+    def _download_sync(self, query: str, output_name: str, quality: str = '192', file_format: str = 'mp3',
+                       video_id: str = None, meta: dict = None,
+                       on_phase: Callable = None) -> Optional[Dict]:
+        """
+        Синхронное скачивание (для запуска в воркере): исходник берется из локального
+        кэша или скачивается с YouTube один раз, затем конвертируется локально.
+        Все файлы задания создаются в его собственной папке jobs/<job_id>.
+        """
+        job_dir = self._create_job_dir()
+        output_path = os.path.join(job_dir, output_name)
+        try:
+            info = dict(meta or {})
+            
+            # 1. Определяем видео: из кэша соответствий или через поиск
+            if not video_id:
+                self._report_phase(on_phase, 'searching')
+                found = self._search_video_sync(query)
+                if not found:
+                    return None
+                video_id = found['id']
+                info.update({k: v for k, v in found.items() if v})
+            
+            # 2. Исходник: из локального кэша или скачиваем bestaudio
+            self._report_phase(on_phase, 'downloading')
+            source_path, source_info = self._ensure_source_sync(video_id, job_dir)
+            info.update({k: v for k, v in source_info.items() if v})
+            
+            # 3. Конвертация в нужный формат и качество (исходник закреплен до ее конца)
+            try:
+                self._report_phase(on_phase, 'transcoding')
+                self._transcode_sync(source_path, output_path, quality, file_format)
+            finally:
+                self.source_cache.unpin(video_id)
+            
+            file_size = os.path.getsize(output_path)
+            return {
+                'file_path': output_path,
+                'video_id': video_id,
+                'title': info.get('title', 'Unknown'),
+                'duration': info.get('duration', 0),
+                'artist': info.get('artist', ''),
+                'thumbnail': info.get('thumbnail') or f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+                'file_size': file_size
+            }
         except Exception as e:
-            print(f"❌ Ошибка скачивания {search_query}: {e}")
+            print(f"❌ Ошибка в _download_sync: {e}")
             return {'error': str(e)}
+        finally:
+            if not os.path.exists(output_path):
+                self._remove_job_dir(job_dir)
+    
+    def _search_video_sync(self, query: str) -> Optional[Dict]:
+        """Найти видео на YouTube без скачивания (только id и базовые метаданные)"""
+        ydl_opts = self._build_ydl_opts(os.path.join(self.jobs_dir, "%(id)s.%(ext)s"))
+        ydl_opts['extract_flat'] = 'in_playlist'
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(query, download=False)
+            if not info:
+                return None
+            # ytsearch возвращает плейлист - берем найденное видео
+            if 'entries' in info:
+                entries = [e for e in (info.get('entries') or []) if e]
+                if not entries:
+                    return None
+                info = entries[0]
+            if not info.get('id'):
+                return None
+            return {
+                'id': info['id'],
+                'title': info.get('title'),
+                'duration': info.get('duration'),
+            }
+    
+    def _ensure_source_sync(self, video_id: str, job_dir: str) -> Tuple[str, Dict]:
+        """
+        Вернуть путь к исходнику видео, скачав его только при отсутствии в кэше.
+        Исходник возвращается закрепленным: вызывающий снимает закрепление через source_cache.unpin.
+        """
+        with self.source_cache.video_lock(video_id):
+            source_path = self.source_cache.get(video_id, pin=True)
+            if source_path:
+                print(f"🎼 Исходник из локального кэша: {video_id}")
+                return source_path, {}
+            
+            # yt-dlp сам сообщает итоговый файл через хуки - папку не сканируем
+            produced = []
+            
+            def on_progress(d):
+                if d.get('status') == 'finished' and d.get('filename'):
+                    produced.append(d['filename'])
+            
+            def on_postprocess(d):
+                if d.get('status') == 'finished':
+                    path = (d.get('info_dict') or {}).get('filepath')
+                    if path:
+                        produced.append(path)
+            
+            ydl_opts = self._build_ydl_opts(os.path.join(job_dir, "%(id)s.%(ext)s"))
+            ydl_opts['progress_hooks'] = [on_progress]
+            ydl_opts['postprocessor_hooks'] = [on_postprocess]
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=True)
+                if not info:
+                    raise RuntimeError(f"Video {video_id} could not be downloaded")
+            
+            downloaded = produced[-1] if produced else None
+            if not downloaded or not os.path.exists(downloaded):
+                raise RuntimeError(f"Source file not found after download: {video_id}")
+            
+            source_path = self.source_cache.put(video_id, downloaded, pin=True)
+            return source_path, {
+                'title': info.get('title'),
+                'duration': info.get('duration'),
+                'artist': info.get('artist'),
+                'thumbnail': info.get('thumbnail'),
+            }
+    
+    def _transcode_sync(self, source_path: str, output_path: str, quality: str, file_format: str):
+        """Локальная конвертация исходника в нужный формат (аналог FFmpegExtractAudio)"""
+        if file_format == 'mp3':
+            codec_args = ['-codec:a', 'libmp3lame', '-b:a', f"{quality}k"]
+        else:
+            codec_args = ['-codec:a', 'flac'] + self._get_ffmpeg_args(quality, file_format)
+        
+        tmp_path = f"{output_path}.part"
+        cmd = ['ffmpeg', '-y', '-v', 'error', '-i', source_path, '-vn'] + codec_args + ['-f', file_format, tmp_path]
+        completed = subprocess.run(cmd, capture_output=True, text=True)
+        if completed.returncode != 0:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise RuntimeError(f"ffmpeg failed: {completed.stderr.strip()[-500:]}")
+        os.replace(tmp_path, output_path)
+    
+    # ========== ФОНОВАЯ ПОДГОТОВКА ДРУГИХ КАЧЕСТВ ==========
+    
+    def schedule_renditions(self, track_id: str, video_id: str, caption: str = None,
+                            skip: List[Tuple[str, str]] = None):
+        """
+        Запустить в фоне конвертацию остальных качеств из локального исходника
+        и их регистрацию в TrackCache (если включено PREFETCH_RENDITIONS)
+        """
+        renditions = [r for r in config.PREFETCH_RENDITIONS if r not in (skip or [])]
+        if not renditions or not self.db or not self.storage:
+            return
+        if track_id in self._prefetching:
+            # Качества этого трека уже готовятся - вторая задача загрузила бы те же файлы
+            return
+        self._prefetching.add(track_id)
+        task = asyncio.get_running_loop().create_task(
+            self._prefetch_renditions(track_id, video_id, caption, renditions)
+        )
+        self._prefetch_tasks.add(task)
+        task.add_done_callback(self._prefetch_tasks.discard)
+        task.add_done_callback(lambda _: self._prefetching.discard(track_id))
+    
+    async def _prefetch_renditions(self, track_id: str, video_id: str, caption: str,
+                                   renditions: List[Tuple[str, str]]):
+        """Подготовить и загрузить в Telegram Storage недостающие качества трека"""
+        for file_format, quality in renditions:
+            try:
+                if await self.db.get_cached_file_id(track_id, file_format=file_format, quality=quality):
+                    continue
+                source_path = self.source_cache.get(video_id, pin=True)
+                if not source_path:
+                    return
+                
+                job_dir = None
+                try:
+                    job_dir = self._create_job_dir()
+                    output_path = os.path.join(job_dir, f"{video_id}_{quality}.{file_format}")
+                    await self.scheduler.run(
+                        '__prefetch__', self._transcode_sync, source_path, output_path, quality, file_format
+                    )
+                    if os.path.getsize(output_path) > TELEGRAM_UPLOAD_LIMIT:
+                        continue
+                    upload = await self.storage.upload_file(
+                        output_path, f"{caption or ''} • {file_format.upper()} {quality}".strip()
+                    )
+                    if upload and upload.get('file_id'):
+                        await self.db.update_track_cache(track_id, upload['file_id'], file_format, quality)
+                        print(f"✨ Prefetched {file_format} {quality} for {track_id}")
+                finally:
+                    self.source_cache.unpin(video_id)
+                    if job_dir:
+                        self._remove_job_dir(job_dir)
+            except QueueFullError:
+                # Фоновая работа не должна вытеснять пользователей
+                return
+            except Exception as e:
+                print(f"⚠️ Prefetch {file_format} {quality} failed for {track_id}: {e}")
     
     async def get_youtube_url(self, artist: str, track_name: str) -> Optional[str]:
         """
@@ -260,29 +614,42 @@ class DownloadService:
             
         try:
             # Используем хеш URL для имени файла чтобы не скачивать одно и то же
-            import hashlib
             file_hash = hashlib.md5(url.encode()).hexdigest()
             file_path = os.path.join(self.download_dir, f"thumb_{file_hash}.jpg")
             
             if os.path.exists(file_path):
+                if not self.disk_cache.touch(file_path):
+                    self.disk_cache.register(file_path)
                 return file_path
                 
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, timeout=10.0)
-                if response.status_code == 200:
-                    with open(file_path, 'wb') as f:
-                        f.write(response.content)
-                    return file_path
+            response = await http_clients.get_async('default').get(url, timeout=10.0)
+            if response.status_code == 200:
+                with open(file_path, 'wb') as f:
+                    f.write(response.content)
+                self.disk_cache.register(file_path)
+                return file_path
         except Exception as e:
             print(f"❌ Ошибка скачивания обложки: {e}")
             
         return None
     
     def cleanup_file(self, file_path: str):
-        """Удалить скачанный файл"""
+        """Удалить скачанный файл (и папку его задания)"""
+        with self._refs_lock:
+            refs = self._file_refs.get(file_path, 0)
+            if refs > 1:
+                # Файл ещё нужен другим получателям того же скачивания
+                self._file_refs[file_path] = refs - 1
+                self.disk_cache.unpin(file_path)
+                return
+            self._file_refs.pop(file_path, None)
+            self.disk_cache.discard(file_path)
         try:
             if os.path.exists(file_path):
                 os.remove(file_path)
                 print(f"🗑️ Удален файл: {file_path}")
+            job_dir = os.path.dirname(os.path.abspath(file_path))
+            if os.path.dirname(job_dir) == self.jobs_dir:
+                self._remove_job_dir(job_dir)
         except Exception as e:
             print(f"❌ Ошибка удаления файла {file_path}: {e}")
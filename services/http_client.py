@@ -0,0 +1,109 @@
+"""
+Общий реестр HTTP клиентов с пулом соединений (keep-alive, HTTP/2 при наличии h2)
+"""
+import asyncio
+import threading
+from typing import Dict, Tuple
+
+import httpx
+
+import config
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+# Пулы по хостам: у каждого свой лимит соединений и таймауты
+POOLS = {
+    'telegram': {
+        'max_connections': config.HTTP_TELEGRAM_MAX_CONNECTIONS,
+        'timeout': httpx.Timeout(30.0, connect=10.0),
+    },
+    'spotify': {
+        'max_connections': config.HTTP_SPOTIFY_MAX_CONNECTIONS,
+        'timeout': httpx.Timeout(15.0, connect=5.0),
+    },
+    'default': {
+        'max_connections': config.HTTP_DEFAULT_MAX_CONNECTIONS,
+        'timeout': httpx.Timeout(10.0, connect=5.0),
+    },
+}
+
+
+class HttpClientRegistry:
+    """
+    Выдает долгоживущие httpx клиенты вместо создания нового на каждый запрос,
+    чтобы TLS-рукопожатие с api.telegram.org и open.spotify.com делалось один раз.
+
+    Синхронные клиенты общие для всех потоков. Асинхронные привязаны к event loop
+    (соединения нельзя переиспользовать между циклами), поэтому хранятся по циклу.
+    """
+
+    def __init__(self):
+        self._sync_clients: Dict[str, httpx.Client] = {}
+        self._async_clients: Dict[Tuple[str, int], Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _client_kwargs(name: str) -> dict:
+        pool = POOLS.get(name, POOLS['default'])
+        return {
+            'timeout': pool['timeout'],
+            'limits': httpx.Limits(
+                max_connections=pool['max_connections'],
+                max_keepalive_connections=pool['max_connections'],
+                keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+            ),
+            'http2': HTTP2_AVAILABLE,
+            'follow_redirects': True,
+        }
+
+    def get_sync(self, name: str = 'default') -> httpx.Client:
+        """Синхронный клиент пула (для кода в потоках и Flask)"""
+        with self._lock:
+            client = self._sync_clients.get(name)
+            if client is None or client.is_closed:
+                client = httpx.Client(**self._client_kwargs(name))
+                self._sync_clients[name] = client
+            return client
+
+    def get_async(self, name: str = 'default') -> httpx.AsyncClient:
+        """Асинхронный клиент пула для текущего event loop"""
+        loop = asyncio.get_running_loop()
+        key = (name, id(loop))
+        with self._lock:
+            entry = self._async_clients.get(key)
+            if entry is not None and entry[0] is loop and not entry[1].is_closed:
+                return entry[1]
+            # Клиенты закрытых циклов больше не нужны
+            for stale_key, (stale_loop, _) in list(self._async_clients.items()):
+                if stale_loop.is_closed():
+                    del self._async_clients[stale_key]
+            client = httpx.AsyncClient(**self._client_kwargs(name))
+            self._async_clients[key] = (loop, client)
+            return client
+
+    async def aclose(self):
+        """Закрыть асинхронные клиенты текущего цикла и все синхронные"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            owned = [key for key, (client_loop, _) in self._async_clients.items() if client_loop is loop]
+            clients = [self._async_clients.pop(key)[1] for key in owned]
+        for client in clients:
+            await client.aclose()
+        self.close()
+
+    def close(self):
+        """Закрыть синхронные клиенты"""
+        with self._lock:
+            clients = list(self._sync_clients.values())
+            self._sync_clients.clear()
+        for client in clients:
+            client.close()
+
+
+# Общий реестр процесса
+http_clients = HttpClientRegistry()
@@ -0,0 +1,179 @@
+"""
+Локальный кэш исходных аудиопотоков YouTube (bestaudio) с LRU-вытеснением
+"""
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+
+class SourceCache:
+    """
+    Хранит скачанные исходники по video_id, чтобы любые форматы и качества
+    (mp3 128/192/320, flac) получались локальной конвертацией без повторного
+    скачивания с YouTube. Общий размер ограничен, вытесняются давно не
+    использованные файлы. Потокобезопасен - вызывается из воркеров скачивания.
+
+    Исходник, который сейчас конвертируется, закреплен (get/put с pin=True)
+    и не вытесняется, пока вызывающий не снимет закрепление через unpin.
+
+    Папка общая для бота и веба. Перед вытеснением индекс перечитывается
+    с диска, поэтому лимит действует на суммарный размер файлов всех процессов,
+    а LRU-порядок берется из mtime (get обновляет его в любом процессе).
+    Файлы, использованные за последние busy_grace секунд, не удаляются:
+    их может конвертировать другой процесс.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, busy_grace: int = 900):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.busy_grace = busy_grace
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # video_id -> (путь, размер); порядок = от давно использованных к недавним
+        self._index: "OrderedDict[str, tuple]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        # video_id -> [блокировка, число пользователей]; запись удаляется с последним пользователем
+        self._video_locks: Dict[str, list] = {}
+        # video_id -> число закреплений
+        self._pins: Dict[str, int] = {}
+        self._scan()
+
+    def _read_dir(self) -> List[tuple]:
+        """Файлы кэша на диске: (mtime, video_id, путь, размер) от давно использованных к недавним"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.part'):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Файл только что удалил другой процесс
+                continue
+            if os.path.isfile(path):
+                entries.append((stat.st_mtime, os.path.splitext(name)[0], path, stat.st_size))
+        return sorted(entries)
+
+    def _scan(self):
+        """Восстановить индекс по файлам на диске (после перезапуска)"""
+        with self._lock:
+            self._rescan_locked()
+        if self._index:
+            print(f"🎼 Source cache: {len(self._index)} files, {self._total_bytes / 1024 / 1024:.1f} MB")
+
+    def _rescan_locked(self):
+        """Перестроить индекс по диску: с файлами и обращениями других процессов"""
+        self._index.clear()
+        self._total_bytes = 0
+        for _, video_id, path, size in self._read_dir():
+            self._index[video_id] = (path, size)
+            self._total_bytes += size
+
+    def _find_on_disk_locked(self, video_id: str) -> Optional[tuple]:
+        """Исходник, который скачал другой процесс (в индексе этого процесса его еще нет)"""
+        for name in os.listdir(self.cache_dir):
+            if os.path.splitext(name)[0] != video_id or name.endswith('.part'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            self._index[video_id] = (path, size)
+            self._total_bytes += size
+            return path, size
+        return None
+
+    @contextmanager
+    def video_lock(self, video_id: str) -> Iterator[None]:
+        """Блокировка на видео, чтобы один исходник не скачивался параллельно"""
+        with self._lock:
+            entry = self._video_locks.setdefault(video_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._video_locks[video_id]
+
+    def get(self, video_id: str, pin: bool = False) -> Optional[str]:
+        """
+        Путь к исходнику или None; отмечает файл как недавно использованный.
+        С pin=True файл закрепляется (снять - unpin).
+        """
+        if not video_id:
+            return None
+        with self._lock:
+            entry = self._index.get(video_id) or self._find_on_disk_locked(video_id)
+            if not entry:
+                return None
+            path, size = entry
+            if not os.path.exists(path):
+                del self._index[video_id]
+                self._total_bytes -= size
+                return None
+            self._index.move_to_end(video_id)
+            if pin:
+                self._pins[video_id] = self._pins.get(video_id, 0) + 1
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return path
+
+    def put(self, video_id: str, file_path: str, pin: bool = False) -> str:
+        """
+        Переместить скачанный файл в кэш и вытеснить старые при превышении лимита.
+        С pin=True файл закрепляется (снять - unpin).
+        """
+        ext = os.path.splitext(file_path)[1]
+        target = os.path.join(self.cache_dir, f"{video_id}{ext}")
+        if os.path.abspath(file_path) != os.path.abspath(target):
+            shutil.move(file_path, target)
+        with self._lock:
+            # Учитываем и файлы, добавленные другими процессами
+            self._rescan_locked()
+            if pin:
+                self._pins[video_id] = self._pins.get(video_id, 0) + 1
+            self._evict_locked(keep=video_id)
+        return target
+
+    def unpin(self, video_id: str):
+        """Снять закрепление; отложенное вытеснение выполняется сразу"""
+        with self._lock:
+            count = self._pins.get(video_id, 0) - 1
+            if count > 0:
+                self._pins[video_id] = count
+            else:
+                self._pins.pop(video_id, None)
+            self._evict_locked()
+
+    def _is_busy(self, path: str, now: float) -> bool:
+        """Исходник недавно скачан или использован (возможно, другим процессом)"""
+        try:
+            return now - os.path.getmtime(path) < self.busy_grace
+        except OSError:
+            return False
+
+    def _evict_locked(self, keep: str = None):
+        now = time.time()
+        for video_id in list(self._index):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if video_id == keep or video_id in self._pins or self._is_busy(self._index[video_id][0], now):
+                continue
+            path, size = self._index.pop(video_id)
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+                print(f"🗑️ Source cache evicted: {video_id} ({size / 1024 / 1024:.1f} MB)")
+            except OSError:
+                pass
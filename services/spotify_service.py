@@ -6,16 +6,15 @@ import re
 import json
 import asyncio
 from typing import Optional, Dict
-import requests
-import httpx
 from bs4 import BeautifulSoup
 
+from .http_client import http_clients
+
 
 class SpotifyService:
     """Сервис для извлечения информации из Spotify ссылок без API"""
     
     def __init__(self):
-        self.session = requests.Session()
         print("✅ Spotify сервис инициализирован (oEmbed)")
     
     @staticmethod
@@ -64,7 +63,7 @@ class SpotifyService:
             }
             
             try:
-                response = self.session.get(oembed_url, timeout=5)
+                response = await http_clients.get_async('spotify').get(oembed_url, headers=headers, timeout=5.0)
                 if response.status_code == 200:
                     data = response.json()
                     track_name = data.get('title', '').strip()
@@ -75,32 +74,32 @@ class SpotifyService:
             # 2. Если нужно больше данных или oEmbed подвел, используем Embed страницу
             try:
                 embed_url = f"https://open.spotify.com/embed/track/{track_id}"
-                async with httpx.AsyncClient(headers=headers, follow_redirects=True) as client:
-                    page_response = await client.get(embed_url, timeout=10.0)
-                    if page_response.status_code == 200:
-                        soup = BeautifulSoup(page_response.text, 'html.parser')
-                        script_tag = soup.find('script', {'id': '__NEXT_DATA__', 'type': 'application/json'})
+                client = http_clients.get_async('spotify')
+                page_response = await client.get(embed_url, headers=headers, timeout=10.0)
+                if page_response.status_code == 200:
+                    soup = BeautifulSoup(page_response.text, 'html.parser')
+                    script_tag = soup.find('script', {'id': '__NEXT_DATA__', 'type': 'application/json'})
                         
-                        if script_tag:
-                            data = json.loads(script_tag.string)
-                            entity = data.get('props', {}).get('pageProps', {}).get('state', {}).get('data', {}).get('entity', {})
+                    if script_tag:
+                        data = json.loads(script_tag.string)
+                        entity = data.get('props', {}).get('pageProps', {}).get('state', {}).get('data', {}).get('entity', {})
                             
-                            if entity:
-                                if not track_name:
-                                    track_name = entity.get('name', '') or entity.get('title', '')
+                        if entity:
+                            if not track_name:
+                                track_name = entity.get('name', '') or entity.get('title', '')
                                 
-                                # Извлекаем артистов
-                                artists = entity.get('artists', [])
-                                if artists:
-                                    artist_name = ', '.join([a.get('name', '') for a in artists])
-                                elif not artist_name:
-                                    artist_name = entity.get('subtitle', '').replace('\u00a0', ' ')
+                            # Извлекаем артистов
+                            artists = entity.get('artists', [])
+                            if artists:
+                                artist_name = ', '.join([a.get('name', '') for a in artists])
+                            elif not artist_name:
+                                artist_name = entity.get('subtitle', '').replace('\u00a0', ' ')
                                 
-                                # Извлекаем картинку если нет
-                                if not image_url:
-                                    images = entity.get('visualIdentity', {}).get('image', [])
-                                    if images:
-                                        image_url = images[0].get('url')
+                            # Извлекаем картинку если нет
+                            if not image_url:
+                                images = entity.get('visualIdentity', {}).get('image', [])
+                                if images:
+                                    image_url = images[0].get('url')
             except Exception as e:
                 print(f"⚠️ Embed scraping failed: {e}")
             
@@ -181,121 +180,190 @@ class SpotifyService:
             
             print(f"🔍 Fetching playlist tokens via: {clean_url}")
             
-            async with httpx.AsyncClient(headers=headers, follow_redirects=True) as client:
-                response = await client.get(clean_url, timeout=30.0)
-                if response.status_code != 200:
-                    return None
+            client = http_clients.get_async('spotify')
+            response = await client.get(clean_url, headers=headers, timeout=30.0)
+            if response.status_code != 200:
+                return None
                     
-                soup = BeautifulSoup(response.text, 'html.parser')
-                script_tag = soup.find('script', {'id': '__NEXT_DATA__', 'type': 'application/json'})
+            soup = BeautifulSoup(response.text, 'html.parser')
+            script_tag = soup.find('script', {'id': '__NEXT_DATA__', 'type': 'application/json'})
                 
-                if not script_tag:
-                    return None
+            if not script_tag:
+                return None
                     
-                data = json.loads(script_tag.string)
-                # Извлекаем анонимный токен
-                token = data.get('props', {}).get('pageProps', {}).get('state', {}).get('settings', {}).get('session', {}).get('accessToken')
+            data = json.loads(script_tag.string)
+            # Извлекаем анонимный токен
+            token = data.get('props', {}).get('pageProps', {}).get('state', {}).get('settings', {}).get('session', {}).get('accessToken')
                 
-                if not token:
-                    print("⚠️ Could not extract anonymous token, falling back to basic data")
-                    # Fallback к данным из самого эмбеда (ограничено 100 треками, нет картинок)
-                    entity = data.get('props', {}).get('pageProps', {}).get('state', {}).get('data', {}).get('entity', {})
-                    if not entity: return None
+            if not token:
+                print("⚠️ Could not extract anonymous token, falling back to basic data")
+                # Fallback к данным из самого эмбеда (ограничено 100 треками, нет картинок)
+                entity = data.get('props', {}).get('pageProps', {}).get('state', {}).get('data', {}).get('entity', {})
+                if not entity: return None
                     
-                    tracks = []
-                    for idx, t in enumerate(entity.get('trackList', [])):
-                        tracks.append({
-                            'position': idx + 1,
-                            'id': t.get('uri', '').split(':')[-1] if 'uri' in t else f"idx_{idx}",
-                            'name': t.get('title', 'Unknown'),
-                            'artist': t.get('subtitle', 'Unknown Artist').replace('\u00a0', ' '),
-                            'duration': t.get('duration', 0) // 1000,
-                            'image': None
-                        })
+                tracks = []
+                for idx, t in enumerate(entity.get('trackList', [])):
+                    tracks.append({
+                        'position': idx + 1,
+                        'id': t.get('uri', '').split(':')[-1] if 'uri' in t else f"idx_{idx}",
+                        'name': t.get('title', 'Unknown'),
+                        'artist': t.get('subtitle', 'Unknown Artist').replace('\u00a0', ' '),
+                        'duration': t.get('duration', 0) // 1000,
+                        'image': None
+                    })
                     
-                    return {
-                        'id': playlist_id,
-                        'name': entity.get('name', 'Unknown Playlist'),
-                        'url': clean_url,
-                        'tracks': tracks,
-                        'total_tracks': len(tracks)
-                    }
-
-                # ИСПОЛЬЗУЕМ SPOTIFY WEB API С АНОНИМНЫМ ТОКЕНОМ
-                print(f"🚀 Using Web API with anonymous token for '{playlist_id}'")
-                api_headers = {
-                    "Authorization": f"Bearer {token}",
-                    "User-Agent": headers['User-Agent']
+                return {
+                    'id': playlist_id,
+                    'name': entity.get('name', 'Unknown Playlist'),
+                    'url': clean_url,
+                    'tracks': tracks,
+                    'total_tracks': len(tracks)
                 }
+
+            # ИСПОЛЬЗУЕМ SPOTIFY WEB API С АНОНИМНЫМ ТОКЕНОМ
+            print(f"🚀 Using Web API with anonymous token for '{playlist_id}'")
+            api_headers = {
+                "Authorization": f"Bearer {token}",
+                "User-Agent": headers['User-Agent']
+            }
                 
-                # Сначала получаем общую информацию о плейлисте
-                playlist_api_url = f"https://api.spotify.com/v1/playlists/{playlist_id}?fields=name,images,tracks.total"
-                pl_resp = await client.get(playlist_api_url, headers=api_headers)
+            # Сначала получаем общую информацию о плейлисте
+            playlist_api_url = f"https://api.spotify.com/v1/playlists/{playlist_id}?fields=name,images,tracks.total"
+            pl_resp = await client.get(playlist_api_url, headers=api_headers)
                 
-                playlist_name = "Unknown Playlist"
-                playlist_image = ""
-                total_tracks_count = 0
+            playlist_name = "Unknown Playlist"
+            playlist_image = ""
+            total_tracks_count = 0
                 
-                if pl_resp.status_code == 200:
-                    pl_data = pl_resp.json()
-                    playlist_name = pl_data.get('name', playlist_name)
-                    images = pl_data.get('images', [])
-                    if images: playlist_image = images[0].get('url')
-                    total_tracks_count = pl_data.get('tracks', {}).get('total', 0)
+            if pl_resp.status_code == 200:
+                pl_data = pl_resp.json()
+                playlist_name = pl_data.get('name', playlist_name)
+                images = pl_data.get('images', [])
+                if images: playlist_image = images[0].get('url')
+                total_tracks_count = pl_data.get('tracks', {}).get('total', 0)
                 
-                # Теперь скачиваем ВСЕ треки (пагинация)
-                tracks = []
-                offset = 0
-                limit = 100
+            # Теперь скачиваем ВСЕ треки (пагинация)
+            tracks = []
+            offset = 0
+            limit = 100
                 
-                while True:
-                    tracks_url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks?offset={offset}&limit={limit}&fields=items(track(id,name,artists,duration_ms,album(name,images)))"
-                    t_resp = await client.get(tracks_url, headers=api_headers)
+            while True:
+                tracks_url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks?offset={offset}&limit={limit}&fields=items(track(id,name,artists,duration_ms,album(name,images)))"
+                t_resp = await client.get(tracks_url, headers=api_headers)
                     
-                    if t_resp.status_code != 200:
-                        break
+                if t_resp.status_code != 200:
+                    break
                         
-                    t_data = t_resp.json()
-                    items = t_data.get('items', [])
-                    if not items:
-                        break
+                t_data = t_resp.json()
+                items = t_data.get('items', [])
+                if not items:
+                    break
                         
-                    for item in items:
-                        t = item.get('track')
-                        if not t: continue
+                for item in items:
+                    t = item.get('track')
+                    if not t: continue
                         
-                        artists = ", ".join([a.get('name', '') for a in t.get('artists', [])])
-                        images = t.get('album', {}).get('images', [])
-                        t_image = images[0].get('url') if images else playlist_image
+                    artists = ", ".join([a.get('name', '') for a in t.get('artists', [])])
+                    images = t.get('album', {}).get('images', [])
+                    t_image = images[0].get('url') if images else playlist_image
                         
-                        tracks.append({
-                            'position': len(tracks) + 1,
-                            'id': t.get('id'),
-                            'name': t.get('name'),
-                            'artist': artists,
-                            'duration': t.get('duration_ms', 0) // 1000,
-                            'image': t_image,
-                            'album': t.get('album', {}).get('name')
-                        })
+                    tracks.append({
+                        'position': len(tracks) + 1,
+                        'id': t.get('id'),
+                        'name': t.get('name'),
+                        'artist': artists,
+                        'duration': t.get('duration_ms', 0) // 1000,
+                        'image': t_image,
+                        'album': t.get('album', {}).get('name')
+                    })
                     
-                    if len(items) < limit or len(tracks) >= 1000: # Ограничиваем 1000 треками для безопасности
-                        break
+                if len(items) < limit or len(tracks) >= 1000: # Ограничиваем 1000 треками для безопасности
+                    break
                     
-                    offset += limit
+                offset += limit
                 
-                print(f"✅ Extracted {len(tracks)} tracks from '{playlist_name}'")
+            print(f"✅ Extracted {len(tracks)} tracks from '{playlist_name}'")
                 
-                return {
-                    'id': playlist_id,
-                    'name': playlist_name,
-                    'url': f"https://open.spotify.com/playlist/{playlist_id}",
-                    'image': playlist_image,
-                    'tracks': tracks,
-                    'total_tracks': total_tracks_count or len(tracks)
-                }
+            return {
+                'id': playlist_id,
+                'name': playlist_name,
+                'url': f"https://open.spotify.com/playlist/{playlist_id}",
+                'image': playlist_image,
+                'tracks': tracks,
+                'total_tracks': total_tracks_count or len(tracks)
+            }
                 
         except Exception as e:
             print(f"❌ Error fetching playlist: {e}")
             import traceback
             traceback.print_exc()
             return None
+    
+    async def get_album_info(self, album_url: str) -> Optional[Dict]:
+        """
+        Получить информацию об альбоме через Embed страницу
+        
+        Args:
+            album_url: URL альбома Spotify
+            
+        Returns:
+            Dict в том же формате, что и get_playlist_info
+        """
+        try:
+            parsed = self.parse_spotify_url(album_url)
+            if not parsed or parsed['type'] != 'album':
+                print("❌ Invalid album URL")
+                return None
+            
+            album_id = parsed['id']
+            embed_url = f"https://open.spotify.com/embed/album/{album_id}"
+            headers = {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
+            }
+            
+            print(f"🔍 Fetching album via: {embed_url}")
+            
+            response = await http_clients.get_async('spotify').get(embed_url, headers=headers, timeout=30.0)
+            if response.status_code != 200:
+                return None
+            
+            soup = BeautifulSoup(response.text, 'html.parser')
+            script_tag = soup.find('script', {'id': '__NEXT_DATA__', 'type': 'application/json'})
+            if not script_tag:
+                return None
+            
+            data = json.loads(script_tag.string)
+            entity = data.get('props', {}).get('pageProps', {}).get('state', {}).get('data', {}).get('entity', {})
+            if not entity:
+                return None
+            
+            album_name = entity.get('name') or entity.get('title') or 'Unknown Album'
+            images = entity.get('visualIdentity', {}).get('image', [])
+            album_image = images[0].get('url') if images else None
+            
+            tracks = []
+            for idx, t in enumerate(entity.get('trackList', [])):
+                tracks.append({
+                    'position': idx + 1,
+                    'id': t.get('uri', '').split(':')[-1] if 'uri' in t else f"idx_{idx}",
+                    'name': t.get('title', 'Unknown'),
+                    'artist': t.get('subtitle', 'Unknown Artist').replace('\u00a0', ' '),
+                    'duration': t.get('duration', 0) // 1000,
+                    'image': album_image,
+                    'album': album_name
+                })
+            
+            print(f"✅ Extracted {len(tracks)} tracks from album '{album_name}'")
+            
+            return {
+                'id': album_id,
+                'name': album_name,
+                'url': f"https://open.spotify.com/album/{album_id}",
+                'image': album_image,
+                'tracks': tracks,
+                'total_tracks': len(tracks)
+            }
+        
+        except Exception as e:
+            print(f"❌ Error fetching album: {e}")
+            return None
@@ -0,0 +1,180 @@
+"""
+Дисковый кэш фрагментов (chunks) файлов Telegram для стриминга в веб-плеере
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, Optional
+
+META_NAME = "meta.json"
+CHUNK_EXT = ".chunk"
+
+
+class StreamCache:
+    """
+    Хранит файлы Telegram фрагментами фиксированного размера, чтобы повторное
+    воспроизведение и перемотка читали диск, а не api.telegram.org.
+
+    Файл (по file_id) - это папка с meta.json (размер, ETag, Last-Modified,
+    тип) и фрагментами <номер>.chunk. Общий размер ограничен, вытесняются
+    давно не читанные фрагменты (LRU). Потокобезопасен: запросы Flask идут
+    из разных потоков.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, chunk_size: int = 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # (ключ файла, номер фрагмента) -> размер; порядок = от давно читанных к недавним
+        self._index: "OrderedDict[tuple, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        # Одновременные запросы одного файла не качают один фрагмент дважды
+        self._file_locks: Dict[str, threading.Lock] = {}
+        self._scan()
+
+    def key_for(self, file_id: str) -> str:
+        """
+        Имя папки файла (file_id длинный и содержит символы, неудобные для ФС).
+        Размер фрагмента входит в ключ: после его смены старые фрагменты просто вытесняются.
+        """
+        return hashlib.sha1(f"{file_id}:{self.chunk_size}".encode()).hexdigest()
+
+    def _file_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _chunk_path(self, key: str, index: int) -> str:
+        return os.path.join(self._file_dir(key), f"{index}{CHUNK_EXT}")
+
+    def _scan(self):
+        """Восстановить индекс по файлам на диске (после перезапуска)"""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            file_dir = self._file_dir(key)
+            if not os.path.isdir(file_dir):
+                continue
+            for name in os.listdir(file_dir):
+                if not name.endswith(CHUNK_EXT):
+                    continue
+                path = os.path.join(file_dir, name)
+                try:
+                    stat = os.stat(path)
+                    index = int(name[:-len(CHUNK_EXT)])
+                except (OSError, ValueError):
+                    continue
+                entries.append((stat.st_mtime, key, index, stat.st_size))
+        for _, key, index, size in sorted(entries):
+            self._index[(key, index)] = size
+            self._total_bytes += size
+        if entries:
+            print(f"🎧 Stream cache: {len(entries)} chunks, {self._total_bytes / 1024 / 1024:.1f} MB")
+
+    def file_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._file_locks.setdefault(key, threading.Lock())
+
+    # ========== МЕТАДАННЫЕ ==========
+
+    def get_meta(self, key: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(self._file_dir(key), META_NAME), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put_meta(self, key: str, meta: dict):
+        file_dir = self._file_dir(key)
+        os.makedirs(file_dir, exist_ok=True)
+        tmp_path = os.path.join(file_dir, f"{META_NAME}.part")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(file_dir, META_NAME))
+
+    # ========== ФРАГМЕНТЫ ==========
+
+    def get_chunk(self, key: str, index: int) -> Optional[bytes]:
+        """Фрагмент с диска или None; отмечает его как недавно прочитанный"""
+        with self._lock:
+            if (key, index) not in self._index:
+                return None
+            self._index.move_to_end((key, index))
+        try:
+            with open(self._chunk_path(key, index), 'rb') as f:
+                return f.read()
+        except OSError:
+            with self._lock:
+                size = self._index.pop((key, index), None)
+                if size is not None:
+                    self._total_bytes -= size
+            return None
+
+    def put_chunk(self, key: str, index: int, data: bytes):
+        """Сохранить фрагмент и вытеснить старые при превышении лимита"""
+        path = self._chunk_path(key, index)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.part"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            old = self._index.pop((key, index), None)
+            if old is not None:
+                self._total_bytes -= old
+            self._index[(key, index)] = len(data)
+            self._total_bytes += len(data)
+            evicted = self._evict_locked(keep=(key, index))
+        self._remove(evicted)
+
+    def read(self, key: str, size: int, start: int, stop: int,
+             fetch_chunk: Callable[[int], bytes]) -> Iterator[bytes]:
+        """
+        Отдать байты [start, stop) файла размера size по фрагментам.
+        Отсутствующие фрагменты запрашиваются через fetch_chunk(номер) и сохраняются.
+        """
+        position = start
+        while position < stop:
+            index = position // self.chunk_size
+            data = self.get_chunk(key, index)
+            if data is None:
+                with self.file_lock(key):
+                    data = self.get_chunk(key, index)
+                    if data is None:
+                        data = fetch_chunk(index)
+                        expected = min(self.chunk_size, size - index * self.chunk_size)
+                        if len(data) != expected:
+                            raise IOError(f"Chunk {index} size mismatch: {len(data)} != {expected}")
+                        self.put_chunk(key, index, data)
+            offset = position - index * self.chunk_size
+            piece = data[offset:offset + (stop - position)]
+            yield piece
+            position += len(piece)
+
+    def _evict_locked(self, keep: tuple = None) -> list:
+        evicted = []
+        while self._total_bytes > self.max_bytes and len(self._index) > 1:
+            entry, size = next(iter(self._index.items()))
+            if entry == keep:
+                break
+            del self._index[entry]
+            self._total_bytes -= size
+            evicted.append(entry)
+        return evicted
+
+    def _remove(self, evicted: list):
+        for key, index in evicted:
+            try:
+                os.remove(self._chunk_path(key, index))
+            except OSError:
+                pass
+            # Последний фрагмент файла ушел - убираем и метаданные
+            file_dir = self._file_dir(key)
+            try:
+                if not any(name.endswith(CHUNK_EXT) for name in os.listdir(file_dir)):
+                    os.remove(os.path.join(file_dir, META_NAME))
+                    # Не удаляется, если в папку как раз пишется новый фрагмент
+                    os.rmdir(file_dir)
+            except OSError:
+                pass
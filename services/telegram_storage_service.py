@@ -2,224 +2,287 @@
 Сервис для работы с Telegram Storage Channel
 """
 import os
-from typing import Optional, Dict
-import httpx
+from typing import Optional, Dict, Tuple
 import config
+from .http_client import http_clients
 
 
-class TelegramStorageService:
-    """Сервис для загрузки и получения файлов из Telegram Storage Channel"""
-    
+class _TelegramStorageBase:
+    """
+    Общая часть синхронного и асинхронного сервиса: сборка запросов к Bot API
+    и разбор ответов. Наследники отличаются только транспортом
+    (httpx.Client или httpx.AsyncClient) и тем, как отправляют запрос.
+    """
+
     def __init__(self, bot_token: str = None, channel_id: str = None):
         self.bot_token = bot_token or config.TELEGRAM_BOT_TOKEN
         self.channel_id = channel_id or config.STORAGE_CHANNEL_ID
         self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
+
+    def _file_url(self, file_path: str) -> str:
+        return f"https://api.telegram.org/file/bot{self.bot_token}/{file_path}"
+
+    # ========== ЗАПРОСЫ ==========
+    # Каждый метод возвращает (HTTP-метод, URL, аргументы запроса httpx)
+
+    def _upload_request(self, api_method: str, field: str, file_obj, caption: str = None) -> Tuple[str, str, Dict]:
+        data = {'chat_id': self.channel_id}
+        if caption:
+            data['caption'] = caption
+        return 'POST', f"{self.base_url}/{api_method}", {
+            'files': {field: file_obj},
+            'data': data,
+            'timeout': 120.0
+        }
+
+    def _get_file_request(self, file_id: str) -> Tuple[str, str, Dict]:
+        return 'GET', f"{self.base_url}/getFile", {'params': {'file_id': file_id}, 'timeout': 30.0}
+
+    def _pin_request(self, message_id: int) -> Tuple[str, str, Dict]:
+        return 'POST', f"{self.base_url}/pinChatMessage", {
+            'data': {
+                'chat_id': self.channel_id,
+                'message_id': message_id,
+                'disable_notification': True
+            },
+            'timeout': 30.0
+        }
+
+    def _get_chat_request(self) -> Tuple[str, str, Dict]:
+        return 'GET', f"{self.base_url}/getChat", {'params': {'chat_id': self.channel_id}, 'timeout': 30.0}
+
+    def _delete_request(self, message_id: int) -> Tuple[str, str, Dict]:
+        return 'POST', f"{self.base_url}/deleteMessage", {
+            'data': {
+                'chat_id': self.channel_id,
+                'message_id': message_id
+            },
+            'timeout': 10.0
+        }
+
+    # ========== РАЗБОР ОТВЕТОВ ==========
+
+    @staticmethod
+    def _check_upload_file(file_path: str) -> Optional[int]:
+        """Размер загружаемого файла или None, если файла нет"""
+        if not os.path.exists(file_path):
+            print(f"❌ File not found: {file_path}")
+            return None
+        return os.path.getsize(file_path)
+
+    @staticmethod
+    def _result(response) -> Optional[Dict]:
+        """Поле result успешного ответа Bot API"""
+        if response.status_code != 200:
+            return None
+        data = response.json()
+        if not data.get('ok'):
+            return None
+        return data.get('result') or {}
+
+    @staticmethod
+    def _is_ok(response) -> bool:
+        return response.status_code == 200 and response.json().get('ok', False)
+
+    def _parse_audio_upload(self, response, file_size: int) -> Optional[Dict]:
+        audio = (self._result(response) or {}).get('audio')
+        if not audio:
+            print(f"❌ Failed to upload file to Telegram: {response.text}")
+            return None
+        file_id = audio['file_id']
+        print(f"✅ Uploaded to Telegram Storage: file_id={file_id[:20]}...")
+        return {
+            'file_id': file_id,
+            'file_path': audio.get('file_unique_id', ''),
+            'file_size': file_size,
+            'duration': audio.get('duration', 0)
+        }
+
+    def _parse_document_upload(self, response, file_size: int) -> Optional[Dict]:
+        message = self._result(response) or {}
+        document = message.get('document')
+        if not document:
+            print(f"❌ Failed to upload document to Telegram: {response.text}")
+            return None
+        file_name = document.get('file_name', '')
+        message_id = message.get('message_id')
+        print(f"✅ Uploaded document to Telegram: {file_name}, message_id={message_id}")
+        return {
+            'file_id': document['file_id'],
+            'file_name': file_name,
+            'file_size': file_size,
+            'message_id': message_id
+        }
+
+    def _parse_file_path(self, response) -> Optional[Dict]:
+        """result ответа getFile, если в нем есть file_path"""
+        result = self._result(response)
+        if not result or not result.get('file_path'):
+            print(f"❌ Failed to get file URL: {response.text}")
+            return None
+        return result
+
+    def _parse_pinned(self, response) -> Optional[Dict]:
+        return (self._result(response) or {}).get('pinned_message')
+
+    @staticmethod
+    def _parse_file_check(response) -> Optional[bool]:
+        """
+        Разобрать ответ getFile для проверки file_id
+
+        Returns:
+            True - файл жив, False - Telegram не знает такой file_id,
+            None - проверить не удалось (лимиты, ошибка сервера)
+        """
+        data = response.json()
+        if data.get('ok'):
+            return True
+        description = data.get('description', '').lower()
+        # Файлы больше 20 MB Bot API не отдает, но сам file_id при этом действителен
+        if 'file is too big' in description:
+            return True
+        if response.status_code == 400:
+            return False
+        return None
+
+
+class TelegramStorageService(_TelegramStorageBase):
+    """Сервис для загрузки и получения файлов из Telegram Storage Channel"""
+
+    def __init__(self, bot_token: str = None, channel_id: str = None):
+        super().__init__(bot_token, channel_id)
         print(f"📦 Telegram Storage initialized for channel: {self.channel_id}")
-    
+
+    @property
+    def http(self):
+        """Общий пул соединений к api.telegram.org"""
+        return http_clients.get_sync('telegram')
+
+    def _send(self, request: Tuple[str, str, Dict]):
+        method, url, kwargs = request
+        return self.http.request(method, url, **kwargs)
+
     def upload_file(self, file_path: str, caption: str = None) -> Optional[Dict]:
         """
         Загрузить файл в Telegram Storage Channel
-        
+
         Args:
             file_path: Путь к файлу
             caption: Описание файла (опционально)
-            
+
         Returns:
             Dict с file_id и file_path или None при ошибке
         """
         try:
-            if not os.path.exists(file_path):
-                print(f"❌ File not found: {file_path}")
+            file_size = self._check_upload_file(file_path)
+            if file_size is None:
                 return None
-            
-            file_size = os.path.getsize(file_path)
             print(f"📤 Uploading to Telegram Storage: {os.path.basename(file_path)} ({file_size / 1024 / 1024:.2f} MB)")
-            
-            # Отправляем файл в канал через HTTP API
+
             with open(file_path, 'rb') as audio_file:
-                files = {'audio': audio_file}
-                data = {'chat_id': self.channel_id}
-                if caption:
-                    data['caption'] = caption
-                
-                response = httpx.post(
-                    f"{self.base_url}/sendAudio",
-                    files=files,
-                    data=data,
-                    timeout=120.0
-                )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('ok') and result.get('result', {}).get('audio'):
-                    audio = result['result']['audio']
-                    file_id = audio['file_id']
-                    telegram_file_path = audio.get('file_unique_id', '')
-                    
-                    print(f"✅ Uploaded to Telegram Storage: file_id={file_id[:20]}...")
-                    
-                    return {
-                        'file_id': file_id,
-                        'file_path': telegram_file_path,
-                        'file_size': file_size,
-                        'duration': audio.get('duration', 0)
-                    }
-            
-            print(f"❌ Failed to upload file to Telegram: {response.text}")
-            return None
-                
+                response = self._send(self._upload_request('sendAudio', 'audio', audio_file, caption))
+            return self._parse_audio_upload(response, file_size)
+
         except Exception as e:
             print(f"❌ Error uploading to Telegram Storage: {e}")
             import traceback
             traceback.print_exc()
             return None
-    
+
     def get_file_url(self, file_id: str) -> Optional[str]:
         """
         Получить прямую ссылку на файл из Telegram
-        
+
         Args:
             file_id: ID файла в Telegram
-            
+
         Returns:
             URL для скачивания или None при ошибке
         """
         try:
-            response = httpx.get(
-                f"{self.base_url}/getFile",
-                params={'file_id': file_id},
-                timeout=30.0
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('ok') and result.get('result', {}).get('file_path'):
-                    file_path = result['result']['file_path']
-                    url = f"https://api.telegram.org/file/bot{self.bot_token}/{file_path}"
-                    return url
-            
-            print(f"❌ Failed to get file URL: {response.text}")
-            return None
-            
+            result = self._parse_file_path(self._send(self._get_file_request(file_id)))
+            return self._file_url(result['file_path']) if result else None
         except Exception as e:
             print(f"❌ Error getting file URL: {e}")
             return None
-    
+
     def file_exists(self, file_id: str) -> bool:
         """
         Проверить, существует ли файл в Telegram
-        
+
         Args:
             file_id: ID файла в Telegram
-            
+
         Returns:
             True если файл существует, False иначе
         """
         try:
-            response = httpx.get(
-                f"{self.base_url}/getFile",
-                params={'file_id': file_id},
-                timeout=30.0
-            )
-            return response.status_code == 200 and response.json().get('ok', False)
-        except:
+            return self._is_ok(self._send(self._get_file_request(file_id)))
+        except Exception:
             return False
-    
+
     def upload_document(self, file_path: str, caption: str = None) -> Optional[Dict]:
         """
         Загрузить документ (например, БД файл) в Telegram Storage Channel
-        
+
         Args:
             file_path: Путь к файлу
             caption: Описание файла (опционально)
-            
+
         Returns:
             Dict с file_id и file_path или None при ошибке
         """
         try:
-            if not os.path.exists(file_path):
-                print(f"❌ File not found: {file_path}")
+            file_size = self._check_upload_file(file_path)
+            if file_size is None:
                 return None
-            
-            file_size = os.path.getsize(file_path)
             print(f"📤 Uploading document to Telegram: {os.path.basename(file_path)} ({file_size / 1024:.2f} KB)")
-            
-            # Отправляем файл как document в канал через HTTP API
+
             with open(file_path, 'rb') as doc_file:
-                files = {'document': doc_file}
-                data = {'chat_id': self.channel_id}
-                if caption:
-                    data['caption'] = caption
-                
-                response = httpx.post(
-                    f"{self.base_url}/sendDocument",
-                    files=files,
-                    data=data,
-                    timeout=120.0
-                )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('ok') and result.get('result', {}).get('document'):
-                    message = result['result']
-                    document = message['document']
-                    file_id = document['file_id']
-                    file_name = document.get('file_name', '')
-                    message_id = message.get('message_id')
-                    
-                    print(f"✅ Uploaded document to Telegram: {file_name}, message_id={message_id}")
-                    
-                    return {
-                        'file_id': file_id,
-                        'file_name': file_name,
-                        'file_size': file_size,
-                        'message_id': message_id
-                    }
-            
-            print(f"❌ Failed to upload document to Telegram: {response.text}")
-            return None
-                
+                response = self._send(self._upload_request('sendDocument', 'document', doc_file, caption))
+            return self._parse_document_upload(response, file_size)
+
         except Exception as e:
             print(f"❌ Error uploading document to Telegram: {e}")
             import traceback
             traceback.print_exc()
             return None
-    
+
     def download_file(self, file_id: str, save_path: str) -> bool:
         """
         Скачать файл из Telegram и сохранить локально
-        
+
         Args:
             file_id: ID файла в Telegram
             save_path: Путь для сохранения файла
-            
+
         Returns:
             True если файл успешно скачан
         """
         try:
             # Получаем информацию о файле
             file_url = self.get_file_url(file_id)
-            
+
             if not file_url:
                 print("❌ Failed to get file URL")
                 return False
-            
+
             print(f"📥 Downloading file from Telegram...")
-            
+
             # Скачиваем файл
-            response = httpx.get(file_url, timeout=120.0)
-            
+            response = self.http.get(file_url, timeout=120.0)
+
             if response.status_code == 200:
                 # Сохраняем файл
                 with open(save_path, 'wb') as f:
                     f.write(response.content)
-                
+
                 print(f"✅ File downloaded: {save_path} ({len(response.content) / 1024:.2f} KB)")
                 return True
             else:
                 print(f"❌ Failed to download file: HTTP {response.status_code}")
                 return False
-                
+
         except Exception as e:
             print(f"❌ Error downloading file: {e}")
             import traceback
@@ -229,16 +292,7 @@ class TelegramStorageService:
     def pin_message(self, message_id: int) -> bool:
         """Закрепить сообщение в канале"""
         try:
-            response = httpx.post(
-                f"{self.base_url}/pinChatMessage",
-                data={
-                    'chat_id': self.channel_id,
-                    'message_id': message_id,
-                    'disable_notification': True
-                },
-                timeout=30.0
-            )
-            return response.status_code == 200 and response.json().get('ok', False)
+            return self._is_ok(self._send(self._pin_request(message_id)))
         except Exception as e:
             print(f"❌ Error pinning message: {e}")
             return False
@@ -246,16 +300,176 @@ class TelegramStorageService:
     def get_pinned_message(self) -> Optional[Dict]:
         """Получить закрепленное сообщение в канале"""
         try:
-            response = httpx.get(
-                f"{self.base_url}/getChat",
-                params={'chat_id': self.channel_id},
-                timeout=30.0
-            )
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('ok') and result.get('result', {}).get('pinned_message'):
-                    return result['result']['pinned_message']
+            return self._parse_pinned(self._send(self._get_chat_request()))
+        except Exception as e:
+            print(f"❌ Error getting pinned message: {e}")
             return None
+
+    def delete_message(self, message_id: int) -> bool:
+        """Удалить сообщение из канала"""
+        try:
+            return self._is_ok(self._send(self._delete_request(message_id)))
+        except Exception as e:
+            print(f"❌ Error deleting message: {e}")
+            return False
+
+
+class AsyncTelegramStorageService(_TelegramStorageBase):
+    """
+    Асинхронный вариант TelegramStorageService для кода внутри event loop
+    (бот, бэкапы, скрипты). Файлы отправляются потоковым multipart прямо с диска
+    и не блокируют обработку апдейтов на время загрузки.
+    Синхронный TelegramStorageService остается для Flask.
+    """
+
+    def __init__(self, bot_token: str = None, channel_id: str = None, db_manager=None):
+        super().__init__(bot_token, channel_id)
+        # С БД ответы getFile кэшируются на TELEGRAM_FILE_PATH_TTL
+        self.db = db_manager
+        print(f"📦 Async Telegram Storage initialized for channel: {self.channel_id}")
+
+    async def _remember_file_path(self, file_id: str, result: dict):
+        """Сохранить путь из ответа getFile в кэш"""
+        file_path = (result or {}).get('file_path')
+        if not self.db or not file_path:
+            return
+        try:
+            await self.db.save_telegram_file_path(file_id, file_path)
+        except Exception as e:
+            print(f"⚠️ Failed to cache file path: {e}")
+
+    @property
+    def client(self):
+        """Общий асинхронный пул соединений к api.telegram.org для текущего цикла"""
+        return http_clients.get_async('telegram')
+
+    async def _send(self, request: Tuple[str, str, Dict]):
+        method, url, kwargs = request
+        return await self.client.request(method, url, **kwargs)
+
+    async def upload_file(self, file_path: str, caption: str = None) -> Optional[Dict]:
+        """Загрузить аудиофайл в Telegram Storage Channel"""
+        try:
+            file_size = self._check_upload_file(file_path)
+            if file_size is None:
+                return None
+            print(f"📤 Uploading to Telegram Storage: {os.path.basename(file_path)} ({file_size / 1024 / 1024:.2f} MB)")
+
+            with open(file_path, 'rb') as audio_file:
+                response = await self._send(self._upload_request('sendAudio', 'audio', audio_file, caption))
+            return self._parse_audio_upload(response, file_size)
+
+        except Exception as e:
+            print(f"❌ Error uploading to Telegram Storage: {e}")
+            return None
+
+    async def get_file_url(self, file_id: str) -> Optional[str]:
+        """Получить прямую ссылку на файл (путь getFile берется из кэша, пока он действителен)"""
+        if self.db:
+            try:
+                cached_path = await self.db.get_telegram_file_path(file_id)
+                if cached_path:
+                    return self._file_url(cached_path)
+            except Exception as e:
+                print(f"⚠️ File path cache error: {e}")
+        try:
+            result = self._parse_file_path(await self._send(self._get_file_request(file_id)))
+            if not result:
+                return None
+            await self._remember_file_path(file_id, result)
+            return self._file_url(result['file_path'])
+        except Exception as e:
+            print(f"❌ Error getting file URL: {e}")
+            return None
+
+    async def file_exists(self, file_id: str) -> bool:
+        """Проверить, существует ли файл в Telegram"""
+        return bool(await self.check_file_id(file_id))
+
+    async def check_file_id(self, file_id: str) -> Optional[bool]:
+        """
+        Проверить file_id через getFile
+
+        Returns:
+            True - файл жив, False - Telegram не знает такой file_id,
+            None - проверить не удалось (сеть, лимиты, ошибка сервера)
+        """
+        try:
+            response = await self._send(self._get_file_request(file_id))
+            status = self._parse_file_check(response)
+        except Exception:
+            return None
+
+        if status and response.status_code == 200:
+            # Ответ проверки годится и для стриминга
+            await self._remember_file_path(file_id, response.json().get('result'))
+        return status
+
+    async def upload_document(self, file_path: str, caption: str = None) -> Optional[Dict]:
+        """Загрузить документ (например, файл БД) в Telegram Storage Channel"""
+        try:
+            file_size = self._check_upload_file(file_path)
+            if file_size is None:
+                return None
+            print(f"📤 Uploading document to Telegram: {os.path.basename(file_path)} ({file_size / 1024:.2f} KB)")
+
+            with open(file_path, 'rb') as doc_file:
+                response = await self._send(self._upload_request('sendDocument', 'document', doc_file, caption))
+            return self._parse_document_upload(response, file_size)
+
+        except Exception as e:
+            print(f"❌ Error uploading document to Telegram: {e}")
+            return None
+
+    async def download_file(self, file_id: str, save_path: str) -> bool:
+        """Скачать файл из Telegram потоком прямо на диск"""
+        try:
+            file_url = await self.get_file_url(file_id)
+
+            if not file_url:
+                print("❌ Failed to get file URL")
+                return False
+
+            print(f"📥 Downloading file from Telegram...")
+
+            async with self.client.stream('GET', file_url, timeout=120.0) as response:
+                if response.status_code != 200:
+                    print(f"❌ Failed to download file: HTTP {response.status_code}")
+                    return False
+
+                size = 0
+                with open(save_path, 'wb') as f:
+                    async for chunk in response.aiter_bytes():
+                        f.write(chunk)
+                        size += len(chunk)
+
+            print(f"✅ File downloaded: {save_path} ({size / 1024:.2f} KB)")
+            return True
+
+        except Exception as e:
+            print(f"❌ Error downloading file: {e}")
+            return False
+
+    async def pin_message(self, message_id: int) -> bool:
+        """Закрепить сообщение в канале"""
+        try:
+            return self._is_ok(await self._send(self._pin_request(message_id)))
+        except Exception as e:
+            print(f"❌ Error pinning message: {e}")
+            return False
+
+    async def get_pinned_message(self) -> Optional[Dict]:
+        """Получить закрепленное сообщение в канале"""
+        try:
+            return self._parse_pinned(await self._send(self._get_chat_request()))
         except Exception as e:
             print(f"❌ Error getting pinned message: {e}")
             return None
+
+    async def delete_message(self, message_id: int) -> bool:
+        """Удалить сообщение из канала"""
+        try:
+            return self._is_ok(await self._send(self._delete_request(message_id)))
+        except Exception as e:
+            print(f"❌ Error deleting message: {e}")
+            return False
@@ -17,8 +17,13 @@ def main():
         # 1. Start Web App with Gunicorn (production WSGI server)
         print("🔗 Starting Web Interface (Gunicorn)...")
         port = env.get('PORT', '5000')
+        # Один воркер: фоновые задания и их SSE живут в памяти процесса.
+        # Долгая работа идет в event loop, потоки только отвечают и держат SSE.
+        threads = env.get('WEB_THREADS', '128')
         web_process = subprocess.Popen(
-            ["gunicorn", "--bind", f"0.0.0.0:{port}", "--workers", "2", "--timeout", "120", "web.app:app"],
+            ["gunicorn", "--bind", f"0.0.0.0:{port}", "--workers", "1",
+             "--worker-class", "gthread", "--threads", threads,
+             "--timeout", "120", "web.app:app"],
             env=env,
             stdout=sys.stdout,
             stderr=sys.stderr
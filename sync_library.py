@@ -3,23 +3,31 @@ import asyncio
 import os
 import sys
 from datetime import datetime
-from sqlalchemy import select, or_
+from sqlalchemy import select, func
 
 # Add project root to sys.path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from database.db_manager import DatabaseManager
 from database.models import Track, TrackCache, TelegramFile
-from services.telegram_storage_service import TelegramStorageService
+from services.telegram_storage_service import AsyncTelegramStorageService
+
+# Одновременных проверок file_id через getFile
+VERIFY_CONCURRENCY = 10
 
 async def sync_discovery():
     print("🔄 Starting Discovery Sync...")
     db = DatabaseManager()
     await db.init_db()
     
-    storage = TelegramStorageService()
+    storage = AsyncTelegramStorageService()
     
     async with db.async_session() as session:
+        # Уже известные файлы одним запросом вместо session.get на каждый трек
+        result = await session.execute(select(TelegramFile.track_id))
+        known_ids = set(result.scalars().all())
+        new_entries = []
+        
         # 1. Находим все треки из legacy кэша
         result = await session.execute(
             select(Track).where(Track.telegram_file_id != None)
@@ -28,60 +36,69 @@ async def sync_discovery():
         print(f"🔍 Found {len(tracks_with_legacy_id)} tracks with legacy telegram_file_id")
         
         for track in tracks_with_legacy_id:
-            tg_check = await session.get(TelegramFile, track.id)
-            if not tg_check:
+            if track.id not in known_ids:
                 print(f"➕ Adding {track.artist} - {track.name} to TelegramFile from legacy ID")
-                new_file = TelegramFile(
-                    track_id=track.id,
-                    file_id=track.telegram_file_id,
-                    artist=track.artist,
-                    track_name=track.name,
-                    uploaded_at=track.cached_at or track.created_at or datetime.utcnow()
-                )
-                session.add(new_file)
+                new_entries.append({
+                    'track_id': track.id,
+                    'file_id': track.telegram_file_id,
+                    'artist': track.artist,
+                    'track_name': track.name,
+                    'uploaded_at': track.cached_at or track.created_at or datetime.utcnow()
+                })
+                known_ids.add(track.id)
         
-        # 2. Проверяем TrackCache
-        result = await session.execute(select(TrackCache))
-        cache_entries = result.scalars().all()
+        # 2. Проверяем TrackCache (треки подгружаются тем же запросом)
+        result = await session.execute(
+            select(TrackCache, Track).join(Track, Track.id == TrackCache.track_id)
+        )
+        cache_entries = result.all()
         print(f"🔍 Found {len(cache_entries)} cache entries")
         
-        for entry in cache_entries:
-            tg_check = await session.get(TelegramFile, entry.track_id)
-            if not tg_check:
-                track = await session.get(Track, entry.track_id)
-                if track:
-                    print(f"➕ Adding {track.artist} - {track.name} to TelegramFile from cache")
-                    new_file = TelegramFile(
-                        track_id=entry.track_id,
-                        file_id=entry.telegram_file_id,
-                        artist=track.artist,
-                        track_name=track.name,
-                        uploaded_at=entry.created_at or datetime.utcnow()
-                    )
-                    session.add(new_file)
-        
-        await session.commit()
+        for entry, track in cache_entries:
+            if entry.track_id not in known_ids:
+                print(f"➕ Adding {track.artist} - {track.name} to TelegramFile from cache")
+                new_entries.append({
+                    'track_id': entry.track_id,
+                    'file_id': entry.telegram_file_id,
+                    'artist': track.artist,
+                    'track_name': track.name,
+                    'uploaded_at': entry.created_at or datetime.utcnow()
+                })
+                known_ids.add(entry.track_id)
         
         # 3. Верификация существующих записей в Telegram Channel
         # Мы проверяем, что файлы реально доступны в Telegram
         result = await session.execute(select(TelegramFile))
         all_files = result.scalars().all()
-        print(f"🧐 Verifying {len(all_files)} files in Telegram Storage...")
-        
-        deleted_count = 0
-        for tg_file in all_files:
-            if not storage.file_exists(tg_file.file_id):
-                print(f"🗑️ Removing orphaned record (file not in channel): {tg_file.artist} - {tg_file.track_name}")
-                await session.delete(tg_file)
-                deleted_count += 1
-        
-        await session.commit()
-        print(f"✅ Discovery Sync complete! Cleaned up {deleted_count} orphaned records.")
-        
-        # Финальный отчет
-        result = await session.execute(select(TelegramFile))
-        final_files = result.scalars().all()
-        print(f"📊 Total valid tracks in Discover: {len(final_files)}")
+    
+    await db.upsert_telegram_files(new_entries, overwrite=False)
+    all_files += [TelegramFile(**entry) for entry in new_entries]
+    print(f"🧐 Verifying {len(all_files)} files in Telegram Storage...")
+    
+    # Проверки идут параллельно через общий пул соединений
+    semaphore = asyncio.Semaphore(VERIFY_CONCURRENCY)
+    
+    async def check(tg_file):
+        async with semaphore:
+            return await storage.check_file_id(tg_file.file_id)
+    
+    exists = await asyncio.gather(*(check(tg_file) for tg_file in all_files))
+    orphaned = []
+    for tg_file, ok in zip(all_files, exists):
+        # None - проверить не удалось (сеть, лимиты): такие записи не трогаем
+        if ok is False:
+            print(f"🗑️ Removing orphaned record (file not in channel): {tg_file.artist} - {tg_file.track_name}")
+            orphaned.append(tg_file.track_id)
+    
+    deleted_count = await db.delete_telegram_files(orphaned)
+    print(f"✅ Discovery Sync complete! Cleaned up {deleted_count} orphaned records.")
+    
+    # Финальный отчет
+    async with db.async_session() as session:
+        result = await session.execute(select(func.count()).select_from(TelegramFile))
+        print(f"📊 Total valid tracks in Discover: {result.scalar()}")
+    
+    await db.close()
 
 if __name__ == "__main__":
     asyncio.run(sync_discovery())
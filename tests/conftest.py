@@ -0,0 +1,37 @@
+"""
+Общие настройки тестов: config требует токен бота и читает DATABASE_URL при импорте,
+поэтому окружение задается до импорта модулей проекта
+"""
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+_TEST_DIR = tempfile.mkdtemp(prefix="spotify_bot_tests_")
+
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:test-token')
+os.environ.setdefault('DATABASE_URL', f"sqlite+aiosqlite:///{os.path.join(_TEST_DIR, 'test.db')}")
+
+
+@pytest.fixture
+def run_db(tmp_path):
+    """
+    Выполнить scenario(db) на свежей SQLite-базе в одном event loop
+    (соединения aiosqlite привязаны к циклу, в котором созданы)
+    """
+    from database.db_manager import DatabaseManager
+
+    def run(scenario, start_writer: bool = False):
+        async def main():
+            db = DatabaseManager(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+            await db.init_db()
+            if start_writer:
+                db.start_writer()
+            try:
+                return await scenario(db)
+            finally:
+                await db.close()
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,84 @@
+"""
+Тесты пакетного скачивания: file_id сохраняются сразу после отправки, ошибки треков не срывают подборку
+"""
+import asyncio
+from types import SimpleNamespace
+
+from handlers.bulk_download import handle_collection_link
+
+TRACKS = [
+    {'id': 'cached', 'name': 'Cached', 'artist': 'A'},
+    {'id': 'fresh', 'name': 'Fresh', 'artist': 'A'},
+    {'id': 'broken', 'name': 'Broken', 'artist': 'A'},
+]
+
+
+class _StatusMessage:
+    def __init__(self):
+        self.texts = []
+
+    async def edit_text(self, text, **kwargs):
+        self.texts.append(text)
+
+
+class _Message:
+    text = 'https://open.spotify.com/playlist/p1'
+
+    def __init__(self):
+        self.status = _StatusMessage()
+        self.sent = []
+
+    async def reply_text(self, text, **kwargs):
+        return self.status
+
+    async def reply_audio(self, audio, title, **kwargs):
+        self.sent.append(title)
+        return SimpleNamespace(audio=SimpleNamespace(file_id=f"file-{title}"))
+
+
+class _DownloadService:
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.cleaned = []
+
+    async def search_and_download_by_query(self, query, track_id, **kwargs):
+        if track_id == 'broken':
+            raise RuntimeError("yt-dlp failed")
+        path = self.tmp_path / f"{track_id}.mp3"
+        path.write_bytes(b"audio")
+        return {'file_path': str(path), 'file_size': 5}
+
+    def cleanup_file(self, path):
+        self.cleaned.append(path)
+
+
+class _Spotify:
+    async def get_playlist_info(self, url):
+        return {'name': 'Mix', 'tracks': TRACKS}
+
+
+def test_failed_track_does_not_lose_uploaded_file_ids(run_db, tmp_path):
+    message = _Message()
+    download_service = _DownloadService(tmp_path)
+
+    async def scenario(db):
+        await db.get_or_create_tracks([
+            {'id': t['id'], 'name': t['name'], 'artist': t['artist'], 'spotify_url': f"u-{t['id']}"}
+            for t in TRACKS
+        ])
+        await db.upsert_track_caches([
+            {'track_id': 'cached', 'telegram_file_id': 'file-old', 'file_format': 'mp3', 'quality': '320'}
+        ])
+        update = SimpleNamespace(message=message, effective_user=SimpleNamespace(id=1))
+        context = SimpleNamespace(bot_data={'spotify': _Spotify(), 'download_service': download_service, 'db': db})
+        user = SimpleNamespace(language='en', preferred_quality='320', format='mp3')
+
+        await handle_collection_link(update, context, {'type': 'playlist'}, user)
+        return await db.get_cached_file_ids([t['id'] for t in TRACKS], file_format='mp3', quality='320')
+
+    cached = run_db(scenario)
+    # Исключение при скачивании одного трека не отменяет остальные и не теряет их file_id
+    assert cached == {'cached': 'file-old', 'fresh': 'file-Fresh'}
+    assert message.sent == ['Cached', 'Fresh']
+    assert download_service.cleaned == [str(tmp_path / "fresh.mp3")]
+    assert "Sent: 2 of 3" in message.status.texts[-1] and "Failed: 1" in message.status.texts[-1]
@@ -0,0 +1,108 @@
+"""
+Тесты поиска по каталогу (FTS5): префиксы, изменения треков, VACUUM и переход с миграции 6
+"""
+from sqlalchemy import delete, text
+
+from database.migrations import MIGRATIONS, run_migrations
+from database.models import Track
+
+TRACKS = [
+    {'id': 'sp1', 'name': 'Bohemian Rhapsody', 'artist': 'Queen', 'album': 'A Night at the Opera'},
+    {'id': 'sp2', 'name': 'Under Pressure', 'artist': 'Queen', 'album': 'Hot Space'},
+    {'id': 'sp3', 'name': 'Crème Brûlée', 'artist': 'Café Tacvba', 'album': None},
+    {'id': 'sp4', 'name': 'Queen of Hearts', 'artist': 'Someone', 'album': None},
+]
+
+
+def _ids(results) -> list:
+    return [track['id'] for track in results]
+
+
+async def _vacuum(db):
+    async with db.engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("VACUUM"))
+
+
+def test_search_by_prefix_and_diacritics(run_db):
+    async def scenario(db):
+        await db.upsert_tracks(TRACKS)
+        return (
+            await db.search_catalog('queen pres'),
+            await db.search_catalog('creme brulee'),
+            await db.search_catalog('"queen*: ^('),
+            await db.search_catalog('nothing here'),
+        )
+
+    prefix, diacritics, special, missing = run_db(scenario)
+    assert _ids(prefix) == ['sp2']
+    assert _ids(diacritics) == ['sp3']
+    # Служебные символы FTS5 не ломают запрос
+    assert set(_ids(special)) == {'sp1', 'sp2', 'sp4'}
+    assert missing == []
+
+
+def test_index_follows_updates_deletes_and_files(run_db):
+    async def scenario(db):
+        await db.upsert_tracks(TRACKS)
+        await db.upsert_tracks([{**TRACKS[0], 'name': 'Killer Queen'}])
+
+        async def _delete(session):
+            await session.execute(delete(Track).where(Track.id == 'sp2'))
+        await db.run_write(_delete)
+        # Метаданные загруженного файла тоже ищутся
+        await db.upsert_telegram_files([
+            {'track_id': 'sp4', 'file_id': 'f4', 'artist': 'Other Name', 'track_name': 'Alt Title'}
+        ])
+        return (
+            await db.search_catalog('killer'),
+            await db.search_catalog('bohemian'),
+            await db.search_catalog('pressure'),
+            await db.search_catalog('alt title'),
+        )
+
+    renamed, old_name, deleted, by_file = run_db(scenario)
+    assert _ids(renamed) == ['sp1'] and old_name == []
+    assert deleted == []
+    assert _ids(by_file) == ['sp4'] and by_file[0]['cached']
+
+
+def test_results_stay_correct_after_vacuum(run_db):
+    async def scenario(db):
+        await db.upsert_tracks(TRACKS)
+
+        async def _delete(session):
+            await session.execute(delete(Track).where(Track.id.in_(['sp1', 'sp2'])))
+        await db.run_write(_delete)
+        # Без INTEGER PRIMARY KEY VACUUM перенумеровывает rowid таблицы tracks
+        await _vacuum(db)
+        await db.upsert_tracks([{'id': 'sp5', 'name': 'Radio Ga Ga', 'artist': 'Queen'}])
+        return await db.search_catalog('queen'), await db.search_catalog('crème')
+
+    queen, creme = run_db(scenario)
+    assert sorted(_ids(queen)) == ['sp4', 'sp5']
+    assert _ids(creme) == ['sp3']
+
+
+def test_database_at_migration_6_is_moved_to_stable_rowids(run_db):
+    async def scenario(db):
+        # Состояние БД до миграции 8: индекс на tracks.rowid
+        async with db.engine.begin() as conn:
+            for name in ('tracks_ai', 'tracks_au', 'tracks_ad', 'files_ai', 'files_au', 'files_ad'):
+                await conn.execute(text(f"DROP TRIGGER catalog_fts_{name}"))
+            await conn.execute(text("DROP TABLE catalog_fts"))
+            await conn.execute(text("DROP TABLE catalog_rowids"))
+            await conn.execute(text("DELETE FROM schema_migrations WHERE version IN (6, 8)"))
+            for statement in next(m for m in MIGRATIONS if m[0] == 6)[2]:
+                await conn.execute(text(statement))
+            await conn.execute(text("INSERT INTO schema_migrations (version) VALUES (6)"))
+        await db.upsert_tracks(TRACKS)
+        async with db.engine.begin() as conn:
+            applied = await run_migrations(conn)
+        await _vacuum(db)
+        return applied, await db.search_catalog('queen pressure'), await db.search_catalog('opera')
+
+    applied, pressure, opera = run_db(scenario)
+    assert applied == 1
+    assert _ids(pressure) == ['sp2']
+    assert _ids(opera) == ['sp1']
@@ -0,0 +1,109 @@
+"""
+Тесты единого писателя БД: групповая фиксация и изоляция операций пачки через SAVEPOINT
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from database.models import User
+
+
+def _add_user(user_id: int):
+    async def _write(session):
+        await session.execute(insert(User).values(id=user_id))
+        return user_id
+    return _write
+
+
+async def _user_ids(db):
+    async with db.async_session() as session:
+        return sorted((await session.execute(select(User.id))).scalars().all())
+
+
+def test_batches_concurrent_writes_into_one_commit(run_db):
+    async def scenario(db):
+        results = await asyncio.gather(*(db.run_write(_add_user(i)) for i in range(1, 6)))
+        return results, db.write_stats.snapshot(), await _user_ids(db)
+
+    results, stats, user_ids = run_db(scenario, start_writer=True)
+    assert results == [1, 2, 3, 4, 5]
+    assert user_ids == [1, 2, 3, 4, 5]
+    assert stats['transactions'] == 1
+    assert stats['operations'] == 5
+
+
+def test_failed_operation_does_not_roll_back_batch(run_db):
+    async def scenario(db):
+        await db.run_write(_add_user(1))
+        # Повтор id=1 нарушает первичный ключ внутри той же пачки, что и соседние операции
+        results = await asyncio.gather(
+            db.run_write(_add_user(2)),
+            db.run_write(_add_user(1)),
+            db.run_write(_add_user(3)),
+            return_exceptions=True
+        )
+        return results, db.write_stats.transactions, await _user_ids(db)
+
+    results, transactions, user_ids = run_db(scenario, start_writer=True)
+    assert transactions == 2
+    assert results[0] == 2 and results[2] == 3
+    assert isinstance(results[1], IntegrityError)
+    assert user_ids == [1, 2, 3]
+
+
+def test_operation_error_reaches_caller(run_db):
+    async def scenario(db):
+        async def _write(session):
+            await session.execute(insert(User).values(id=10))
+            raise RuntimeError("operation failed")
+
+        with pytest.raises(RuntimeError, match="operation failed"):
+            await db.run_write(_write)
+        # Изменения упавшей операции откатываются вместе с ее SAVEPOINT
+        return await _user_ids(db)
+
+    assert run_db(scenario, start_writer=True) == []
+
+
+def test_stop_commits_queued_writes(run_db):
+    async def scenario(db):
+        pending = [asyncio.ensure_future(db.run_write(_add_user(i))) for i in range(1, 4)]
+        await asyncio.sleep(0)
+        await db.stop_writer()
+        await asyncio.gather(*pending)
+        return await _user_ids(db)
+
+    assert run_db(scenario, start_writer=True) == [1, 2, 3]
+
+
+def test_writes_directly_without_writer(run_db):
+    async def scenario(db):
+        await db.run_write(_add_user(7))
+        async with db.async_session() as session:
+            return (await session.execute(select(func.count(User.id)))).scalar()
+
+    assert run_db(scenario) == 1
+
+
+def test_submit_rejected_while_stopping_and_after_stop(run_db):
+    async def scenario(db):
+        writer = db._writer
+        pending = asyncio.ensure_future(db.run_write(_add_user(1)))
+        await asyncio.sleep(0)
+        stopping = asyncio.ensure_future(db.stop_writer())
+        await asyncio.sleep(0)
+        # Сигнал остановки уже в очереди - новой операции некому ответить
+        with pytest.raises(RuntimeError):
+            await writer.submit(_add_user(2))
+        # run_write в это время пишет напрямую и не зависает
+        await asyncio.wait_for(db.run_write(_add_user(3)), timeout=5)
+        await stopping
+        await pending
+        with pytest.raises(RuntimeError):
+            await writer.submit(_add_user(4))
+        await asyncio.wait_for(db.run_write(_add_user(5)), timeout=5)
+        return await _user_ids(db)
+
+    assert run_db(scenario, start_writer=True) == [1, 3, 5]
@@ -0,0 +1,92 @@
+"""
+Тесты дискового кэша downloads/: LRU-вытеснение, закрепления, недавние файлы других процессов, исключенные папки
+"""
+import os
+import time
+
+from services.disk_cache import DiskCacheManager
+
+
+def _file(root, name: str, size: int = 100, age: float = 0) -> str:
+    path = root / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    if age:
+        stamp = time.time() - age
+        os.utime(path, (stamp, stamp))
+    return str(path)
+
+
+def _age(path: str, seconds: float):
+    stamp = time.time() - seconds
+    os.utime(path, (stamp, stamp))
+
+
+def test_evicts_least_recently_used_files(tmp_path):
+    cache = DiskCacheManager(str(tmp_path), max_bytes=250, busy_grace=60)
+    a = _file(tmp_path, "a.mp3", age=600)
+    b = _file(tmp_path, "b.mp3", age=300)
+    cache.register(a)
+    cache.register(b)
+    assert cache.touch(a)
+    _age(a, 300)
+    _age(b, 300)
+    cache.register(_file(tmp_path, "c.mp3"))
+    # 'a' использован позже 'b' - вытесняется 'b'
+    assert os.path.exists(a) and not os.path.exists(b)
+    assert cache.total_bytes <= 250
+
+
+def test_recent_files_of_other_processes_are_kept(tmp_path):
+    # Файлы на диске созданы только что (например, ботом) - веб их не удаляет
+    for name in ("a.mp3", "b.mp3", "c.mp3"):
+        _file(tmp_path, name)
+    cache = DiskCacheManager(str(tmp_path), max_bytes=150, busy_grace=60)
+    assert sorted(os.listdir(tmp_path)) == ["a.mp3", "b.mp3", "c.mp3"]
+    assert cache.total_bytes == 300
+
+
+def test_pinned_file_is_not_evicted_until_unpinned(tmp_path):
+    cache = DiskCacheManager(str(tmp_path), max_bytes=150, busy_grace=0)
+    a = _file(tmp_path, "a.mp3")
+    cache.register(a)
+    with cache.pinned(a):
+        cache.register(_file(tmp_path, "b.mp3"))
+        assert os.path.exists(a)
+    cache.register(_file(tmp_path, "c.mp3"))
+    assert not os.path.exists(a)
+
+
+def test_stale_pin_expires(tmp_path):
+    cache = DiskCacheManager(str(tmp_path), max_bytes=150, pin_ttl=60, busy_grace=0)
+    a = _file(tmp_path, "a.mp3")
+    cache.register(a)
+    cache.pin(a)
+    # Обработчик завис и так и не снял закрепление
+    cache._pins[os.path.abspath(a)][1] = time.time() - 120
+    cache.register(_file(tmp_path, "b.mp3"))
+    assert not os.path.exists(a)
+    assert cache._pins == {}
+
+
+def test_excluded_dirs_and_partial_files_are_ignored(tmp_path):
+    _file(tmp_path, "sources/video.webm", size=1000, age=3600)
+    _file(tmp_path, "jobs/1/song.mp3.part", size=1000, age=3600)
+    song = _file(tmp_path, "jobs/1/song.mp3", age=3600)
+    cache = DiskCacheManager(str(tmp_path), max_bytes=50, exclude_dirs=[str(tmp_path / "sources")], busy_grace=60)
+    # Исходники считает свой кэш, недокачанные файлы не учитываются
+    assert os.path.exists(tmp_path / "sources" / "video.webm")
+    assert os.path.exists(tmp_path / "jobs" / "1" / "song.mp3.part")
+    assert not os.path.exists(song)
+    assert cache.total_bytes == 0
+
+
+def test_discard_forgets_removed_file(tmp_path):
+    cache = DiskCacheManager(str(tmp_path), max_bytes=1000)
+    a = _file(tmp_path, "a.mp3")
+    cache.register(a)
+    cache.pin(a)
+    os.remove(a)
+    cache.discard(a)
+    assert cache.total_bytes == 0 and cache._pins == {}
+    assert not cache.touch(a)
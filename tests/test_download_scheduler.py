@@ -0,0 +1,153 @@
+"""
+Тесты планировщика скачиваний: лимит воркеров, round robin между пользователями, лимиты очереди
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from services.download_scheduler import DownloadScheduler, QueueFullError
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = DownloadScheduler(max_workers=1, max_queued=10, max_queued_per_user=5)
+    yield scheduler
+    scheduler.shutdown()
+
+
+async def _wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        await asyncio.sleep(0.01)
+
+
+def test_limits_concurrent_jobs():
+    scheduler = DownloadScheduler(max_workers=2, max_queued=10, max_queued_per_user=10)
+    lock = threading.Lock()
+    running = 0
+    peak = 0
+
+    def job(value):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+        return value * 2
+
+    async def main():
+        return await asyncio.gather(*(scheduler.run(i % 3, job, i) for i in range(6)))
+
+    try:
+        assert asyncio.run(main()) == [0, 2, 4, 6, 8, 10]
+    finally:
+        scheduler.shutdown()
+    assert peak == 2
+
+
+def test_round_robin_between_users(scheduler):
+    gate = threading.Event()
+    order = []
+
+    def job(name):
+        if name == 'a1':
+            gate.wait(5)
+        order.append(name)
+
+    async def main():
+        first = asyncio.ensure_future(scheduler.run('a', job, 'a1'))
+        await _wait_until(lambda: scheduler._active == 1)
+        # Пока воркер занят, пользователь a ставит еще два задания, b - одно
+        rest = [asyncio.ensure_future(scheduler.run('a', job, name)) for name in ('a2', 'a3')]
+        await _wait_until(lambda: scheduler.queued_count == 2)
+        rest.append(asyncio.ensure_future(scheduler.run('b', job, 'b1')))
+        await _wait_until(lambda: scheduler.queued_count == 3)
+        gate.set()
+        await asyncio.gather(first, *rest)
+
+    asyncio.run(main())
+    # b не ждет, пока выполнятся все задания a
+    assert order == ['a1', 'a2', 'b1', 'a3']
+
+
+def test_reports_queue_positions(scheduler):
+    gate = threading.Event()
+    positions = []
+
+    async def main():
+        blocker = asyncio.ensure_future(scheduler.run('a', gate.wait, 5))
+        await _wait_until(lambda: scheduler._active == 1)
+        waiting = asyncio.ensure_future(scheduler.run('b', lambda: 'done', on_position=positions.append))
+        await _wait_until(lambda: positions == [1])
+        gate.set()
+        await blocker
+        return await waiting
+
+    assert asyncio.run(main()) == 'done'
+    assert positions == [1, 0]
+
+
+def test_rejects_jobs_over_per_user_limit():
+    scheduler = DownloadScheduler(max_workers=1, max_queued=10, max_queued_per_user=1)
+    gate = threading.Event()
+
+    async def main():
+        running = asyncio.ensure_future(scheduler.run('a', gate.wait, 5))
+        await _wait_until(lambda: scheduler._active == 1)
+        queued = asyncio.ensure_future(scheduler.run('a', lambda: None))
+        await _wait_until(lambda: scheduler.queued_count == 1)
+        try:
+            with pytest.raises(QueueFullError):
+                await scheduler.run('a', lambda: None)
+            # Лимит действует на пользователя, остальные в очередь попадают
+            other = asyncio.ensure_future(scheduler.run('b', lambda: 'b'))
+            await _wait_until(lambda: scheduler.queued_count == 2)
+        finally:
+            gate.set()
+        await asyncio.gather(running, queued)
+        return await other
+
+    try:
+        assert asyncio.run(main()) == 'b'
+    finally:
+        scheduler.shutdown()
+
+
+def test_cancelled_waiter_leaves_queue(scheduler):
+    gate = threading.Event()
+    executed = []
+
+    async def main():
+        running = asyncio.ensure_future(scheduler.run('a', gate.wait, 5))
+        await _wait_until(lambda: scheduler._active == 1)
+        queued = asyncio.ensure_future(scheduler.run('b', executed.append, 'b'))
+        await _wait_until(lambda: scheduler.queued_count == 1)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert scheduler.queued_count == 0
+        gate.set()
+        await running
+        await _wait_until(lambda: scheduler._active == 0)
+
+    asyncio.run(main())
+    assert executed == []
+
+
+def test_propagates_job_errors(scheduler):
+    def job():
+        raise ValueError("boom")
+
+    async def main():
+        with pytest.raises(ValueError, match="boom"):
+            await scheduler.run('a', job)
+        # Воркер освобождается и берет следующие задания
+        return await scheduler.run('a', lambda: 'ok')
+
+    assert asyncio.run(main()) == 'ok'
@@ -0,0 +1,59 @@
+"""
+Тесты фонового цикла веба: результат, таймаут с отменой корутины, ответ 504 маршрута
+"""
+import asyncio
+
+import pytest
+
+import config
+from web.event_loop import BackgroundLoop, LoopTimeoutError
+
+
+@pytest.fixture
+def loop():
+    loop = BackgroundLoop(name="test-loop")
+    yield loop
+    loop.stop()
+
+
+def test_run_returns_result(loop):
+    async def add(a, b):
+        await asyncio.sleep(0)
+        return a + b
+
+    assert loop.run(add(2, 3)) == 5
+
+
+def test_timeout_cancels_coroutine(loop, monkeypatch):
+    monkeypatch.setattr(config, 'WEB_LOOP_TIMEOUT', 0.05)
+    state = {}
+
+    async def hang():
+        state['started'] = True
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            state['cancelled'] = True
+            raise
+
+    # Без явного timeout действует значение из конфига
+    with pytest.raises(LoopTimeoutError):
+        loop.run(hang())
+    # Отмена доходит до корутины в цикле, она не висит дальше
+    assert loop.run(asyncio.sleep(0.05, result='alive'), timeout=5) == 'alive'
+    assert state == {'started': True, 'cancelled': True}
+
+
+def test_route_answers_504_on_timeout(monkeypatch):
+    import web.app as web_app
+
+    monkeypatch.setattr(web_app, 'db_initialized', True)
+    monkeypatch.setattr(config, 'WEB_LOOP_TIMEOUT', 0.05)
+
+    async def slow_search(query, limit):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(web_app.db, 'search_catalog', slow_search)
+    response = web_app.app.test_client().post('/api/search', json={'query': 'song'})
+    assert response.status_code == 504
+    assert 'timed out' in response.get_json()['error']
@@ -0,0 +1,131 @@
+"""
+Тесты проверки file_id (stale-while-revalidate): старые записи отдаются сразу и проверяются в фоне
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+import config
+from database.models import TrackCache
+
+
+async def _seed(db, age_days: float = 0):
+    await db.upsert_tracks([{'id': 't1', 'name': 'Song', 'artist': 'Artist'}])
+    await db.update_track_cache('t1', 'file-1', 'mp3', '320')
+    created_at = datetime.utcnow() - timedelta(days=age_days)
+
+    async def _write(session):
+        await session.execute(update(TrackCache).values(created_at=created_at))
+    await db.run_write(_write)
+    return created_at
+
+
+async def _entry(db):
+    async with db.async_session() as session:
+        return (await session.execute(select(TrackCache))).scalar_one_or_none()
+
+
+def _validator(answer, calls: list):
+    async def check(file_id):
+        calls.append(file_id)
+        await asyncio.sleep(0.01)
+        return answer
+    return check
+
+
+async def _settle(db):
+    await asyncio.gather(*list(db._revalidate_tasks))
+
+
+def test_fresh_entry_is_not_checked(run_db):
+    calls = []
+
+    async def scenario(db):
+        await _seed(db)
+        db.file_id_validator = _validator(True, calls)
+        file_id = await db.get_cached_file_id('t1', 'mp3', '320')
+        await _settle(db)
+        return file_id
+
+    assert run_db(scenario) == 'file-1'
+    assert calls == []
+
+
+def test_old_live_entry_is_served_and_refreshed_once(run_db):
+    calls = []
+
+    async def scenario(db):
+        created_at = await _seed(db, age_days=config.FILE_ID_REVALIDATE_DAYS + 1)
+        db.file_id_validator = _validator(True, calls)
+        # Одновременные обращения запускают одну проверку
+        served = await asyncio.gather(
+            db.get_cached_file_id('t1', 'mp3', '320'),
+            db.get_cached_file_ids(['t1'], 'mp3', '320'),
+        )
+        await _settle(db)
+        return served, created_at, (await _entry(db)).created_at
+
+    served, old_created_at, new_created_at = run_db(scenario)
+    assert served == ['file-1', {'t1': 'file-1'}]
+    assert calls == ['file-1']
+    assert new_created_at > old_created_at
+
+
+def test_dead_entry_is_removed_after_check(run_db):
+    calls = []
+
+    async def scenario(db):
+        await _seed(db, age_days=config.FILE_ID_REVALIDATE_DAYS + 1)
+        db.file_id_validator = _validator(False, calls)
+        # Пока идет проверка, запись еще отдается
+        first = await db.get_cached_file_id('t1', 'mp3', '320')
+        await _settle(db)
+        return first, await db.get_cached_file_id('t1', 'mp3', '320'), await _entry(db), db._dead_file_ids
+
+    first, second, entry, dead = run_db(scenario)
+    assert first == 'file-1'
+    assert second is None and entry is None
+    assert 'file-1' in dead
+
+
+def test_unknown_answer_keeps_entry(run_db):
+    calls = []
+
+    async def scenario(db):
+        created_at = await _seed(db, age_days=config.FILE_ID_REVALIDATE_DAYS + 1)
+        db.file_id_validator = _validator(None, calls)
+        await db.get_cached_file_id('t1', 'mp3', '320')
+        await _settle(db)
+        entry = await _entry(db)
+        # Следующее обращение снова запускает проверку
+        await db.get_cached_file_id('t1', 'mp3', '320')
+        await _settle(db)
+        return created_at, entry.created_at
+
+    old_created_at, created_at = run_db(scenario)
+    assert created_at == old_created_at
+    assert calls == ['file-1', 'file-1']
+
+
+@pytest.mark.parametrize('max_age_days, served', [(0, 'file-1'), (30, None)])
+def test_hard_age_limit(run_db, monkeypatch, max_age_days, served):
+    monkeypatch.setattr(config, 'FILE_ID_MAX_AGE_DAYS', max_age_days)
+
+    async def scenario(db):
+        await _seed(db, age_days=60)
+        return await db.get_cached_file_id('t1', 'mp3', '320')
+
+    assert run_db(scenario) == served
+
+
+def test_negative_cache_expires(run_db, monkeypatch):
+    monkeypatch.setattr(config, 'FILE_ID_NEGATIVE_TTL', 0)
+
+    async def scenario(db):
+        await _seed(db)
+        db.mark_file_id_dead('file-1')
+        return await db.get_cached_file_id('t1', 'mp3', '320')
+
+    assert run_db(scenario) == 'file-1'
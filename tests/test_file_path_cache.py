@@ -0,0 +1,89 @@
+"""
+Тесты кэша путей getFile: срок жизни, общий для процессов кэш, повторное использование в get_file_url
+"""
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import select
+
+import database.db_manager as db_manager
+from database.models import TelegramFilePath
+from services.telegram_storage_service import AsyncTelegramStorageService
+
+
+def test_path_is_shared_between_processes_until_it_expires(run_db):
+    async def scenario(db):
+        await db.save_telegram_file_path('file-1', 'music/file_1.mp3', ttl=3600)
+        await db.save_telegram_file_path('file-2', 'music/file_2.mp3', ttl=3600)
+        # Другой процесс: своя память, та же таблица
+        other = db_manager.DatabaseManager(db.database_url)
+        try:
+            shared = await other.get_telegram_file_path('file-1')
+        finally:
+            await other.close()
+        # Истекшая запись не отдается ни из памяти, ни из таблицы
+        expired = datetime.utcnow() - timedelta(seconds=1)
+        db._file_paths['file-2'] = ('music/file_2.mp3', expired)
+
+        async def _expire(session):
+            row = await session.get(TelegramFilePath, 'file-2')
+            row.expires_at = expired
+        await db.run_write(_expire)
+        return shared, await db.get_telegram_file_path('file-2'), await db.get_telegram_file_path('unknown')
+
+    shared, expired, unknown = run_db(scenario)
+    assert shared == 'music/file_1.mp3'
+    assert expired is None and unknown is None
+
+
+def test_saving_removes_expired_rows(run_db):
+    async def scenario(db):
+        await db.save_telegram_file_path('old', 'music/old.mp3', ttl=3600)
+
+        async def _expire(session):
+            row = await session.get(TelegramFilePath, 'old')
+            row.expires_at = datetime.utcnow() - timedelta(seconds=1)
+        await db.run_write(_expire)
+        await db.save_telegram_file_path('new', 'music/new.mp3')
+        async with db.async_session() as session:
+            return [row.file_id for row in (await session.execute(select(TelegramFilePath))).scalars()]
+
+    assert run_db(scenario) == ['new']
+
+
+def test_memory_cache_is_bounded(run_db, monkeypatch):
+    monkeypatch.setattr(db_manager, 'FILE_PATH_MEMORY_LIMIT', 3)
+
+    async def scenario(db):
+        for n in range(5):
+            await db.save_telegram_file_path(f'file-{n}', f'music/{n}.mp3')
+        return list(db._file_paths)
+
+    assert run_db(scenario) == ['file-2', 'file-3', 'file-4']
+
+
+def test_dead_file_id_drops_cached_path(run_db):
+    async def scenario(db):
+        await db.save_telegram_file_path('file-1', 'music/file_1.mp3')
+        db.mark_file_id_dead('file-1')
+        return db._file_paths
+
+    assert run_db(scenario) == {}
+
+
+def test_get_file_url_calls_getfile_once(run_db):
+    requests = []
+
+    async def scenario(db):
+        storage = AsyncTelegramStorageService(bot_token='123:abc', channel_id='-100', db_manager=db)
+
+        async def fake_send(request):
+            requests.append(request[2]['params']['file_id'])
+            return httpx.Response(200, json={'ok': True, 'result': {'file_id': 'file-1', 'file_path': 'music/a.mp3'}})
+
+        storage._send = fake_send
+        return [await storage.get_file_url('file-1') for _ in range(3)]
+
+    urls = run_db(scenario)
+    assert urls == ['https://api.telegram.org/file/bot123:abc/music/a.mp3'] * 3
+    assert requests == ['file-1']
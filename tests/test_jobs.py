@@ -0,0 +1,134 @@
+"""
+Тесты фоновых заданий веба: этапы, ошибки, срок хранения, освобождение файла, поток SSE
+"""
+import asyncio
+import json
+import threading
+
+import pytest
+
+from web.event_loop import BackgroundLoop
+from web.jobs import JobError, JobManager
+
+
+@pytest.fixture
+def loop():
+    loop = BackgroundLoop(name="test-jobs-loop")
+    yield loop
+    loop.stop()
+
+
+def _wait_done(manager, job, timeout: float = 5):
+    version = -1
+    while True:
+        version, state = manager.snapshot(job)
+        if state['done']:
+            return state
+        assert manager.wait(job, version, timeout), "job did not finish"
+
+
+def test_job_goes_through_phases_to_ready(loop):
+    manager = JobManager(loop)
+    seen = []
+    gate = threading.Event()
+
+    async def runner(job):
+        manager.update(job, 'queued', position=2)
+        seen.append(manager.snapshot(job)[1].get('position'))
+        manager.update(job, 'downloading')
+        seen.append(manager.snapshot(job)[1].get('position'))
+        await asyncio.get_running_loop().run_in_executor(None, gate.wait, 5)
+        return {'stream_url': '/api/stream/t1'}
+
+    job = manager.submit('prepare-stream', runner)
+    assert manager.get(job.id) is job
+    gate.set()
+    state = _wait_done(manager, job)
+    assert state['phase'] == 'ready' and state['result'] == {'stream_url': '/api/stream/t1'}
+    # Позиция в очереди сбрасывается, когда задание пошло дальше
+    assert seen == [2, None]
+
+
+@pytest.mark.parametrize('error, message', [
+    (JobError('Track not found'), 'Track not found'),
+    (RuntimeError('yt-dlp crashed'), 'yt-dlp crashed'),
+])
+def test_failed_job_reports_error(loop, error, message):
+    manager = JobManager(loop)
+
+    async def runner(job):
+        raise error
+
+    state = _wait_done(manager, manager.submit('download', runner))
+    assert state['phase'] == 'failed' and state['error'] == message
+
+
+def test_finished_job_is_not_changed(loop):
+    manager = JobManager(loop)
+
+    async def runner(job):
+        return {}
+
+    job = manager.submit('download', runner)
+    _wait_done(manager, job)
+    version = job.version
+    # Опоздавший колбэк воркера не возвращает задание в работу
+    manager.update(job, 'uploading')
+    assert job.phase == 'ready' and job.version == version
+
+
+def test_expired_jobs_are_purged_with_cleanup(loop):
+    manager = JobManager(loop, ttl=0)
+    cleaned = []
+
+    async def runner(job):
+        job.cleanup = lambda: cleaned.append(job.id)
+        return {}
+
+    old = manager.submit('download', runner)
+    _wait_done(manager, old)
+    new = manager.submit('download', runner)
+    assert manager.get(old.id) is None and manager.get(new.id) is new
+    assert cleaned == [old.id]
+    _wait_done(manager, new)
+
+
+def test_release_runs_cleanup_once(loop):
+    manager = JobManager(loop)
+    cleaned = []
+
+    async def runner(job):
+        job.file_path = 'song.mp3'
+        job.cleanup = lambda: cleaned.append(1)
+        return {}
+
+    job = manager.submit('download', runner)
+    _wait_done(manager, job)
+    manager.release(job)
+    manager.release(job)
+    assert cleaned == [1] and job.file_path is None
+
+
+def test_events_stream_runs_until_ready(monkeypatch):
+    import web.app as web_app
+
+    monkeypatch.setattr(web_app, 'db_initialized', True)
+    gate = threading.Event()
+
+    async def runner(job):
+        await asyncio.get_running_loop().run_in_executor(None, gate.wait, 5)
+        web_app.jobs.update(job, 'downloading')
+        web_app.jobs.update(job, 'uploading')
+        return {'stream_url': '/api/stream/t1'}
+
+    job = web_app.jobs.submit('prepare-stream', runner)
+    client = web_app.app.test_client()
+    assert client.get(f"/api/jobs/{job.id}/file").status_code == 409
+    response = client.get(f"/api/jobs/{job.id}/events", buffered=False)
+    gate.set()
+    body = response.get_data(as_text=True)
+    events = [block for block in body.split("\n\n") if block.startswith("event:")]
+    phases = [block.split("\n")[0].split(": ")[1] for block in events]
+    assert phases[0] == 'queued' and phases[-1] == 'ready'
+    assert json.loads(events[-1].split("data: ")[1])['result'] == {'stream_url': '/api/stream/t1'}
+    assert client.get("/api/jobs/missing").status_code == 404
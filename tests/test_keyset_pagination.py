@@ -0,0 +1,97 @@
+"""
+Тесты keyset-пагинации: курсоры и обход страниц вперед/назад без пропусков и повторов
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from database.db_manager import decode_cursor, encode_cursor
+from database.models import Track
+
+_BASE_TIME = datetime(2024, 5, 1, 12, 0, 0)
+
+
+def test_datetime_cursor_round_trip():
+    moment = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    cursor = encode_cursor('a', moment, 42)
+    assert decode_cursor(cursor, sort_is_datetime=True) == ('a', moment, 42)
+
+
+def test_int_cursor_round_trip_with_string_id():
+    cursor = encode_cursor('b', 7, 'spotify:track:1')
+    # id может содержать ':' - делится только первое вхождение
+    assert decode_cursor(cursor, sort_is_datetime=False, id_type=str) == ('b', 7, 'spotify:track:1')
+
+
+def test_cursor_fits_callback_data():
+    cursor = encode_cursor('a', datetime(2099, 12, 31, 23, 59, 59, 999999), 2 ** 63 - 1)
+    # callback_data в Telegram ограничен 64 байтами, курсору нужен запас под префикс
+    assert len(cursor.encode()) <= 48
+
+
+@pytest.mark.parametrize('cursor', ['', 'x1:2', 'a12', 'aabc:1', 'b1:x'])
+def test_decode_rejects_garbage(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, sort_is_datetime=False)
+
+
+def _seed_tracks(count: int):
+    """Треки с парами одинакового created_at, чтобы порядок решал id"""
+    async def _write(session):
+        session.add_all([
+            Track(
+                id=f"t{i:02d}", name=f"Track {i}", artist="Artist",
+                spotify_url=f"https://open.spotify.com/track/t{i:02d}",
+                created_at=_BASE_TIME + timedelta(minutes=i // 2)
+            )
+            for i in range(count)
+        ])
+    return _write
+
+
+async def _collect_pages(db, limit: int, descending: bool):
+    """Пройти все страницы вперед, затем вернуться назад по prev_cursor"""
+    async def page(cursor):
+        return await db._keyset_page(
+            select(Track.id), Track.created_at, Track.id, limit, cursor, descending=descending
+        )
+
+    forward = []
+    rows, next_cursor, prev_cursor = await page(None)
+    assert prev_cursor is None
+    forward.append([row[0] for row in rows])
+    while next_cursor:
+        rows, next_cursor, prev_cursor = await page(next_cursor)
+        forward.append([row[0] for row in rows])
+
+    backward = [forward[-1]]
+    while prev_cursor:
+        rows, next_cursor, prev_cursor = await page(prev_cursor)
+        backward.append([row[0] for row in rows])
+    return forward, backward
+
+
+@pytest.mark.parametrize('descending', [True, False])
+def test_keyset_pages_cover_all_rows_once(run_db, descending):
+    async def scenario(db):
+        await db.run_write(_seed_tracks(8))
+        return await _collect_pages(db, limit=3, descending=descending)
+
+    forward, backward = run_db(scenario)
+
+    expected = sorted(
+        (f"t{i:02d}" for i in range(8)),
+        key=lambda track_id: (int(track_id[1:]) // 2, track_id),
+        reverse=descending
+    )
+    assert forward == [expected[0:3], expected[3:6], expected[6:8]]
+    # Назад приходим к тем же страницам в обратном порядке
+    assert backward == forward[::-1]
+
+
+def test_keyset_page_on_empty_result(run_db):
+    async def scenario(db):
+        return await db._keyset_page(select(Track.id), Track.created_at, Track.id, 5)
+
+    assert run_db(scenario) == ([], None, None)
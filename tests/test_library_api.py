@@ -0,0 +1,85 @@
+"""
+Тесты /api/library: ETag и 304, сброс при новой загрузке, дельта ?since=
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.db_manager import DatabaseManager
+
+BASE_TIME = datetime(2026, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def web(tmp_path, monkeypatch):
+    """Flask-клиент веба поверх отдельной SQLite-базы в цикле веб-процесса"""
+    import web.app as web_app
+
+    db = DatabaseManager(f"sqlite+aiosqlite:///{tmp_path / 'web.db'}")
+    web_app.web_loop.run(db.init_db())
+    monkeypatch.setattr(web_app, 'db', db)
+    monkeypatch.setattr(web_app, 'db_initialized', True)
+    web_app._library_responses.clear()
+    yield web_app, db
+    web_app.web_loop.run(db.close())
+    web_app._library_responses.clear()
+
+
+def _upload(web_app, db, n: int):
+    """Трек n загружен в хранилище через n минут после BASE_TIME"""
+    track_id = f"t{n}"
+    web_app.web_loop.run(db.upsert_tracks([{'id': track_id, 'name': f"Song {n}", 'artist': 'Artist'}]))
+    web_app.web_loop.run(db.upsert_telegram_files([{
+        'track_id': track_id,
+        'file_id': f"file-{n}",
+        'uploaded_at': BASE_TIME + timedelta(minutes=n),
+    }]))
+
+
+def test_unchanged_library_answers_304(web):
+    web_app, db = web
+    for n in range(3):
+        _upload(web_app, db, n)
+    client = web_app.app.test_client()
+
+    first = client.get('/api/library?limit=2')
+    assert first.status_code == 200
+    data = first.get_json()
+    assert [t['id'] for t in data['tracks']] == ['t2', 't1'] and data['next_cursor']
+    assert data['total'] == 3 and data['latest'] == (BASE_TIME + timedelta(minutes=2)).isoformat()
+
+    etag = first.headers['ETag']
+    again = client.get('/api/library?limit=2', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.headers['ETag'] == etag
+
+    _upload(web_app, db, 3)
+    changed = client.get('/api/library?limit=2', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert [t['id'] for t in changed.get_json()['tracks']] == ['t3', 't2']
+
+
+def test_since_returns_only_new_tracks(web):
+    web_app, db = web
+    for n in range(2):
+        _upload(web_app, db, n)
+    client = web_app.app.test_client()
+    latest = client.get('/api/library').get_json()['latest']
+
+    for n in range(2, 5):
+        _upload(web_app, db, n)
+    delta = client.get('/api/library', query_string={'since': latest}).get_json()
+    assert [t['id'] for t in delta['tracks']] == ['t4', 't3', 't2']
+    assert delta['complete'] and delta['total'] == 5
+
+    # Дельта больше страницы - клиенту проще перечитать список
+    partial = client.get('/api/library', query_string={'since': latest, 'limit': 2}).get_json()
+    assert [t['id'] for t in partial['tracks']] == ['t4', 't3']
+    assert not partial['complete']
+
+
+def test_invalid_parameters_answer_400(web):
+    web_app, _ = web
+    client = web_app.app.test_client()
+    assert client.get('/api/library?since=yesterday').status_code == 400
+    assert client.get('/api/library?limit=0').status_code == 400
+    assert client.get('/api/library?cursor=broken').status_code == 400
@@ -0,0 +1,62 @@
+"""
+Тесты миграций схемы: новая БД, БД без индексов (восстановленная из бэкапа), повторный запуск
+"""
+from sqlalchemy import insert, text
+
+from database.migrations import MIGRATIONS, run_migrations
+from database.models import Favorite, Track, TrackCache, User
+
+
+async def _scalar(db, sql: str):
+    async with db.engine.connect() as conn:
+        return (await conn.execute(text(sql))).scalar()
+
+
+async def _indexes(db, table: str) -> set:
+    async with db.engine.connect() as conn:
+        result = await conn.execute(text(f"PRAGMA index_list({table})"))
+        return {row[1] for row in result}
+
+
+def test_fresh_database_records_all_migrations(run_db):
+    async def scenario(db):
+        async with db.engine.connect() as conn:
+            applied = {row[0] for row in await conn.execute(text("SELECT version FROM schema_migrations"))}
+        async with db.engine.begin() as conn:
+            again = await run_migrations(conn)
+        return applied, again
+
+    applied, again = run_db(scenario)
+    assert applied == {version for version, _, _ in MIGRATIONS}
+    assert again == 0
+
+
+def test_old_database_gets_unique_indexes_without_duplicates(run_db):
+    async def scenario(db):
+        # БД из старого бэкапа: уникальных индексов нет, есть дубликаты
+        async with db.engine.begin() as conn:
+            await conn.execute(text("DROP INDEX uq_track_cache_track_format_quality"))
+            await conn.execute(text("DROP INDEX uq_favorites_user_track"))
+            await conn.execute(text("DELETE FROM schema_migrations WHERE version IN (1, 3)"))
+            await conn.execute(insert(User).values(id=1))
+            await conn.execute(insert(Track).values(id='t1', name='Song', artist='Artist', spotify_url='u1'))
+            for n in range(3):
+                await conn.execute(insert(TrackCache).values(
+                    track_id='t1', telegram_file_id=f'file-{n}', file_format='mp3', quality='320'
+                ))
+                await conn.execute(insert(Favorite).values(user_id=1, track_id='t1'))
+        async with db.engine.begin() as conn:
+            applied = await run_migrations(conn)
+        return (
+            applied,
+            await _scalar(db, "SELECT telegram_file_id FROM track_cache"),
+            await _scalar(db, "SELECT COUNT(*) FROM favorites"),
+            await _indexes(db, 'track_cache') | await _indexes(db, 'favorites'),
+        )
+
+    applied, file_id, favorites, indexes = run_db(scenario)
+    assert applied == 2
+    # В кэше остается самая свежая запись, в избранном - одна
+    assert file_id == 'file-2'
+    assert favorites == 1
+    assert {'uq_track_cache_track_format_quality', 'uq_favorites_user_track'} <= indexes
@@ -0,0 +1,147 @@
+"""
+Тесты общего скачивания (single-flight): одно задание на ключ, учет ссылок на файл, отмены
+"""
+import asyncio
+import os
+import threading
+
+import pytest
+
+from services.download_service import DownloadService
+
+KEY = ('track-1', 'mp3', '320')
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = DownloadService(download_dir=str(tmp_path / "downloads"))
+    yield service
+    service.scheduler.shutdown()
+
+
+def _job_file(service, name: str = "song.mp3") -> str:
+    job_dir = os.path.join(service.jobs_dir, "job-1")
+    os.makedirs(job_dir, exist_ok=True)
+    path = os.path.join(job_dir, name)
+    with open(path, 'wb') as f:
+        f.write(b"audio")
+    return path
+
+
+def _pins(service, path: str) -> int:
+    pin = service.disk_cache._pins.get(os.path.abspath(path))
+    return pin[0] if pin else 0
+
+
+def test_concurrent_callers_share_one_download(service):
+    calls = []
+
+    async def main():
+        async def factory():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return {'file_path': _job_file(service)}
+
+        return await asyncio.gather(*(service._single_flight(KEY, factory) for _ in range(3)))
+
+    results = asyncio.run(main())
+    path = results[0]['file_path']
+    assert calls == [1]
+    assert all(result['file_path'] == path for result in results)
+    # Каждый получатель держит ссылку, файл удаляет последний cleanup_file
+    assert service._file_refs[path] == 3 and _pins(service, path) == 3
+    service.cleanup_file(path)
+    service.cleanup_file(path)
+    assert os.path.exists(path) and _pins(service, path) == 1
+    service.cleanup_file(path)
+    assert not os.path.exists(path)
+    assert service._file_refs == {} and service._inflight == {}
+
+
+def test_waiter_cancelled_before_result_holds_no_reference(service):
+    async def main():
+        release = asyncio.Event()
+
+        async def factory():
+            await release.wait()
+            return {'file_path': _job_file(service)}
+
+        leader = asyncio.ensure_future(service._single_flight(KEY, factory))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(service._single_flight(KEY, factory))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        release.set()
+        return await leader
+
+    path = asyncio.run(main())['file_path']
+    assert service._file_refs[path] == 1 and _pins(service, path) == 1
+    service.cleanup_file(path)
+    assert not os.path.exists(path)
+    assert service._file_refs == {}
+
+
+def test_waiter_cancelled_as_result_arrives_releases_reference(service):
+    async def main():
+        release = asyncio.Event()
+        tasks = {}
+
+        async def factory():
+            await release.wait()
+            # Отмена приходит, когда ссылка на ожидающего уже выдана вместе с результатом
+            tasks['waiter'].cancel()
+            return {'file_path': _job_file(service)}
+
+        leader = asyncio.ensure_future(service._single_flight(KEY, factory))
+        await asyncio.sleep(0)
+        tasks['waiter'] = asyncio.ensure_future(service._single_flight(KEY, factory))
+        await asyncio.sleep(0)
+        release.set()
+        result = await leader
+        with pytest.raises(asyncio.CancelledError):
+            await tasks['waiter']
+        return result
+
+    path = asyncio.run(main())['file_path']
+    assert service._file_refs[path] == 1 and _pins(service, path) == 1
+    service.cleanup_file(path)
+    assert not os.path.exists(path)
+
+
+def test_failed_download_is_not_shared_afterwards(service):
+    async def main():
+        async def failing():
+            raise RuntimeError("yt-dlp failed")
+
+        with pytest.raises(RuntimeError):
+            await service._single_flight(KEY, failing)
+
+        async def factory():
+            return {'file_path': _job_file(service)}
+
+        # Упавшее задание не остается в реестре - следующий запрос качает заново
+        return await service._single_flight(KEY, factory)
+
+    assert asyncio.run(main())['file_path']
+    assert service._inflight == {}
+
+
+def test_cleanup_from_threads_removes_file_once(service):
+    async def main():
+        async def factory():
+            await asyncio.sleep(0.01)
+            return {'file_path': _job_file(service)}
+
+        return await asyncio.gather(*(service._single_flight(KEY, factory) for _ in range(8)))
+
+    path = asyncio.run(main())[0]['file_path']
+    # cleanup_file вызывается из потоков Flask (call_on_close)
+    threads = [threading.Thread(target=service.cleanup_file, args=(path,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not os.path.exists(path)
+    assert service._file_refs == {} and _pins(service, path) == 0
@@ -0,0 +1,141 @@
+"""
+Тесты кэша исходников: закрепление, общий для процессов лимит, блокировки видео, конвертация из кэша
+"""
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+from services.download_service import DownloadService
+from services.source_cache import SourceCache
+
+
+def _source(tmp_path, video_id: str, size: int, age: float = 0) -> str:
+    """Скачанный исходник во временной папке задания"""
+    path = tmp_path / "job" / f"{video_id}.webm"
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(b"x" * size)
+    if age:
+        stamp = time.time() - age
+        os.utime(path, (stamp, stamp))
+    return str(path)
+
+
+def _age(cache: SourceCache, video_id: str, seconds: float):
+    path = cache._index[video_id][0]
+    stamp = time.time() - seconds
+    os.utime(path, (stamp, stamp))
+
+
+def test_evicts_least_recently_used_sources(tmp_path):
+    cache = SourceCache(str(tmp_path / "sources"), max_bytes=250, busy_grace=60)
+    for video_id in ('a', 'b'):
+        cache.put(video_id, _source(tmp_path, video_id, 100))
+        _age(cache, video_id, 600 if video_id == 'a' else 300)
+    cache.put('c', _source(tmp_path, 'c', 100))
+    assert cache.get('a') is None
+    assert cache.get('b') and cache.get('c')
+
+
+def test_recently_used_sources_are_not_evicted(tmp_path):
+    cache = SourceCache(str(tmp_path / "sources"), max_bytes=150, busy_grace=60)
+    cache.put('a', _source(tmp_path, 'a', 100))
+    cache.put('b', _source(tmp_path, 'b', 100))
+    # 'a' только что скачан - его может конвертировать другой процесс
+    assert cache.get('a') and cache.get('b')
+
+
+def test_pinned_source_survives_until_unpinned(tmp_path):
+    cache = SourceCache(str(tmp_path / "sources"), max_bytes=150, busy_grace=0)
+    cache.put('a', _source(tmp_path, 'a', 100), pin=True)
+    cache.put('b', _source(tmp_path, 'b', 100))
+    assert os.path.exists(cache._index['a'][0])
+    cache.unpin('a')
+    # Отложенное вытеснение выполняется при снятии закрепления
+    assert cache._total_bytes <= 150
+
+
+def test_budget_is_shared_between_processes(tmp_path):
+    cache_dir = str(tmp_path / "sources")
+    bot = SourceCache(cache_dir, max_bytes=250, busy_grace=60)
+    web = SourceCache(cache_dir, max_bytes=250, busy_grace=60)
+    bot.put('a', _source(tmp_path, 'a', 100))
+    _age(bot, 'a', 600)
+    web.put('b', _source(tmp_path, 'b', 100))
+    _age(web, 'b', 300)
+    # Исходник другого процесса виден и переиспользуется
+    assert web.get('a') is not None
+    _age(web, 'a', 600)
+    bot.put('c', _source(tmp_path, 'c', 100))
+    on_disk = sorted(os.path.splitext(name)[0] for name in os.listdir(cache_dir))
+    assert on_disk == ['b', 'c']
+    assert sum(os.path.getsize(os.path.join(cache_dir, n)) for n in os.listdir(cache_dir)) <= 250
+
+
+def test_video_locks_are_released(tmp_path):
+    cache = SourceCache(str(tmp_path / "sources"), max_bytes=1000)
+    inside = []
+    entered = threading.Event()
+    release = threading.Event()
+
+    def holder():
+        with cache.video_lock('v'):
+            entered.set()
+            release.wait(5)
+            inside.append('holder')
+
+    def waiter():
+        entered.wait(5)
+        with cache.video_lock('v'):
+            inside.append('waiter')
+
+    threads = [threading.Thread(target=holder), threading.Thread(target=waiter)]
+    for thread in threads:
+        thread.start()
+    entered.wait(5)
+    time.sleep(0.05)
+    assert inside == []
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert inside == ['holder', 'waiter']
+    # Запись удаляется вместе с последним пользователем блокировки
+    assert cache._video_locks == {}
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = DownloadService(download_dir=str(tmp_path / "downloads"))
+    yield service
+    service.scheduler.shutdown()
+
+
+def test_download_transcodes_from_cached_source(service, tmp_path, monkeypatch):
+    service.source_cache.put('vid', _source(tmp_path, 'vid', 100))
+    monkeypatch.setattr(service, '_transcode_sync', lambda src, out, quality, fmt: shutil.copy(src, out))
+
+    result = service._download_sync('query', 'song.mp3', '320', 'mp3', video_id='vid')
+
+    assert result['file_path'].endswith('song.mp3') and os.path.exists(result['file_path'])
+    assert result['video_id'] == 'vid'
+    assert service.source_cache._pins == {}
+
+
+def test_failed_transcode_unpins_source_and_removes_job_dir(service, tmp_path, monkeypatch):
+    service.source_cache.put('vid', _source(tmp_path, 'vid', 100))
+
+    def broken_transcode(src, out, quality, fmt):
+        with open(f"{out}.part", 'wb') as f:
+            f.write(b"partial")
+        raise RuntimeError("ffmpeg failed")
+
+    monkeypatch.setattr(service, '_transcode_sync', broken_transcode)
+    result = service._download_sync('query', 'song.mp3', '320', 'mp3', video_id='vid')
+
+    assert result == {'error': 'ffmpeg failed'}
+    assert service.source_cache._pins == {}
+    assert os.listdir(service.jobs_dir) == []
+    # Исходник остается в кэше для следующей попытки
+    assert service.source_cache.get('vid')
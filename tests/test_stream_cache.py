@@ -0,0 +1,98 @@
+"""
+Тесты кэша фрагментов для стриминга: чтение диапазонов, повторное использование и вытеснение
+"""
+import threading
+
+import pytest
+
+from services.stream_cache import StreamCache
+
+CHUNK = 10
+DATA = bytes(range(256)) * 2  # 512 байт: 51 полный фрагмент и хвост из 2 байт
+
+
+class _Source:
+    """Источник фрагментов, считающий обращения (вместо Range-запросов к Telegram)"""
+
+    def __init__(self, data: bytes = DATA, chunk_size: int = CHUNK):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.fetched = []
+        self._lock = threading.Lock()
+
+    def __call__(self, index: int) -> bytes:
+        with self._lock:
+            self.fetched.append(index)
+        return self.data[index * self.chunk_size:(index + 1) * self.chunk_size]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return StreamCache(str(tmp_path / "stream"), max_bytes=10 * 1024, chunk_size=CHUNK)
+
+
+def _read(cache, source, start, stop):
+    return b"".join(cache.read(cache.key_for("file-1"), len(source.data), start, stop, source))
+
+
+@pytest.mark.parametrize('start, stop', [(0, 512), (0, 1), (5, 25), (10, 20), (505, 512), (511, 512)])
+def test_read_returns_requested_range(cache, start, stop):
+    source = _Source()
+    assert _read(cache, source, start, stop) == DATA[start:stop]
+    # Запрашиваются только фрагменты, пересекающие диапазон
+    assert source.fetched == list(range(start // CHUNK, (stop - 1) // CHUNK + 1))
+
+
+def test_second_read_is_served_from_disk(cache):
+    source = _Source()
+    _read(cache, source, 0, 100)
+    source.fetched.clear()
+    assert _read(cache, source, 35, 80) == DATA[35:80]
+    assert source.fetched == []
+
+
+def test_index_survives_restart(cache, tmp_path):
+    _read(cache, _Source(), 0, 30)
+    reopened = StreamCache(str(tmp_path / "stream"), max_bytes=10 * 1024, chunk_size=CHUNK)
+    source = _Source()
+    assert _read(reopened, source, 0, 30) == DATA[0:30]
+    assert source.fetched == []
+
+
+def test_rejects_truncated_chunk(cache):
+    source = _Source(data=DATA[:505])  # источник короче заявленного размера
+    key = cache.key_for("file-1")
+    with pytest.raises(IOError):
+        b"".join(cache.read(key, len(DATA), 500, 512, source))
+    # Битый фрагмент не сохраняется
+    assert cache.get_chunk(key, 50) is None
+
+
+def test_evicts_least_recently_read_chunks(tmp_path):
+    cache = StreamCache(str(tmp_path / "stream"), max_bytes=3 * CHUNK, chunk_size=CHUNK)
+    key = cache.key_for("file-1")
+    source = _Source()
+    _read(cache, source, 0, 30)      # фрагменты 0, 1, 2
+    _read(cache, source, 0, 10)      # 0 снова недавний
+    _read(cache, source, 30, 40)     # фрагмент 3 вытесняет давно не читанный 1
+    assert cache._total_bytes <= 3 * CHUNK
+    assert cache.get_chunk(key, 1) is None
+    assert cache.get_chunk(key, 0) == DATA[0:10]
+    assert cache.get_chunk(key, 3) == DATA[30:40]
+
+
+def test_concurrent_readers_fetch_each_chunk_once(cache):
+    source = _Source()
+    results = []
+
+    def reader():
+        results.append(_read(cache, source, 0, 200))
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [DATA[0:200]] * 4
+    assert sorted(source.fetched) == list(range(20))
@@ -0,0 +1,114 @@
+"""
+Тесты /api/stream: Range и 206, ETag и If-Range, 416, HEAD, повторное чтение из кэша фрагментов
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from services.stream_cache import StreamCache
+
+CHUNK = 16
+DATA = bytes(range(256)) * 2  # 512 байт
+
+
+class _Telegram:
+    """Ответы на Range-запросы к файлу в Telegram"""
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, file_id: str, start: int, end: int):
+        self.requests.append((start, end))
+        end = min(end, len(DATA) - 1)
+        response = SimpleNamespace(
+            status_code=206,
+            content=DATA[start:end + 1],
+            headers={'Content-Range': f"bytes {start}-{end}/{len(DATA)}"},
+        )
+        return response, "https://api.telegram.org/file/bot-token/music/file_1.mp3"
+
+
+@pytest.fixture
+def stream(tmp_path, monkeypatch):
+    import web.app as web_app
+
+    telegram = _Telegram()
+
+    async def find_file_id(track_id):
+        return 'file-1' if track_id == 't1' else None
+
+    monkeypatch.setattr(web_app, 'db_initialized', True)
+    monkeypatch.setattr(web_app, '_find_stream_file_id', find_file_id)
+    monkeypatch.setattr(web_app, '_fetch_telegram_range', telegram)
+    monkeypatch.setattr(web_app, 'stream_cache', StreamCache(str(tmp_path / "stream"), 64 * 1024, chunk_size=CHUNK))
+    return web_app.app.test_client(), telegram
+
+
+def test_full_response_with_validators(stream):
+    client, _ = stream
+    response = client.get('/api/stream/t1')
+    assert response.status_code == 200
+    assert response.data == DATA
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Content-Length'] == str(len(DATA))
+    assert response.headers['ETag'] and response.headers['Last-Modified']
+    assert response.mimetype == 'audio/mpeg'
+
+
+def test_range_request_returns_206(stream):
+    client, _ = stream
+    response = client.get('/api/stream/t1', headers={'Range': 'bytes=100-149'})
+    assert response.status_code == 206
+    assert response.data == DATA[100:150]
+    assert response.headers['Content-Range'] == f"bytes 100-149/{len(DATA)}"
+    assert response.headers['Content-Length'] == '50'
+
+    suffix = client.get('/api/stream/t1', headers={'Range': 'bytes=-10'})
+    assert suffix.status_code == 206 and suffix.data == DATA[-10:]
+
+
+def test_unsatisfiable_range_answers_416(stream):
+    client, _ = stream
+    response = client.get('/api/stream/t1', headers={'Range': f"bytes={len(DATA)}-"})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f"bytes */{len(DATA)}"
+
+
+def test_etag_and_if_range(stream):
+    client, _ = stream
+    etag = client.head('/api/stream/t1').headers['ETag']
+    assert client.get('/api/stream/t1', headers={'If-None-Match': etag}).status_code == 304
+
+    same = client.get('/api/stream/t1', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert same.status_code == 206 and same.data == DATA[:10]
+    # Клиент держит другую версию файла - отдаем весь файл
+    stale = client.get('/api/stream/t1', headers={'Range': 'bytes=0-9', 'If-Range': '"old-version"'})
+    assert stale.status_code == 200 and stale.data == DATA
+
+
+def test_head_and_repeat_reads_do_not_refetch(stream):
+    client, telegram = stream
+    head = client.head('/api/stream/t1')
+    assert head.status_code == 200 and head.data == b''
+    assert head.headers['Content-Length'] == str(len(DATA))
+    # Размер узнается одним запросом первого фрагмента
+    assert telegram.requests == [(0, CHUNK - 1)]
+
+    assert client.get('/api/stream/t1', headers={'Range': 'bytes=20-59'}).data == DATA[20:60]
+    fetched = len(telegram.requests)
+    again = client.get('/api/stream/t1', headers={'Range': 'bytes=24-47'})
+    assert again.data == DATA[24:48]
+    assert len(telegram.requests) == fetched
+
+
+def test_unknown_track_and_upstream_errors(stream, monkeypatch):
+    import web.app as web_app
+
+    client, _ = stream
+    assert client.get('/api/stream/missing').status_code == 404
+
+    def broken(file_id, start, end):
+        raise IOError("Telegram file request failed: HTTP 500")
+
+    monkeypatch.setattr(web_app, '_fetch_telegram_range', broken)
+    assert client.get('/api/stream/t1').status_code == 502
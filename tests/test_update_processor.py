@@ -0,0 +1,113 @@
+"""
+Тесты обработки апдейтов: порядок внутри чата, параллельность между чатами, фоновые шаги
+"""
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+from telegram import Chat, Message, Update
+
+from utils.update_processor import PerChatUpdateProcessor, run_in_background
+
+
+def _update(update_id: int, chat_id: int) -> Update:
+    chat = Chat(id=chat_id, type=Chat.PRIVATE)
+    return Update(update_id=update_id, message=Message(message_id=update_id, date=datetime.now(), chat=chat))
+
+
+def test_updates_of_one_chat_run_in_order():
+    async def main():
+        processor = PerChatUpdateProcessor(8)
+        order = []
+
+        async def handle(name, delay):
+            await asyncio.sleep(delay)
+            order.append(name)
+
+        # Первый апдейт самый долгий - без очереди чата он завершился бы последним
+        for n, delay in enumerate([0.05, 0.0, 0.01]):
+            await processor.do_process_update(_update(n, 1), handle(n, delay))
+        await processor.drain()
+        return order
+
+    assert asyncio.run(main()) == [0, 1, 2]
+
+
+def test_busy_chat_does_not_block_other_chats():
+    async def main():
+        processor = PerChatUpdateProcessor(2)
+        gate = asyncio.Event()
+        done = []
+
+        async def blocked(name):
+            await gate.wait()
+            done.append(name)
+
+        async def quick(name):
+            done.append(name)
+
+        # Чат 1 занят, за ним в очереди еще апдейты - слоты они не занимают
+        await processor.do_process_update(_update(1, 1), blocked('chat1-a'))
+        for n in range(3):
+            await processor.do_process_update(_update(10 + n, 1), quick(f'chat1-{n}'))
+        await processor.do_process_update(_update(2, 2), quick('chat2'))
+        await asyncio.sleep(0.05)
+        finished_while_busy = list(done)
+        gate.set()
+        await processor.drain()
+        return finished_while_busy, done
+
+    finished_while_busy, done = asyncio.run(main())
+    assert finished_while_busy == ['chat2']
+    assert done == ['chat2', 'chat1-a', 'chat1-0', 'chat1-1', 'chat1-2']
+
+
+def test_drain_waits_for_background_steps():
+    async def main():
+        processor = PerChatUpdateProcessor(4)
+        context = SimpleNamespace(application=SimpleNamespace(update_processor=processor))
+        finished = []
+
+        async def download():
+            await asyncio.sleep(0.05)
+            finished.append('download')
+
+        async def handler():
+            # Обработчик только запускает скачивание и сразу освобождает очередь чата
+            run_in_background(context, download())
+            finished.append('handler')
+
+        await processor.do_process_update(_update(1, 1), handler())
+        await processor.drain()
+        return finished
+
+    assert asyncio.run(main()) == ['handler', 'download']
+
+
+def test_background_errors_do_not_break_drain():
+    async def main():
+        processor = PerChatUpdateProcessor(4)
+
+        async def failing():
+            raise RuntimeError("download failed")
+
+        task = processor.create_background_task(failing())
+        await processor.drain()
+        return task
+
+    task = asyncio.run(main())
+    assert isinstance(task.exception(), RuntimeError)
+
+
+def test_shutdown_cancels_pending_work():
+    async def main():
+        processor = PerChatUpdateProcessor(4)
+        task = processor.create_background_task(asyncio.sleep(10))
+        await processor.do_process_update(_update(1, 1), asyncio.sleep(10))
+        await asyncio.sleep(0)
+        await processor.shutdown()
+        return task, processor._chat_queues
+
+    task, queues = asyncio.run(main())
+    assert task.cancelled()
+    assert queues == {}
@@ -0,0 +1,90 @@
+"""
+Тесты кэша пользователей и отложенной записи last_active/профиля: горячий путь без БД, TTL, запись по таймеру
+"""
+import asyncio
+
+from sqlalchemy import select
+
+import config
+from database.models import User
+
+
+async def _stored(db, user_id: int) -> User:
+    async with db.async_session() as session:
+        return (await session.execute(select(User).where(User.id == user_id))).scalar_one()
+
+
+def test_cached_user_is_served_without_db_and_written_later(run_db, monkeypatch):
+    monkeypatch.setattr(config, 'WRITE_BEHIND_INTERVAL', 3600)
+    monkeypatch.setattr(config, 'USER_CACHE_TTL', 3600)
+
+    async def scenario(db):
+        await db.get_or_create_user(1, 'old_name')
+        real_session = db.async_session
+
+        def no_queries():
+            raise AssertionError("cached user must not hit the database")
+
+        db.async_session = no_queries
+        user = await db.get_or_create_user(1, 'renamed')
+        db.async_session = real_session
+        before_flush = (await _stored(db, 1)).username
+        await db.flush_write_behind()
+        return user.username, before_flush, (await _stored(db, 1)).username
+
+    cached, before_flush, after_flush = run_db(scenario)
+    assert cached == 'renamed'
+    assert before_flush == 'old_name'
+    assert after_flush == 'renamed'
+
+
+def test_expired_entry_is_reloaded(run_db, monkeypatch):
+    monkeypatch.setattr(config, 'USER_CACHE_TTL', 0)
+
+    async def scenario(db):
+        first = await db.get_or_create_user(1, 'name')
+        second = await db.get_or_create_user(1)
+        return first is second, len(db._user_cache)
+
+    same_object, cached = run_db(scenario)
+    assert not same_object
+    assert cached == 1
+
+
+def test_timer_flushes_queued_updates_without_further_requests(run_db, monkeypatch):
+    monkeypatch.setattr(config, 'WRITE_BEHIND_INTERVAL', 0.05)
+
+    async def scenario(db):
+        db.start_write_behind()
+        await db.get_or_create_user(1, 'old')
+        # Ставим обновление в очередь, не трогая таймер последней записи
+        db._queue_user_update(1, username='quiet_bot')
+        await asyncio.sleep(0.3)
+        stored = (await _stored(db, 1)).username
+        await db.stop_write_behind()
+        return stored, db._write_behind_task
+
+    stored, task = run_db(scenario)
+    assert stored == 'quiet_bot'
+    assert task is None
+
+
+def test_close_writes_pending_changes(run_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'WRITE_BEHIND_INTERVAL', 3600)
+
+    async def scenario(db):
+        await db.get_or_create_user(1, 'before_close')
+        db._queue_user_update(1, username='after_close')
+        return db.database_url
+
+    url = run_db(scenario)
+
+    async def reopen():
+        from database.db_manager import DatabaseManager
+        db = DatabaseManager(url)
+        try:
+            return (await _stored(db, 1)).username
+        finally:
+            await db.close()
+
+    assert asyncio.run(reopen()) == 'after_close'
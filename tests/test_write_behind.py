@@ -0,0 +1,93 @@
+"""
+Тесты отложенной записи: история и счетчики пачкой, отбрасывание битых строк, предел очереди
+"""
+import pytest
+from sqlalchemy import insert, select
+from sqlalchemy.exc import OperationalError
+
+import config
+from database.models import DownloadHistory, Track, User
+
+
+async def _seed(db):
+    async def _write(session):
+        await session.execute(insert(User).values([{'id': 1}, {'id': 2}]))
+        await session.execute(insert(Track).values([
+            {'id': 't1', 'name': 'One', 'artist': 'A', 'spotify_url': 'u1'},
+            {'id': 't2', 'name': 'Two', 'artist': 'A', 'spotify_url': 'u2'},
+        ]))
+    await db.run_write(_write)
+
+
+async def _load(db):
+    async with db.async_session() as session:
+        history = (await session.execute(
+            select(DownloadHistory.user_id, DownloadHistory.track_id).order_by(DownloadHistory.id)
+        )).all()
+        users = {u.id: u for u in (await session.execute(select(User))).scalars()}
+        tracks = {t.id: t for t in (await session.execute(select(Track))).scalars()}
+    return [tuple(row) for row in history], users, tracks
+
+
+def test_flush_writes_history_and_aggregated_counters(run_db):
+    async def scenario(db):
+        await _seed(db)
+        db._queue_user_update(1, username='new_name')
+        for user_id, track_id in [(1, 't1'), (1, 't1'), (2, 't2')]:
+            await db.add_download_to_history(user_id, track_id, file_size=3 * 1024 * 1024)
+        await db.flush_write_behind()
+        return await _load(db)
+
+    history, users, tracks = run_db(scenario)
+    assert history == [(1, 't1'), (1, 't1'), (2, 't2')]
+    assert users[1].username == 'new_name'
+    assert (users[1].total_downloads, users[1].total_size_mb) == (2, 6)
+    assert (tracks['t1'].download_count, tracks['t2'].download_count) == (2, 1)
+
+
+def test_rows_violating_foreign_keys_are_dropped(run_db):
+    async def scenario(db):
+        await _seed(db)
+        db._queue_user_update(2, username='still_saved')
+        # Трек удален между постановкой в очередь и записью
+        for user_id, track_id in [(1, 't1'), (1, 'deleted'), (999, 't2'), (2, 't2')]:
+            await db.add_download_to_history(user_id, track_id)
+        await db.flush_write_behind()
+        return await _load(db), list(db._pending_history)
+
+    (history, users, tracks), pending = run_db(scenario)
+    assert history == [(1, 't1'), (2, 't2')]
+    assert pending == []
+    assert users[2].username == 'still_saved'
+    # Отброшенные строки не попадают и в счетчики
+    assert users[1].total_downloads == 1
+    assert tracks['t2'].download_count == 1
+
+
+def test_failed_flush_requeues_up_to_limit(run_db, monkeypatch):
+    monkeypatch.setattr(config, 'WRITE_BEHIND_MAX_PENDING', 3)
+
+    async def scenario(db):
+        await _seed(db)
+
+        async def broken_write(operation):
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+        monkeypatch.setattr(db, 'run_write', broken_write)
+        db._queue_user_update(1, username='old')
+        with db._write_behind_lock:
+            db._pending_history = [
+                {'user_id': 1, 'track_id': 't1', 'quality': '192', 'file_size_mb': 0, 'downloaded_at': None, 'n': n}
+                for n in range(5)
+            ]
+        with pytest.raises(OperationalError):
+            await db.flush_write_behind()
+        db._queue_user_update(1, username='newer')
+        with pytest.raises(OperationalError):
+            await db.flush_write_behind()
+        return [event['n'] for event in db._pending_history], dict(db._pending_user_updates)
+
+    pending, user_updates = run_db(scenario)
+    # Остаются самые новые записи, очередь не растет сверх предела
+    assert pending == [2, 3, 4]
+    assert user_updates == {1: {'username': 'newer'}}
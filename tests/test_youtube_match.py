@@ -0,0 +1,86 @@
+"""
+Тесты кэша соответствий YouTube: повторное использование видео и очистка только недоступных
+"""
+import pytest
+
+from services.download_service import DownloadService
+
+KEYS = ['spotify:t1', 'q:artist song']
+
+
+def _run(run_db, tmp_path, monkeypatch, cached_error: str):
+    """Скачать трек с сохраненным видео, которое отвечает cached_error; вернуть вызовы и кэш после"""
+    calls = []
+
+    async def scenario(db):
+        service = DownloadService(download_dir=str(tmp_path / "downloads"), db_manager=db)
+
+        async def fake_download(query, output_name, quality, file_format, user_id=None,
+                                on_queue_position=None, video_id=None, meta=None, on_phase=None):
+            calls.append(video_id)
+            if video_id == 'old':
+                return {'error': cached_error}
+            # Обычный поиск тоже не удался - в кэше остается только то, что не удалили
+            return {'error': 'No results found'}
+
+        monkeypatch.setattr(service, '_run_download', fake_download)
+        try:
+            await db.save_youtube_match(KEYS, 'old', title='Song', duration=200)
+            await service._resolve_and_download('artist song', KEYS, 'song.mp3', '320', 'mp3')
+            return await db.get_youtube_match(KEYS)
+        finally:
+            service.scheduler.shutdown()
+
+    match = run_db(scenario)
+    return calls, match
+
+
+@pytest.mark.parametrize('error', [
+    'ERROR: [youtube] old: Video unavailable',
+    'ERROR: [youtube] old: Private video. Sign in if you\'ve been granted access',
+    'ERROR: [youtube] old: This video has been removed by the uploader',
+    'ERROR: This video is no longer available because the YouTube account associated '
+    'with this video has been terminated.',
+])
+def test_unavailable_video_is_forgotten(run_db, tmp_path, monkeypatch, error):
+    calls, match = _run(run_db, tmp_path, monkeypatch, error)
+    assert calls == ['old', None]
+    assert match is None
+
+
+@pytest.mark.parametrize('error', [
+    'ERROR: [youtube] old: Requested format is not available',
+    'ERROR: unable to download video data: HTTP Error 403: Forbidden',
+    'Read timed out',
+])
+def test_transient_errors_keep_the_match(run_db, tmp_path, monkeypatch, error):
+    calls, match = _run(run_db, tmp_path, monkeypatch, error)
+    assert calls == ['old', None]
+    # Временная ошибка или неподходящий формат не стирают верное соответствие
+    assert match.video_id == 'old'
+
+
+def test_cached_video_is_reused_without_search(run_db, tmp_path, monkeypatch):
+    calls = []
+
+    async def scenario(db):
+        service = DownloadService(download_dir=str(tmp_path / "downloads"), db_manager=db)
+
+        async def fake_download(query, output_name, quality, file_format, user_id=None,
+                                on_queue_position=None, video_id=None, meta=None, on_phase=None):
+            calls.append((video_id, meta))
+            return {'file_path': 'song.mp3', 'video_id': video_id or 'found'}
+
+        monkeypatch.setattr(service, '_run_download', fake_download)
+        try:
+            first = await service._resolve_and_download('artist song', KEYS, 'song.mp3', '320', 'mp3')
+            # Тот же трек, найденный по названию (без Spotify ID), берет видео из кэша
+            second = await service._resolve_and_download('artist song', KEYS[1:], 'song.mp3', '320', 'mp3')
+            return first, second
+        finally:
+            service.scheduler.shutdown()
+
+    first, second = run_db(scenario)
+    assert first['video_id'] == second['video_id'] == 'found'
+    assert calls[0] == (None, None)
+    assert calls[1][0] == 'found'
@@ -53,8 +53,8 @@ class KeyboardBuilder:
         return InlineKeyboardMarkup(keyboard)
 
     @staticmethod
-    def playlist_tracks(playlist_id, tracks, lang: str = "ru"):
-        """Клавиатура со списком треков в плейлисте"""
+    def playlist_tracks(playlist_id, tracks, lang: str = "ru", pagination: InlineKeyboardMarkup = None):
+        """Клавиатура со списком треков в плейлисте (pagination - ряд перехода по страницам)"""
         keyboard = []
         for track in tracks:
             keyboard.append([InlineKeyboardButton(
@@ -62,6 +62,9 @@ class KeyboardBuilder:
                 callback_data=f"track_in_playlist_{track.id}_{playlist_id}"
             )])
         
+        if pagination:
+            keyboard.extend(pagination.inline_keyboard)
+        
         keyboard.append([InlineKeyboardButton("🗑 Delete Playlist" if lang == "en" else "🗑 Удалить плейлист", callback_data=f"delete_playlist_{playlist_id}")])
         keyboard.append([InlineKeyboardButton(get_string("btn_back", lang), callback_data="menu_playlists")])
         
@@ -165,33 +168,55 @@ def get_format_keyboard(lang: str = "ru", current: str = "mp3") -> InlineKeyboar
     return InlineKeyboardMarkup(keyboard)
 
 
-def get_search_results_keyboard(results: list) -> InlineKeyboardMarkup:
+def get_search_results_keyboard(results: list, limit: int = 5) -> InlineKeyboardMarkup:
     """Клавиатура результатов поиска (Функция 4)"""
     keyboard = []
     
-    for i, result in enumerate(results[:5]):  # Максимум 5 результатов
+    for i, result in enumerate(results[:limit]):  # По умолчанию максимум 5 результатов
         track_name = result.get('name', 'Unknown')
         artist = result.get('artist', 'Unknown')
         track_id = result.get('id', '')
         
-        button_text = f"🎵 {track_name} - {artist}"[:64]  # Telegram лимит
+        # ⚡ - трек уже есть в Telegram и придет сразу
+        icon = "⚡" if result.get('cached') else "🎵"
+        button_text = f"{icon} {track_name} - {artist}"[:64]  # Telegram лимит
         keyboard.append([InlineKeyboardButton(button_text, callback_data=f"download_{track_id}")])
     
     return InlineKeyboardMarkup(keyboard)
 
 
-def get_pagination_keyboard(page: int, total_pages: int, prefix: str) -> InlineKeyboardMarkup:
-    """Клавиатура пагинации"""
+def get_pagination_keyboard(page: int, total_pages: int, prefix: str,
+                            next_cursor: str = None, prev_cursor: str = None,
+                            lang: str = "ru") -> InlineKeyboardMarkup:
+    """
+    Клавиатура пагинации.
+    С курсорами (keyset) callback_data имеет вид {prefix}_page_{номер}_{курсор},
+    без них - {prefix}_page_{номер}
+    """
     keyboard = []
+    use_cursors = next_cursor is not None or prev_cursor is not None
     
     row = []
-    if page > 1:
-        row.append(InlineKeyboardButton("◀️ Назад", callback_data=f"{prefix}_page_{page-1}"))
+    if page > 1 and (prev_cursor or not use_cursors):
+        suffix = f"_{prev_cursor}" if prev_cursor else ""
+        row.append(InlineKeyboardButton(
+            "◀️ Back" if lang == "en" else "◀️ Назад", callback_data=f"{prefix}_page_{page-1}{suffix}"
+        ))
     
     row.append(InlineKeyboardButton(f"{page}/{total_pages}", callback_data="noop"))
     
-    if page < total_pages:
-        row.append(InlineKeyboardButton("Вперёд ▶️", callback_data=f"{prefix}_page_{page+1}"))
+    if page < total_pages and (next_cursor or not use_cursors):
+        suffix = f"_{next_cursor}" if next_cursor else ""
+        row.append(InlineKeyboardButton(
+            "Next ▶️" if lang == "en" else "Вперёд ▶️", callback_data=f"{prefix}_page_{page+1}{suffix}"
+        ))
     
     keyboard.append(row)
     return InlineKeyboardMarkup(keyboard)
+
+
+def parse_pagination_callback(callback_data: str):
+    """Разобрать {prefix}_page_{номер}[_{курсор}] в (prefix, номер, курсор или None)"""
+    prefix, rest = callback_data.split("_page_", 1)
+    page, _, cursor = rest.partition("_")
+    return prefix, int(page), cursor or None
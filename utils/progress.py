@@ -63,7 +63,8 @@ def create_download_progress_message(
     track_name: str,
     current: int,
     total: int,
-    status: str = "Скачивание"
+    status: str = "Скачивание",
+    lang: str = "ru"
 ) -> str:
     """
     Создать сообщение о прогрессе скачивания
@@ -73,11 +74,13 @@ def create_download_progress_message(
         current: Текущий трек
         total: Всего треков
         status: Статус (Скачивание, Конвертация и т.д.)
+        lang: Язык пользователя
     
     Returns:
         Форматированное сообщение
     """
     progress_bar = create_progress_bar(current, total)
+    counter = f"Track {current} of {total}" if lang == "en" else f"Трек {current} из {total}"
     
     message = f"""
 ⏳ <b>{status}...</b>
@@ -85,6 +88,41 @@ def create_download_progress_message(
 🎵 {track_name}
 
 {progress_bar}
-Трек {current} из {total}
+{counter}
 """
     return message.strip()
+
+
+def create_queue_position_reporter(status_msg, lang: str, name: str, artist: str):
+    """
+    Создать колбэк для планировщика скачиваний, показывающий позицию в очереди
+    
+    Args:
+        status_msg: Статусное сообщение Telegram, которое редактируется
+        lang: Язык пользователя
+        name: Название трека
+        artist: Исполнитель
+    
+    Returns:
+        Корутина-колбэк: позиция > 0 - ожидание, 0 - скачивание началось
+    """
+    from .strings import get_string
+    
+    shown = {'position': 0}
+    
+    async def report(position: int):
+        # Не трогаем сообщение, если задание стартовало сразу без ожидания
+        if position == shown['position']:
+            return
+        shown['position'] = position
+        if position > 0:
+            text = get_string("queue_position", lang, name=name, artist=artist, position=position)
+        else:
+            text = get_string("downloading", lang, name=name, artist=artist).strip()
+        try:
+            await status_msg.edit_text(text, parse_mode='HTML')
+        except Exception:
+            # Сообщение уже удалено или не изменилось
+            pass
+    
+    return report
@@ -61,12 +61,24 @@ STRINGS = {
         "notifications_success": "✅ Уведомления {status}",
         
         # Поиск
-        "search_welcome": "🔍 <b>Поиск музыки</b>\n\nОтправьте мне ссылку на трек из Spotify, и я скачаю его для вас!\n\nПример:\n<code>https://open.spotify.com/track/...</code>",
+        "search_welcome": "🔍 <b>Поиск музыки</b>\n\nОтправьте мне ссылку на трек из Spotify, и я скачаю его для вас!\n\nПример:\n<code>https://open.spotify.com/track/...</code>\n\nПоиск по уже скачанным трекам:\n<code>/search исполнитель название</code>",
+        "search_results": "🔍 <b>Найдено в каталоге:</b> {count}\n⚡ - отправка сразу из кэша",
+        "search_no_results": "🔍 В каталоге ничего не найдено. Отправьте ссылку на трек из Spotify.",
         "downloading": "📥 <b>Загрузка...</b>\n\n<i>{name} - {artist}</i>\n\nПожалуйста, подождите.",
         "searching": "🔍 Ищу информацию о треке...",
         "from_cache": "📤 Отправляю из кэша...",
         "uploading": "📤 Загружаю файл в Telegram...",
         "error_download": "❌ Ошибка при скачивании трека. Попробуйте еще раз позже.",
+        "queue_position": "⏳ <b>В очереди на скачивание</b>\n\n<i>{name} - {artist}</i>\n\nВаша позиция: {position}",
+        "queue_full": "⏳ Сейчас слишком много скачиваний. Попробуйте через пару минут.",
+        "bulk_loading": "🔍 Получаю список треков...",
+        "bulk_not_found": "❌ Не удалось получить список треков",
+        "bulk_limited": "ℹ️ В подборке {total} треков, будут отправлены первые {limit}.",
+        "bulk_status_cache": "Отправка из кэша",
+        "bulk_status_download": "Скачивание",
+        "bulk_done": "✅ <b>{name}</b>\n\nОтправлено: {sent} из {total}\nИз кэша: {cached}\nНе удалось: {failed}",
+        "bulk_track_caption": "🎵 <b>{name}</b>\n👤 {artist}\n\n🎧 {format} • {quality}",
+        "cached_label": "✨ Из кэша",
         "error_file_too_large": "⚠️ <b>Файл слишком большой!</b>\n\nРазмер: {size} MB\nЛимит Telegram: 50 MB\n\n💡 Пожалуйста, выберите качество ниже (например, 320 kbps или CD) в /settings, чтобы файл прошел по размеру.",
         "track_caption": "🎵 <b>{name}</b>\n👤 {artist}\n\n🎧 {quality} kbps",
         
@@ -159,12 +171,24 @@ STRINGS = {
         "notifications_success": "✅ Notifications {status}",
         
         # Search
-        "search_welcome": "🔍 <b>Music Search</b>\n\nSend me a Spotify track link, and I'll download it for you!\n\nExample:\n<code>https://open.spotify.com/track/...</code>",
+        "search_welcome": "🔍 <b>Music Search</b>\n\nSend me a Spotify track link, and I'll download it for you!\n\nExample:\n<code>https://open.spotify.com/track/...</code>\n\nSearch tracks already downloaded:\n<code>/search artist title</code>",
+        "search_results": "🔍 <b>Found in catalog:</b> {count}\n⚡ - sent instantly from cache",
+        "search_no_results": "🔍 Nothing found in the catalog. Send a Spotify track link.",
         "downloading": "📥 <b>Downloading...</b>\n\n<i>{name} - {artist}</i>\n\nPlease wait.",
         "searching": "🔍 Searching for track info...",
         "from_cache": "📤 Sending from cache...",
         "uploading": "📤 Uploading file to Telegram...",
         "error_download": "❌ Error downloading track. Please try again later.",
+        "queue_position": "⏳ <b>Queued for download</b>\n\n<i>{name} - {artist}</i>\n\nYour position: {position}",
+        "queue_full": "⏳ Too many downloads right now. Please try again in a couple of minutes.",
+        "bulk_loading": "🔍 Fetching track list...",
+        "bulk_not_found": "❌ Could not fetch the track list",
+        "bulk_limited": "ℹ️ This collection has {total} tracks, only the first {limit} will be sent.",
+        "bulk_status_cache": "Sending from cache",
+        "bulk_status_download": "Downloading",
+        "bulk_done": "✅ <b>{name}</b>\n\nSent: {sent} of {total}\nFrom cache: {cached}\nFailed: {failed}",
+        "bulk_track_caption": "🎵 <b>{name}</b>\n👤 {artist}\n\n🎧 {format} • {quality}",
+        "cached_label": "✨ From cache",
         "error_file_too_large": "⚠️ <b>File too large!</b>\n\nSize: {size} MB\nTelegram Limit: 50 MB\n\n💡 Please choose a lower quality (e.g., 320 kbps or CD) in /settings so the file can be sent.",
         "track_caption": "🎵 <b>{name}</b>\n👤 {artist}\n\n🎧 {quality} kbps",
 
@@ -0,0 +1,131 @@
+"""
+Параллельная обработка апдейтов с сохранением порядка внутри одного чата
+"""
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Optional
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обрабатывает апдейты разных чатов параллельно (не больше max_concurrent_updates),
+    а апдейты одного чата - строго по очереди, поэтому ConversationHandler
+    (создание плейлиста) видит сообщения пользователя в исходном порядке.
+
+    PTB держит слот своего семафора на все время do_process_update, поэтому
+    апдейт здесь только ставится в очередь своего чата и слот сразу освобождается.
+    Очередь чата разбирает одна задача-воркер, а число одновременно выполняемых
+    апдейтов ограничивает собственный семафор: ждущие своей очереди апдейты
+    занятого чата не занимают слоты и не блокируют другие чаты.
+
+    Долгий шаг обработчика (скачивание) запускается через run_in_background
+    и не держит очередь своего чата на время загрузки; drain при остановке
+    дожидается и его.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # chat_id -> апдейты чата (первый сейчас выполняется); пока очередь есть, жив ее воркер
+        self._chat_queues: Dict[Any, Deque[Awaitable[Any]]] = {}
+        self._workers: set = set()
+        # Фоновые шаги обработчиков (create_background_task)
+        self._background: set = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        """Слоты выполнения апдейтов (создаются в цикле бота)"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent_updates)
+        return self._slots
+
+    @staticmethod
+    def _chat_key(update: object):
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._chat_key(update)
+        if key is None:
+            # Апдейты без чата (например, poll) упорядочивать не нужно
+            async with self.slots:
+                await coroutine
+            return
+
+        queue = self._chat_queues.get(key)
+        if queue is not None:
+            # Воркер чата уже работает - он выполнит апдейт после предыдущих
+            queue.append(coroutine)
+            return
+        self._chat_queues[key] = deque([coroutine])
+        task = asyncio.create_task(self._drain_chat(key))
+        self._workers.add(task)
+        task.add_done_callback(self._workers.discard)
+
+    async def _drain_chat(self, key):
+        """Выполнить апдейты чата по порядку, пока его очередь не опустеет"""
+        queue = self._chat_queues[key]
+        try:
+            while queue:
+                try:
+                    async with self.slots:
+                        await queue[0]
+                except Exception as e:
+                    # Ошибки обработчиков PTB передает в error handler сам; сюда попадают только его сбои
+                    print(f"❌ Update processing error (chat {key}): {e}")
+                finally:
+                    queue.popleft()
+        finally:
+            # Воркер отменен при остановке - невыполненные корутины закрываем без предупреждений
+            for coroutine in queue:
+                close = getattr(coroutine, 'close', None)
+                if close:
+                    close()
+            del self._chat_queues[key]
+
+    def create_background_task(self, coroutine: Awaitable[Any]) -> asyncio.Task:
+        """Выполнить долгий шаг обработчика вне очереди чата"""
+        task = asyncio.create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+        return task
+
+    def _background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"❌ Background handler error: {task.exception()}")
+
+    async def drain(self):
+        """Дождаться обработки всех уже принятых апдейтов и их фоновых шагов (при остановке бота)"""
+        while self._workers or self._background:
+            await asyncio.gather(*self._workers, *self._background, return_exceptions=True)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        # Обычно очереди уже разобраны в post_stop; оставшиеся воркеры отменяем
+        tasks = [*self._workers, *self._background]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def run_in_background(context, coroutine: Awaitable[Any]) -> asyncio.Task:
+    """
+    Запустить долгий шаг обработчика в фоне, не задерживая следующие апдейты чата.
+    Задачу отслеживает процессор апдейтов (или Application), поэтому при остановке
+    бота она дорабатывает, а не теряется.
+    """
+    processor = context.application.update_processor
+    if isinstance(processor, PerChatUpdateProcessor):
+        return processor.create_background_task(coroutine)
+    return context.application.create_task(coroutine)
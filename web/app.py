@@ -1,11 +1,19 @@
 """
 Flask Web Application для музыкального бота
 """
-from flask import Flask, request, jsonify, send_file, render_template
+from flask import Flask, Response, request, jsonify, send_file, render_template
 from flask_cors import CORS
-import asyncio
+from werkzeug.http import http_date, quote_etag
+import hashlib
+import atexit
+import json
+import mimetypes
 import os
 import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
 
 # Добавляем корневую директорию в путь для импорта модулей
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -13,18 +21,47 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import config
 from services.spotify_service import SpotifyService
 from services.download_service import DownloadService
+from services.http_client import http_clients
+from services.stream_cache import StreamCache
 from database.db_manager import DatabaseManager
+from web.event_loop import LoopTimeoutError, web_loop
+from web.jobs import Job, JobError, JobManager
 
 app = Flask(__name__)
 CORS(app)
 
 # Инициализация сервисов
 spotify_service = SpotifyService()
-download_service = DownloadService()
 db = DatabaseManager()
+download_service = DownloadService(db_manager=db)
+
+def _shutdown():
+    """Дописать отложенные записи БД и закрыть пулы соединений при остановке воркера"""
+    if web_loop.running:
+        try:
+            web_loop.run(db.close(), timeout=30)
+            web_loop.run(http_clients.aclose(), timeout=10)
+        except Exception as e:
+            print(f"⚠️ Web App: shutdown error: {e}")
+        web_loop.stop()
+    http_clients.close()
+
+# Цикл, БД и пулы HTTP соединений живут весь процесс и закрываются при его остановке
+atexit.register(_shutdown)
+
+# Задания подготовки стрима и скачивания выполняются в цикле процесса
+jobs = JobManager(web_loop, ttl=config.WEB_JOB_TTL)
+
+# Фрагменты файлов Telegram на диске: повтор и перемотка не ходят в Telegram
+stream_cache = StreamCache(
+    download_service.stream_cache_dir,
+    max_bytes=config.STREAM_CACHE_MAX_MB * 1024 * 1024,
+    chunk_size=config.STREAM_CHUNK_KB * 1024
+)
 
 # Telegram Storage Service будет инициализирован при первом использовании
 telegram_storage = None
+async_telegram_storage = None
 backup_service = None
 
 def get_telegram_storage():
@@ -35,37 +72,56 @@ def get_telegram_storage():
         telegram_storage = TelegramStorageService()
     return telegram_storage
 
+def get_async_telegram_storage():
+    """Асинхронный Telegram Storage для кода в цикле процесса (задания, проверка file_id)"""
+    global async_telegram_storage
+    if async_telegram_storage is None:
+        from services.telegram_storage_service import AsyncTelegramStorageService
+        async_telegram_storage = AsyncTelegramStorageService(db_manager=db)
+    return async_telegram_storage
+
 def get_backup_service():
     """Ленивая инициализация Database Backup Service"""
     global backup_service
     if backup_service is None:
         from services.db_backup_service import DatabaseBackupService
+        from services.telegram_storage_service import AsyncTelegramStorageService
+        # Без кэша путей в БД: восстановление идет до инициализации самой БД
         backup_service = DatabaseBackupService(
-            storage_service=get_telegram_storage(),
-            db_path=config.DATABASE_URL.replace('sqlite+aiosqlite:///', ''),
-            db_manager=db
+            storage_service=AsyncTelegramStorageService(),
+            db_path=config.SQLITE_DB_PATH,
+            db_manager=db,
+            database_dsn=config.DATABASE_DSN
         )
     return backup_service
 
 # Флаг инициализации БД
 db_initialized = False
+_db_init_lock = threading.Lock()
+
+async def _start_db_services():
+    """Писатель БД, запись отложенных изменений и фоновая проверка file_id работают в цикле процесса"""
+    db.start_writer()
+    db.start_write_behind()
+    db.file_id_validator = get_async_telegram_storage().check_file_id
 
 def ensure_db_initialized():
     """Ленивая инициализация БД при первом запросе с восстановлением из Telegram"""
     global db_initialized
-    if not db_initialized:
+    if db_initialized:
+        return
+    with _db_init_lock:
+        if db_initialized:
+            return
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
             print("📦 Web App: Checking for database restoration...")
             # Попытка восстановления из Telegram перед инициализацией
             backup = get_backup_service()
-            loop.run_until_complete(backup.restore_from_telegram())
+            web_loop.run(backup.restore_from_telegram(), timeout=config.WEB_DB_INIT_TIMEOUT)
             
             # Инициализация (создание таблиц, если не созданы)
-            loop.run_until_complete(db.init_db())
-            loop.close()
+            web_loop.run(db.init_db(), timeout=config.WEB_DB_INIT_TIMEOUT)
+            web_loop.run(_start_db_services())
             db_initialized = True
             print("✅ Web App: Database ready")
         except Exception as e:
@@ -79,6 +135,16 @@ def before_request():
     """Инициализация БД перед первым запросом"""
     ensure_db_initialized()
 
+def _error_status(e: Exception, default: int = 500) -> int:
+    """HTTP статус ответа об ошибке: 504, если операция в цикле событий не уложилась во время"""
+    return 504 if isinstance(e, LoopTimeoutError) else default
+
+@app.errorhandler(LoopTimeoutError)
+def loop_timeout(e):
+    """Таймаут операции вне try маршрута - тоже 504, а не 500"""
+    print(f"⏱ Web App: {e}")
+    return jsonify({'error': str(e)}), 504
+
 @app.route('/health')
 def health_check():
     return jsonify({'status': 'ok'}), 200
@@ -102,114 +168,173 @@ def search():
         if 'spotify.com' in query or 'open.spotify' in query:
             return search_by_url(query)
         
-        # Обычный поиск по тексту
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        results = loop.run_until_complete(spotify_service.search_track(query))
-        loop.close()
+        # Обычный поиск по тексту: сначала собственный каталог (FTS5)
+        results = web_loop.run(db.search_catalog(query, limit=config.SEARCH_RESULTS_LIMIT))
+        if not results:
+            results = web_loop.run(spotify_service.search_track(query))
         
         if not results:
             return jsonify({'tracks': []})
         
         # Форматируем результаты
         tracks = []
-        for track in results[:10]:
+        for track in results[:config.SEARCH_RESULTS_LIMIT]:
             tracks.append({
                 'id': track.get('id'),
                 'name': track.get('name'),
                 'artist': track.get('artist'),
                 'album': track.get('album'),
-                'duration': track.get('duration_ms', 0) // 1000,
+                'duration': (track.get('duration_ms') or 0) // 1000,
                 'image': track.get('image_url'),
-                'preview_url': track.get('preview_url')
+                'preview_url': track.get('preview_url'),
+                'cached': bool(track.get('cached'))
             })
         
         return jsonify({'tracks': tracks})
     
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return jsonify({'error': str(e)}), _error_status(e)
 
 @app.route('/api/sync-library', methods=['POST'])
 def sync_library():
     """Синхронизировать библиотеку (перенести данные из старых таблиц в Discovery)"""
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
         # Получаем все треки с легаси ID
-        async def run_sync():
-            async with db.async_session() as session:
-                from database.models import Track, TrackCache, TelegramFile
-                from sqlalchemy import select
-                from datetime import datetime
-                
-                added_count = 0
-                # 1. Сначала из Track.telegram_file_id
-                result = await session.execute(select(Track).where(Track.telegram_file_id != None))
-                for track in result.scalars().all():
-                    exists = await session.get(TelegramFile, track.id)
-                    if not exists:
+        async def run_sync(session):
+            from database.models import Track, TrackCache, TelegramFile
+            from sqlalchemy import select
+            from datetime import datetime
+            
+            added_count = 0
+            # 1. Сначала из Track.telegram_file_id
+            result = await session.execute(select(Track).where(Track.telegram_file_id != None))
+            for track in result.scalars().all():
+                exists = await session.get(TelegramFile, track.id)
+                if not exists:
+                    session.add(TelegramFile(
+                        track_id=track.id,
+                        file_id=track.telegram_file_id,
+                        artist=track.artist,
+                        track_name=track.name,
+                        uploaded_at=track.cached_at or track.created_at or datetime.utcnow()
+                    ))
+                    added_count += 1
+            
+            # 2. Потом из TrackCache
+            result = await session.execute(select(TrackCache))
+            for entry in result.scalars().all():
+                exists = await session.get(TelegramFile, entry.track_id)
+                if not exists:
+                    track = await session.get(Track, entry.track_id)
+                    if track:
                         session.add(TelegramFile(
-                            track_id=track.id,
-                            file_id=track.telegram_file_id,
+                            track_id=entry.track_id,
+                            file_id=entry.telegram_file_id,
                             artist=track.artist,
                             track_name=track.name,
-                            uploaded_at=track.cached_at or track.created_at or datetime.utcnow()
+                            uploaded_at=entry.created_at or datetime.utcnow()
                         ))
                         added_count += 1
-                
-                # 2. Потом из TrackCache
-                result = await session.execute(select(TrackCache))
-                for entry in result.scalars().all():
-                    exists = await session.get(TelegramFile, entry.track_id)
-                    if not exists:
-                        track = await session.get(Track, entry.track_id)
-                        if track:
-                            session.add(TelegramFile(
-                                track_id=entry.track_id,
-                                file_id=entry.telegram_file_id,
-                                artist=track.artist,
-                                track_name=track.name,
-                                uploaded_at=entry.created_at or datetime.utcnow()
-                            ))
-                            added_count += 1
-                
-                await session.commit()
-                return added_count
+            
+            return added_count
         
-        count = loop.run_until_complete(run_sync())
-        loop.close()
+        # Запись идет через писателя БД, как и остальные записи процесса
+        count = web_loop.run(db.run_write(run_sync))
+        db.invalidate_library_version()
         return jsonify({'success': True, 'added_count': count})
         
     except Exception as e:
         print(f"❌ Sync error: {e}")
-        return jsonify({'error': str(e)}), 500
+        return jsonify({'error': str(e)}), _error_status(e)
+
+# Максимальный размер страницы для ?limit=
+MAX_PAGE_SIZE = 500
+
+def _page_params(default_limit: int):
+    """Параметры keyset-пагинации из query string: (cursor, limit)"""
+    cursor = request.args.get('cursor') or None
+    limit = int(request.args.get('limit', default_limit))
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return cursor, min(limit, MAX_PAGE_SIZE)
+
+# Готовые ответы /api/library: (ETag, query string) -> JSON; сбрасываются при смене версии
+_library_responses: "OrderedDict[tuple, bytes]" = OrderedDict()
+_library_responses_lock = threading.Lock()
+
+def _library_etag(version) -> str:
+    """ETag библиотеки из ее версии (последний uploaded_at, число файлов)"""
+    latest, count = version
+    stamp = latest.isoformat() if latest else ''
+    return f"lib-{count}-{hashlib.md5(stamp.encode()).hexdigest()[:12]}"
+
+def _library_payload(version, limit: int, cursor, since):
+    """Страница библиотеки или дельта после since"""
+    if since is not None:
+        tracks_db, has_more = web_loop.run(db.get_library_tracks_since(since, limit=limit))
+        payload = {'complete': not has_more}
+    else:
+        tracks_db, next_cursor, _ = web_loop.run(
+            db.get_library_tracks_page(limit=limit, cursor=cursor)
+        )
+        payload = {'next_cursor': next_cursor}
+    
+    latest, count = version
+    payload['tracks'] = [{
+        'id': track.id,
+        'name': track.name,
+        'artist': track.artist,
+        'album': track.album,
+        'image': track.image_url,
+        'spotify_url': track.spotify_url
+    } for track in tracks_db]
+    # latest - значение для следующего ?since=, total - для проверки, что дельта ничего не пропустила
+    payload['latest'] = latest.isoformat() if latest else None
+    payload['total'] = count
+    return payload
 
 @app.route('/api/library', methods=['GET'])
 def get_library():
-    """Получить все треки из библиотеки (кэша)"""
+    """
+    Получить страницу треков из библиотеки (кэша): ?cursor=&limit=
+    или только новые треки: ?since=<latest из прошлого ответа>.
+    Ответ с ETag: без изменений в библиотеке отдается 304.
+    """
+    try:
+        cursor, limit = _page_params(config.LIBRARY_PAGE_SIZE)
+        since = request.args.get('since')
+        since = datetime.fromisoformat(since) if since else None
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor, limit or since'}), 400
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        tracks_db = loop.run_until_complete(db.get_library_tracks(limit=500))
-        loop.close()
+        version = web_loop.run(db.get_library_version())
+        etag = _library_etag(version)
+        headers = {'ETag': quote_etag(etag), 'Cache-Control': 'no-cache'}
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
         
-        tracks = []
-        for track in tracks_db:
-            tracks.append({
-                'id': track.id,
-                'name': track.name,
-                'artist': track.artist,
-                'album': track.album,
-                'image': track.image_url,
-                'spotify_url': track.spotify_url
-            })
-            
-        return jsonify({'tracks': tracks})
+        key = (etag, request.query_string)
+        with _library_responses_lock:
+            body = _library_responses.get(key)
+            if body is not None:
+                _library_responses.move_to_end(key)
+        if body is None:
+            body = json.dumps(_library_payload(version, limit, cursor, since)).encode()
+            with _library_responses_lock:
+                # Ответы прошлых версий больше не понадобятся
+                for stale in [k for k in _library_responses if k[0] != etag]:
+                    del _library_responses[stale]
+                _library_responses[key] = body
+                while len(_library_responses) > config.LIBRARY_RESPONSE_CACHE_SIZE:
+                    _library_responses.popitem(last=False)
         
+        return Response(body, mimetype='application/json', headers=headers)
+        
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         print(f"❌ Error in get_library: {e}")
-        return jsonify({'error': str(e)}), 500
+        return jsonify({'error': str(e)}), _error_status(e)
 
 def search_by_url(url):
     """Поиск по Spotify URL"""
@@ -217,10 +342,7 @@ def search_by_url(url):
         # Определяем тип URL (track, album, playlist)
         if '/track/' in url:
             # Получаем информацию о треке
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            track_info = loop.run_until_complete(spotify_service.get_track_info_from_url(url))
-            loop.close()
+            track_info = web_loop.run(spotify_service.get_track_info_from_url(url))
             
             if track_info:
                 return jsonify({
@@ -237,18 +359,20 @@ def search_by_url(url):
         
         elif '/playlist/' in url:
             # Поддержка Spotify плейлистов
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
             
-            playlist_info = loop.run_until_complete(spotify_service.get_playlist_info(url))
-            loop.close()
+            playlist_info = web_loop.run(spotify_service.get_playlist_info(url))
             
             if playlist_info and playlist_info.get('tracks'):
                 # Форматируем треки плейлиста
                 tracks = []
                 for track in playlist_info['tracks']:
+                    track_id = track.get('id')
+                    if not track_id or track_id.startswith('idx_'):
+                        # Тот же ID, что получит трек при скачивании по имени
+                        unique_string = f"{track['artist']}_{track['name']}".lower()
+                        track_id = hashlib.md5(unique_string.encode()).hexdigest()[:16]
                     tracks.append({
-                        'id': track.get('id', f"{track['artist']}_{track['name']}"),  # Используем ID из сервиса или генерируем
+                        'id': track_id,
                         'name': track['name'],
                         'artist': track['artist'],
                         'album': playlist_info['name'],  # Используем название плейлиста как альбом
@@ -258,6 +382,21 @@ def search_by_url(url):
                         'playlist_name': playlist_info['name']
                     })
                 
+                # Регистрация треков и проверка кэша - пакетными запросами на весь плейлист
+                try:
+                    web_loop.run(db.upsert_tracks([{
+                        'id': t['id'],
+                        'name': t['name'],
+                        'artist': t['artist'],
+                        'duration_ms': (t['duration'] or 0) * 1000,
+                        'image_url': t['image'],
+                    } for t in tracks]))
+                    cached_ids = web_loop.run(db.get_telegram_file_ids([t['id'] for t in tracks]))
+                    for t in tracks:
+                        t['cached'] = t['id'] in cached_ids
+                except Exception as db_e:
+                    print(f"⚠️ Warning: playlist cache lookup failed: {db_e}")
+                
                 return jsonify({
                     'tracks': tracks,
                     'playlist_info': {
@@ -283,143 +422,93 @@ def search_by_url(url):
         print(f"❌ Error in search_by_url: {e}")
         import traceback
         traceback.print_exc()
-        return jsonify({'error': str(e), 'tracks': []})
+        return jsonify({'error': str(e), 'tracks': []}), _error_status(e, 200)
 
 @app.route('/api/download', methods=['POST'])
 def download():
-    """Скачивание трека"""
+    """
+    Скачивание трека: ставит фоновое задание и отвечает 202.
+    Готовый файл отдается по result.download_url задания.
+    """
+    data = request.json or {}
+    track_id = data.get('track_id')
+    track_name = data.get('track_name')
+    track_artist = data.get('track_artist')
+    quality = data.get('quality', '320')
+    file_format = data.get('format', 'mp3')
+    
+    if not track_id and not (track_name and track_artist):
+        return jsonify({'error': 'Track ID or name/artist is required'}), 400
+    
+    job = jobs.submit('download', lambda job: _download_job(
+        job, track_id, track_name, track_artist, quality, file_format
+    ))
+    return _job_accepted(job)
+
+async def _download_job(job: Job, track_id, track_name, track_artist, quality, file_format):
+    """Скачать трек, зарегистрировать его в Discover и подготовить файл для клиента"""
+    if not (track_name and track_artist):
+        # Только track_id - информацию о треке берем из Spotify
+        track_info = await spotify_service.get_track_info(track_id)
+        if not track_info:
+            raise JobError('Track not found')
+        track_name, track_artist = track_info['name'], track_info['artist']
+    
+    result = await download_service.search_and_download(
+        track_artist,
+        track_name,
+        quality,
+        file_format,
+        track_id=track_id,
+        on_queue_position=_queue_reporter(job),
+        on_phase=_phase_reporter(job)
+    )
+    if not result or not result.get('file_path') or not os.path.exists(result['file_path']):
+        error_msg = result.get('error') if result else "Unknown error"
+        raise JobError(f"Download failed: {error_msg}")
+    
+    file_path = result['file_path']
+    # Файл удаляется, когда клиент его забрал или задание устарело
+    jobs.update(job, cleanup=lambda: download_service.cleanup_file(file_path))
+    
+    # РЕГИСТРАЦИЯ В DISCOVER (Функция для надежности)
+    jobs.update(job, 'uploading')
     try:
-        data = request.json
-        track_id = data.get('track_id')
-        track_name = data.get('track_name')
-        track_artist = data.get('track_artist')
-        quality = data.get('quality', '320')
-        file_format = data.get('format', 'mp3')
-        
-        # Если есть имя и исполнитель, используем их напрямую
-        if track_name and track_artist:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            result = loop.run_until_complete(
-                download_service.search_and_download(
-                    track_artist,
-                    track_name,
-                    quality,
-                    file_format
-                )
-            )
-            loop.close()
-            
-            if result and result.get('file_path') and os.path.exists(result['file_path']):
-                file_path = result['file_path']
-                
-                # РЕГИСТРАЦИЯ В DISCOVER (Функция для надежности)
-                try:
-                    # Генерируем ID если его нет
-                    if not track_id:
-                        import hashlib
-                        unique_string = f"{track_artist}_{track_name}".lower()
-                        track_id = hashlib.md5(unique_string.encode()).hexdigest()[:16]
-                    
-                    # 1. Создаем трек в БД
-                    loop.run_until_complete(db.get_or_create_track({
-                        'id': track_id,
-                        'name': track_name,
-                        'artist': track_artist,
-                        'spotify_url': f"https://open.spotify.com/search/{track_artist} {track_name}"
-                    }))
-                    
-                    # 2. Загружаем в Telegram Storage (чтобы появился в Discover)
-                    print(f"📤 Auto-uploading web download to Telegram: {track_name}")
-                    upload_result = get_telegram_storage().upload_file(file_path, f"🎵 {track_artist} - {track_name}")
-                    if upload_result and upload_result.get('file_id'):
-                        file_id = upload_result['file_id']
-                        # Сохраняем во все кэш-таблицы
-                        loop.run_until_complete(db.update_track_cache(track_id, file_id, file_format, quality))
-                        loop.run_until_complete(db.save_telegram_file(
-                            track_id=track_id, 
-                            file_id=file_id, 
-                            artist=track_artist, 
-                            track_name=track_name, 
-                            file_size=result.get('file_size', 0)
-                        ))
-                except Exception as reg_e:
-                    print(f"⚠️ Warning: Registration in discovery failed: {reg_e}")
-
-                loop.close()
-                return send_file(
-                    file_path,
-                    as_attachment=True,
-                    download_name=f"{track_artist} - {track_name}.{file_format}"
-                )
-            else:
-                loop.close()
-                error_msg = result.get('error') if result else "Unknown error"
-                return jsonify({'error': f"Download failed: {error_msg}"}), 500
-        
-        # Иначе используем track_id
+        # Генерируем ID если его нет
         if not track_id:
-            return jsonify({'error': 'Track ID or name/artist is required'}), 400
-        
-        # Скачивание трека по ID
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        # Получаем информацию о треке
-        track_info = loop.run_until_complete(spotify_service.get_track_info(track_id))
+            unique_string = f"{track_artist}_{track_name}".lower()
+            track_id = hashlib.md5(unique_string.encode()).hexdigest()[:16]
         
-        if not track_info:
-            return jsonify({'error': 'Track not found'}), 404
-        
-        # Скачиваем трек
-        result = loop.run_until_complete(
-            download_service.search_and_download(
-                track_info['artist'],
-                track_info['name'],
-                quality,
-                file_format
-            )
-        )
-        loop.close()
+        # 1. Создаем трек в БД
+        await db.get_or_create_track({
+            'id': track_id,
+            'name': track_name,
+            'artist': track_artist,
+            'spotify_url': f"https://open.spotify.com/search/{track_artist} {track_name}"
+        })
         
-        if result and result.get('file_path') and os.path.exists(result['file_path']):
-            file_path = result['file_path']
-            
-            # РЕГИСТРАЦИЯ В DISCOVER
-            try:
-                # 1. Загружаем в Telegram Storage
-                print(f"📤 Auto-uploading web download to Telegram: {track_info['name']}")
-                upload_result = get_telegram_storage().upload_file(file_path, f"🎵 {track_info['artist']} - {track_info['name']}")
-                if upload_result and upload_result.get('file_id'):
-                    file_id = upload_result['file_id']
-                    loop.run_until_complete(db.update_track_cache(track_id, file_id, file_format, quality))
-                    loop.run_until_complete(db.save_telegram_file(
-                        track_id=track_id, 
-                        file_id=file_id, 
-                        artist=track_info['artist'], 
-                        track_name=track_info['name'], 
-                        file_size=result.get('file_size', 0)
-                    ))
-            except Exception as reg_e:
-                print(f"⚠️ Warning: Registration in discovery failed: {reg_e}")
-
-            loop.close()
-            return send_file(
-                file_path,
-                as_attachment=True,
-                download_name=f"{track_info['artist']} - {track_info['name']}.{file_format}"
+        # 2. Загружаем в Telegram Storage (чтобы появился в Discover)
+        print(f"📤 Auto-uploading web download to Telegram: {track_name}")
+        upload_result = await get_async_telegram_storage().upload_file(file_path, f"🎵 {track_artist} - {track_name}")
+        if upload_result and upload_result.get('file_id'):
+            file_id = upload_result['file_id']
+            # Сохраняем во все кэш-таблицы
+            await db.update_track_cache(track_id, file_id, file_format, quality)
+            await db.save_telegram_file(
+                track_id=track_id,
+                file_id=file_id,
+                artist=track_artist,
+                track_name=track_name,
+                file_size=result.get('file_size', 0)
             )
-        else:
-            loop.close()
-            error_msg = result.get('error') if result else "Unknown error"
-            return jsonify({'error': f"Download failed: {error_msg}"}), 500
+    except Exception as reg_e:
+        print(f"⚠️ Warning: Registration in discovery failed: {reg_e}")
     
-    except Exception as e:
-        print(f"❌ Download error: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+    jobs.update(job, file_path=file_path, download_name=f"{track_artist} - {track_name}.{file_format}")
+    return {
+        'download_url': f"/api/jobs/{job.id}/file",
+        'title': f"{track_artist} - {track_name}"
+    }
 
 # Временное хранилище токенов (в идеале использовать Redis или общую таблицу в БД)
 # Но для простоты пока будем использовать глобальную переменную, 
@@ -437,10 +526,7 @@ def authenticate():
             return jsonify({'error': 'Token is required'}), 400
             
         # Проверяем токен в БД
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        user = loop.run_until_complete(db.verify_auth_token(token))
-        loop.close()
+        user = web_loop.run(db.verify_auth_token(token))
         
         if user:
             return jsonify({
@@ -456,7 +542,7 @@ def authenticate():
             return jsonify({'error': 'Invalid or expired token'}), 401
     except Exception as e:
         print(f"❌ Auth error: {e}")
-        return jsonify({'error': str(e)}), 500
+        return jsonify({'error': str(e)}), _error_status(e)
 
 @app.route('/api/playlists', methods=['GET', 'POST'])
 def handle_playlists():
@@ -467,26 +553,22 @@ def handle_playlists():
             return jsonify({'error': 'Unauthorized'}), 401
             
         user_id = int(user_id)
-        
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-            
+
         if request.method == 'GET':
             # Получить список плейлистов
-            playlists_db = loop.run_until_complete(db.get_user_playlists(user_id))
+            playlists_db = web_loop.run(db.get_user_playlists_with_counts(user_id))
             
             result = []
-            for pl in playlists_db:
-                # Получаем количество треков
-                count = loop.run_until_complete(db.get_playlist_track_count(pl.id))
+            for pl, count, last_added_at in playlists_db:
+                updated_at = max(filter(None, (pl.updated_at, last_added_at)), default=None)
                 result.append({
                     'id': pl.id,
                     'name': pl.name,
                     'description': pl.description,
-                    'track_count': count
+                    'track_count': count,
+                    'updated_at': updated_at.isoformat() if updated_at else None
                 })
             
-            loop.close()
             return jsonify({'playlists': result})
             
         elif request.method == 'POST':
@@ -498,8 +580,7 @@ def handle_playlists():
             if not name:
                 return jsonify({'error': 'Name is required'}), 400
                 
-            playlist = loop.run_until_complete(db.create_playlist(user_id, name, description))
-            loop.close()
+            playlist = web_loop.run(db.create_playlist(user_id, name, description))
             
             return jsonify({
                 'id': playlist.id,
@@ -509,7 +590,7 @@ def handle_playlists():
             
     except Exception as e:
         print(f"❌ Playlists API error: {e}")
-        return jsonify({'error': str(e)}), 500
+        return jsonify({'error': str(e)}), _error_status(e)
 
 @app.route('/api/playlists/add_track', methods=['POST'])
 def add_track_to_playlist():
@@ -525,10 +606,7 @@ def add_track_to_playlist():
         
         if not playlist_id or not track_data:
             return jsonify({'error': 'Missing required data'}), 400
-            
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
+
         # 1. Получаем/создаем трек в БД
         # Генерируем стабильный ID на основе названия и исполнителя
         import hashlib
@@ -538,7 +616,7 @@ def add_track_to_playlist():
             unique_string = f"{track_data.get('artist', '')}_{track_data.get('name', '')}".lower()
             track_id = f"web_{hashlib.md5(unique_string.encode()).hexdigest()[:16]}"
         
-        track = loop.run_until_complete(db.get_or_create_track({
+        track = web_loop.run(db.get_or_create_track({
             'id': track_id,
             'name': track_data.get('name'),
             'artist': track_data.get('artist'),
@@ -548,8 +626,7 @@ def add_track_to_playlist():
         }))
         
         # 2. Добавляем в плейлист
-        success = loop.run_until_complete(db.add_track_to_playlist(playlist_id, track.id))
-        loop.close()
+        success = web_loop.run(db.add_track_to_playlist(playlist_id, track.id))
         
         if success:
             return jsonify({'success': True})
@@ -558,22 +635,25 @@ def add_track_to_playlist():
             
     except Exception as e:
         print(f"❌ Add track error: {e}")
-        return jsonify({'error': str(e)}), 500
+        return jsonify({'error': str(e)}), _error_status(e)
 
 @app.route('/api/playlists/<int:playlist_id>/tracks', methods=['GET'])
 def get_playlist_tracks(playlist_id):
-    """Получить треки плейлиста"""
+    """Получить страницу треков плейлиста: ?cursor=&limit="""
     try:
         user_id = request.headers.get('X-User-ID')
         if not user_id:
             return jsonify({'error': 'Unauthorized'}), 401
-            
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
         
+        try:
+            cursor, limit = _page_params(MAX_PAGE_SIZE)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor or limit'}), 400
+
         # Получаем треки плейлиста
-        tracks = loop.run_until_complete(db.get_playlist_tracks(playlist_id))
-        loop.close()
+        tracks, next_cursor, _ = web_loop.run(
+            db.get_playlist_tracks_page(playlist_id, limit=limit, cursor=cursor)
+        )
         
         # Форматируем результат
         result = []
@@ -588,17 +668,22 @@ def get_playlist_tracks(playlist_id):
                 'spotify_url': track.spotify_url
             })
         
-        return jsonify({'tracks': result})
+        return jsonify({'tracks': result, 'next_cursor': next_cursor})
         
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
     except Exception as e:
         print(f"❌ Get playlist tracks error: {e}")
-        return jsonify({'error': str(e)}), 500
+        return jsonify({'error': str(e)}), _error_status(e)
 
 @app.route('/api/prepare-stream', methods=['POST'])
 def prepare_stream():
-    """Подготовить трек для стриминга через Telegram Storage"""
+    """
+    Подготовить трек для стриминга через Telegram Storage.
+    Трек из кэша отдается сразу, остальные - фоновым заданием (202).
+    """
     try:
-        data = request.json
+        data = request.json or {}
         artist = data.get('artist', '')
         track_name = data.get('name', '')
         track_id = data.get('id', '')
@@ -608,113 +693,32 @@ def prepare_stream():
         
         # Генерируем уникальный track_id если не передан
         if not track_id:
-            import hashlib
             # Используем тот же алгоритм, что и в боте для консистентности
             unique_string = f"{artist}_{track_name}".lower()
             track_id = hashlib.md5(unique_string.encode()).hexdigest()[:16]
         
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
         # 1. Проверяем кеш в БД (сначала общий кэш бота, затем специфичный для веб-хранилища)
-        file_id = loop.run_until_complete(db.get_cached_file_id(track_id, quality='192'))
+        file_id = web_loop.run(db.get_cached_file_id(track_id, quality='192'))
         
         if not file_id:
             # Проверяем старую таблицу TelegramFile (для совместимости)
-            telegram_file = loop.run_until_complete(db.get_telegram_file(track_id))
+            telegram_file = web_loop.run(db.get_telegram_file(track_id))
             if telegram_file:
                 file_id = telegram_file.file_id
         
         if file_id:
-            # Файл уже в Telegram!
+            # Файл уже в Telegram - отдаем через прокси /api/stream
             print(f"✅ Found in cache: {track_id}")
-            
-            # Получаем прямую ссылку из Telegram
-            file_url = get_telegram_storage().get_file_url(file_id)
-            
-            if file_url:
-                loop.close()
-                return jsonify({
-                    'success': True,
-                    'stream_url': file_url,
-                    'cached': True,
-                    'title': f"{artist} - {track_name}"
-                })
-        
-        # 2. Файла нет в кеше - скачиваем
-        print(f"📥 Downloading: {artist} - {track_name}")
-        result = loop.run_until_complete(
-            download_service.search_and_download(
-                artist,
-                track_name,
-                '192',  # Среднее качество для стриминга
-                'mp3'
-            )
-        )
-        
-        if not result or result.get('error'):
-            error_msg = result.get('error') if result else "Unknown download error"
-            print(f"❌ Download failed details: {error_msg}")
-            loop.close()
-            return jsonify({'error': f"Download failed: {error_msg}"}), 500
-            
-        if not result.get('file_path') or not os.path.exists(result['file_path']):
-            print(f"❌ File not found after download: {result.get('file_path')}")
-            loop.close()
-            return jsonify({'error': 'File not found after download'}), 500
-        
-        file_path = result['file_path']
-        
-        # 3. Загружаем в Telegram Storage
-        print(f"📤 Uploading to Telegram Storage: {os.path.basename(file_path)}")
-        caption = f"🎵 {artist} - {track_name}"
-        upload_result = get_telegram_storage().upload_file(file_path, caption)
-        
-        if not upload_result or not upload_result.get('file_id'):
-            loop.close()
-            return jsonify({'error': 'Failed to upload to Telegram Storage'}), 500
-        
-        # 4. Сохраняем в обе таблицы кэша для максимальной совместимости
-        file_id = upload_result['file_id']
-        loop.run_until_complete(
-            db.update_track_cache(
-                track_id=track_id,
-                telegram_file_id=file_id,
-                file_format='mp3',
-                quality='192'
-            )
-        )
-        loop.run_until_complete(
-            db.save_telegram_file(
-                track_id=track_id,
-                file_id=file_id,
-                file_path=upload_result.get('file_path'),
-                file_size=upload_result.get('file_size'),
-                artist=artist,
-                track_name=track_name
-            )
-        )
-        
-        # 5. Получаем прямую ссылку
-        file_url = get_telegram_storage().get_file_url(upload_result['file_id'])
-        
-        # 6. Очистка временного файла
-        try:
-            download_service.cleanup_file(file_path)
-        except:
-            pass
-            
-        loop.close()
-        
-        if file_url:
             return jsonify({
                 'success': True,
-                'stream_url': file_url,
-                'cached': False,
+                'stream_url': f"/api/stream/{track_id}",
+                'cached': True,
                 'title': f"{artist} - {track_name}"
             })
-        else:
-            return jsonify({'error': 'Failed to get stream URL after upload'}), 500
+        
+        # 2. Файла нет в кеше - скачиваем и загружаем в фоне
+        job = jobs.submit('prepare-stream', lambda job: _prepare_stream_job(job, artist, track_name, track_id))
+        return _job_accepted(job)
             
     except Exception as e:
         print(f"❌ Prepare stream error: {e}")
@@ -724,7 +728,273 @@ def prepare_stream():
         return jsonify({
             'error': f"Internal Server Error: {str(e)}",
             'type': type(e).__name__
-        }), 500
+        }), _error_status(e)
+
+async def _prepare_stream_job(job: Job, artist: str, track_name: str, track_id: str):
+    """Скачать трек, загрузить в Telegram Storage и вернуть ссылку на прокси стриминга"""
+    print(f"📥 Downloading: {artist} - {track_name}")
+    result = await download_service.search_and_download(
+        artist,
+        track_name,
+        '192',  # Среднее качество для стриминга
+        'mp3',
+        track_id=track_id,
+        on_queue_position=_queue_reporter(job),
+        on_phase=_phase_reporter(job)
+    )
+    
+    if not result or result.get('error'):
+        error_msg = result.get('error') if result else "Unknown download error"
+        print(f"❌ Download failed details: {error_msg}")
+        raise JobError(f"Download failed: {error_msg}")
+        
+    if not result.get('file_path') or not os.path.exists(result['file_path']):
+        print(f"❌ File not found after download: {result.get('file_path')}")
+        raise JobError('File not found after download')
+    
+    file_path = result['file_path']
+    try:
+        # 3. Загружаем в Telegram Storage
+        jobs.update(job, 'uploading')
+        storage = get_async_telegram_storage()
+        upload_result = await storage.upload_file(file_path, f"🎵 {artist} - {track_name}")
+        if not upload_result or not upload_result.get('file_id'):
+            raise JobError('Failed to upload to Telegram Storage')
+        
+        # 4. Сохраняем в обе таблицы кэша для максимальной совместимости
+        # (кэш ссылается на трек, поэтому сначала регистрируем сам трек)
+        file_id = upload_result['file_id']
+        await db.get_or_create_track({
+            'id': track_id,
+            'name': track_name,
+            'artist': artist,
+            'spotify_url': f"https://open.spotify.com/search/{artist} {track_name}"
+        })
+        await db.update_track_cache(
+            track_id=track_id,
+            telegram_file_id=file_id,
+            file_format='mp3',
+            quality='192'
+        )
+        await db.save_telegram_file(
+            track_id=track_id,
+            file_id=file_id,
+            file_path=upload_result.get('file_path'),
+            file_size=upload_result.get('file_size'),
+            artist=artist,
+            track_name=track_name
+        )
+    finally:
+        # 5. Очистка временного файла
+        download_service.cleanup_file(file_path)
+    
+    return {
+        'stream_url': f"/api/stream/{track_id}",
+        'cached': False,
+        'title': f"{artist} - {track_name}"
+    }
+
+# ========== ФОНОВЫЕ ЗАДАНИЯ ==========
+
+def _job_accepted(job: Job):
+    """Ответ 202 с адресами статуса и потока событий задания"""
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'phase': job.phase,
+        'status_url': f"/api/jobs/{job.id}",
+        'events_url': f"/api/jobs/{job.id}/events"
+    }), 202
+
+def _phase_reporter(job: Job):
+    """Колбэк этапов скачивания для задания (вызывается из потока воркера)"""
+    return lambda phase: jobs.update(job, phase)
+
+def _queue_reporter(job: Job):
+    """Колбэк позиции в очереди скачиваний (0 - скачивание началось)"""
+    def report(position: int):
+        if position:
+            jobs.update(job, 'queued', position=position)
+    return report
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Статус задания для опроса"""
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    _, state = jobs.snapshot(job)
+    return jsonify(state)
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-Sent Events: событие на каждый этап задания до ready или failed"""
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def stream():
+        sent_version = -1
+        while True:
+            version, state = jobs.snapshot(job)
+            if version > sent_version:
+                sent_version = version
+                yield f"event: {state['phase']}\ndata: {json.dumps(state)}\n\n"
+                if state['done']:
+                    return
+            elif not jobs.wait(job, sent_version, config.WEB_SSE_HEARTBEAT):
+                # Комментарий не дает прокси закрыть простаивающее соединение
+                yield ": keep-alive\n\n"
+    
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/jobs/<job_id>/file', methods=['GET'])
+def job_file(job_id):
+    """Отдать файл завершенного задания скачивания (один раз)"""
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job.done:
+        return jsonify({'error': 'Job is not finished', 'phase': job.phase}), 409
+    if not job.file_path or not os.path.exists(job.file_path):
+        return jsonify({'error': 'File is no longer available'}), 410
+    
+    response = send_file(job.file_path, as_attachment=True, download_name=job.download_name)
+    # Файл больше не нужен после отправки клиенту
+    response.call_on_close(lambda: jobs.release(job))
+    return response
+
+# ========== СТРИМИНГ ==========
+
+async def _find_stream_file_id(track_id: str):
+    """file_id трека для веб-плеера (общий кэш бота, затем веб-хранилище)"""
+    file_id = await db.get_cached_file_id(track_id, quality='192')
+    if not file_id:
+        telegram_file = await db.get_telegram_file(track_id)
+        if telegram_file:
+            file_id = telegram_file.file_id
+    return file_id
+
+def _fetch_telegram_range(file_id: str, start: int, end: int):
+    """
+    Запросить байты [start, end] файла из Telegram.
+    Ссылка содержит токен бота, поэтому ее видит только сервер.
+    """
+    file_url = web_loop.run(get_async_telegram_storage().get_file_url(file_id))
+    if not file_url:
+        raise IOError('Failed to get file URL from Telegram')
+    response = http_clients.get_sync('telegram').get(
+        file_url,
+        headers={'Range': f"bytes={start}-{end}"},
+        timeout=60.0
+    )
+    if response.status_code not in (200, 206):
+        raise IOError(f"Telegram file request failed: HTTP {response.status_code}")
+    return response, file_url
+
+def _stream_meta(key: str, file_id: str) -> dict:
+    """Размер, ETag и тип файла; при первом обращении заодно кэшируется фрагмент 0"""
+    meta = stream_cache.get_meta(key)
+    if meta:
+        return meta
+    with stream_cache.file_lock(key):
+        meta = stream_cache.get_meta(key)
+        if meta:
+            return meta
+        response, file_url = _fetch_telegram_range(file_id, 0, stream_cache.chunk_size - 1)
+        data = response.content
+        if response.status_code == 206:
+            try:
+                size = int(response.headers.get('Content-Range', '').rsplit('/', 1)[1])
+            except (IndexError, ValueError):
+                raise IOError('Telegram returned no file size')
+        else:
+            # Range проигнорирован - пришел весь файл
+            size = len(data)
+            data = data[:stream_cache.chunk_size]
+        meta = {
+            'size': size,
+            'etag': f"{hashlib.sha1(file_id.encode()).hexdigest()[:16]}-{size}",
+            'last_modified': response.headers.get('Last-Modified') or http_date(time.time()),
+            'content_type': mimetypes.guess_type(file_url)[0] or 'audio/mpeg',
+        }
+        stream_cache.put_meta(key, meta)
+        if data:
+            stream_cache.put_chunk(key, 0, data)
+        return meta
+
+def _if_range_matches(meta: dict) -> bool:
+    """If-Range: частичный ответ, только если у клиента та же версия файла"""
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == meta['etag']
+    if if_range.date:
+        return http_date(if_range.date) == meta['last_modified']
+    return True
+
+@app.route('/api/stream/<track_id>', methods=['GET', 'HEAD'])
+def stream_track(track_id):
+    """
+    Стримить трек из Telegram Storage с поддержкой Range (перемотка в <audio>).
+    Фрагменты файла кэшируются на диске, клиент не получает ссылку с токеном бота.
+    """
+    try:
+        file_id = web_loop.run(_find_stream_file_id(track_id))
+        if not file_id:
+            return jsonify({'error': 'Track is not in storage'}), 404
+        key = stream_cache.key_for(file_id)
+        meta = _stream_meta(key, file_id)
+    except Exception as e:
+        print(f"❌ Stream error ({track_id}): {e}")
+        return jsonify({'error': 'Upstream storage error'}), _error_status(e, 502)
+    
+    size = meta['size']
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': quote_etag(meta['etag']),
+        'Last-Modified': meta['last_modified'],
+        'Cache-Control': 'private, max-age=3600',
+    }
+    if request.if_none_match.contains(meta['etag']):
+        return Response(status=304, headers=headers)
+    
+    start, stop, status = 0, size, 200
+    byte_range = request.range
+    if byte_range and byte_range.units == 'bytes' and len(byte_range.ranges) == 1 and _if_range_matches(meta):
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            headers['Content-Range'] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+        start, stop = bounds
+        status = 206
+        headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+    headers['Content-Length'] = str(stop - start)
+    
+    def fetch_chunk(index: int) -> bytes:
+        chunk_start = index * stream_cache.chunk_size
+        chunk_end = min(chunk_start + stream_cache.chunk_size, size) - 1
+        response, _ = _fetch_telegram_range(file_id, chunk_start, chunk_end)
+        if response.status_code == 200:
+            return response.content[chunk_start:chunk_end + 1]
+        return response.content
+    
+    def body():
+        try:
+            yield from stream_cache.read(key, size, start, stop, fetch_chunk)
+        except Exception as e:
+            # Заголовки уже отправлены - остается оборвать ответ
+            print(f"❌ Stream error ({track_id}): {e}")
+    
+    return Response(
+        () if request.method == 'HEAD' else body(),
+        status=status,
+        mimetype=meta['content_type'],
+        headers=headers,
+        direct_passthrough=True
+    )
 
 @app.route('/api/stream-file/<path:filename>')
 def stream_file(filename):
@@ -746,7 +1016,7 @@ def stream_file(filename):
         
     except Exception as e:
         print(f"❌ Stream file error: {e}")
-        return jsonify({'error': str(e)}), 500
+        return jsonify({'error': str(e)}), _error_status(e)
 
 @app.route('/api/backup-db', methods=['POST'])
 def backup_database():
@@ -755,10 +1025,7 @@ def backup_database():
         backup_svc = get_backup_service()
         
         # Создаем backup асинхронно
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        success = loop.run_until_complete(backup_svc.backup_to_telegram())
-        loop.close()
+        success = web_loop.run(backup_svc.backup_to_telegram(), timeout=config.WEB_DB_INIT_TIMEOUT)
         
         if success:
             return jsonify({'success': True, 'message': 'Database backup created'})
@@ -769,7 +1036,7 @@ def backup_database():
         print(f"❌ Backup error: {e}")
         import traceback
         traceback.print_exc()
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return jsonify({'success': False, 'error': str(e)}), _error_status(e)
 
 if __name__ == '__main__':
     # Инициализация БД перед запуском
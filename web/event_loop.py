@@ -0,0 +1,105 @@
+"""
+Долгоживущий event loop веб-процесса
+
+Маршруты Flask синхронные, а БД и сервисы - асинхронные. Раньше каждый запрос
+создавал свой цикл и закрывал его, а вместе с ним пропадали пул соединений
+aiosqlite, httpx клиенты и писатель БД. Здесь один цикл работает весь процесс
+в фоновом потоке, а потоки запросов передают в него корутины и ждут результат.
+"""
+import asyncio
+import concurrent.futures
+import os
+import threading
+from typing import Any, Awaitable, Optional
+
+import config
+
+
+class LoopTimeoutError(TimeoutError):
+    """Корутина не завершилась за отведенное время и отменена"""
+
+
+class BackgroundLoop:
+    """
+    Event loop в отдельном потоке-демоне.
+
+    Цикл создается лениво при первом вызове run() и заново после fork
+    (например, gunicorn --preload): поток родителя в дочернем процессе не работает.
+    """
+
+    def __init__(self, name: str = "web-event-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        """Запущен ли цикл в текущем процессе"""
+        return (
+            self._loop is not None
+            and self._pid == os.getpid()
+            and self._thread is not None
+            and self._thread.is_alive()
+        )
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Цикл процесса (запускается при первом обращении)"""
+        with self._lock:
+            if not self.running:
+                self._start()
+            return self._loop
+
+    def _start(self):
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run_forever():
+            asyncio.set_event_loop(loop)
+            loop.call_soon(ready.set)
+            loop.run_forever()
+
+        thread = threading.Thread(target=run_forever, name=self.name, daemon=True)
+        thread.start()
+        ready.wait()
+        self._loop, self._thread, self._pid = loop, thread, os.getpid()
+        print(f"🔁 Web event loop started (pid {self._pid})")
+
+    def run(self, coroutine: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """
+        Выполнить корутину в цикле процесса и вернуть ее результат.
+        Вызывается из потоков запросов, не из самого цикла.
+
+        Args:
+            timeout: Сколько ждать (по умолчанию WEB_LOOP_TIMEOUT); зависшая операция
+                не должна навсегда занимать поток gunicorn
+
+        Raises:
+            LoopTimeoutError: время вышло, корутина отменена
+        """
+        if timeout is None:
+            timeout = config.WEB_LOOP_TIMEOUT
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise LoopTimeoutError(f"Operation timed out after {timeout:.0f}s")
+
+    def stop(self, timeout: float = 10.0):
+        """Остановить цикл и дождаться завершения потока"""
+        with self._lock:
+            if not self.running:
+                return
+            loop, thread = self._loop, self._thread
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout)
+            if not thread.is_alive():
+                loop.close()
+            self._loop = self._thread = self._pid = None
+
+
+# Общий цикл веб-процесса
+web_loop = BackgroundLoop()
@@ -0,0 +1,154 @@
+"""
+Фоновые задания веб-интерфейса (подготовка стрима и скачивание)
+
+Поиск на YouTube, скачивание, ffmpeg и загрузка в Telegram занимают десятки
+секунд. Маршрут ставит задание в цикл процесса и сразу отвечает 202 с его id,
+а клиент следит за этапами через опрос статуса или Server-Sent Events.
+Задания хранятся в памяти процесса, поэтому веб работает одним воркером.
+"""
+import asyncio
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from web.event_loop import BackgroundLoop
+
+# Этапы задания в порядке выполнения; ready и failed - конечные
+PHASES = ('queued', 'searching', 'downloading', 'transcoding', 'uploading', 'ready', 'failed')
+FINAL_PHASES = ('ready', 'failed')
+
+
+class JobError(Exception):
+    """Ожидаемая ошибка задания: сообщение уходит клиенту, трассировка в лог не пишется"""
+
+
+class Job:
+    """Состояние одного задания"""
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.phase = 'queued'
+        self.position: Optional[int] = None
+        self.result: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        # Растет при каждом изменении - по нему SSE понимает, что отправлять
+        self.version = 0
+        # Готовый файл для скачивания клиентом и его имя
+        self.file_path: Optional[str] = None
+        self.download_name: Optional[str] = None
+        # Освобождение ресурсов задания (например, временного файла) при удалении
+        self.cleanup: Optional[Callable[[], None]] = None
+
+    @property
+    def done(self) -> bool:
+        return self.phase in FINAL_PHASES
+
+    def to_dict(self) -> dict:
+        data = {
+            'job_id': self.id,
+            'kind': self.kind,
+            'phase': self.phase,
+            'done': self.done,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+        }
+        if self.position is not None:
+            data['position'] = self.position
+        if self.result:
+            data['result'] = self.result
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class JobManager:
+    """
+    Реестр заданий процесса.
+
+    Этапы обновляются из цикла и из потоков воркеров скачивания, а читаются
+    потоками запросов, поэтому все изменения идут под одной блокировкой.
+    """
+
+    def __init__(self, loop: BackgroundLoop, ttl: float = 600.0):
+        self.loop = loop
+        self.ttl = ttl
+        self._jobs: Dict[str, Job] = {}
+        self._changed = threading.Condition()
+
+    def submit(self, kind: str, runner: Callable[[Job], Awaitable[Dict[str, Any]]]) -> Job:
+        """
+        Поставить задание в цикл процесса
+
+        Args:
+            runner: Корутинная функция, получает задание и возвращает результат для клиента
+        """
+        job = Job(kind)
+        with self._changed:
+            self._purge_locked()
+            self._jobs[job.id] = job
+        asyncio.run_coroutine_threadsafe(self._execute(job, runner), self.loop.loop)
+        return job
+
+    async def _execute(self, job: Job, runner: Callable[[Job], Awaitable[Dict[str, Any]]]):
+        try:
+            result = await runner(job)
+            self.update(job, 'ready', result=result or {})
+        except JobError as e:
+            self.update(job, 'failed', error=str(e))
+        except Exception as e:
+            print(f"❌ Job {job.kind} {job.id} failed: {e}")
+            self.update(job, 'failed', error=str(e))
+
+    def update(self, job: Job, phase: Optional[str] = None, **fields):
+        """Обновить этап и поля задания и разбудить ожидающих"""
+        with self._changed:
+            if job.done:
+                return
+            if phase is not None:
+                job.phase = phase
+                if phase != 'queued':
+                    job.position = None
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.updated_at = time.time()
+            job.version += 1
+            self._changed.notify_all()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._changed:
+            return self._jobs.get(job_id)
+
+    def snapshot(self, job: Job) -> Tuple[int, dict]:
+        """Согласованные версия и состояние задания"""
+        with self._changed:
+            return job.version, job.to_dict()
+
+    def wait(self, job: Job, version: int, timeout: float) -> bool:
+        """Дождаться изменения задания после версии version; False - по таймауту"""
+        with self._changed:
+            return self._changed.wait_for(lambda: job.version > version, timeout)
+
+    def release(self, job: Job):
+        """Освободить ресурсы задания (результат уже забран клиентом)"""
+        with self._changed:
+            cleanup, job.cleanup = job.cleanup, None
+            job.file_path = None
+        if cleanup:
+            cleanup()
+
+    def _purge_locked(self):
+        """Удалить завершенные задания старше ttl"""
+        now = time.time()
+        expired = [job for job in self._jobs.values() if job.done and now - job.updated_at > self.ttl]
+        for job in expired:
+            del self._jobs[job.id]
+            if job.cleanup:
+                try:
+                    job.cleanup()
+                except Exception as e:
+                    print(f"⚠️ Job cleanup error: {e}")
+                job.cleanup = None
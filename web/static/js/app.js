@@ -4,6 +4,10 @@ let currentTrack = null;
 let searchTimeout = null;
 let resultsData = [];
 let libraryData = [];
+let libraryNextCursor = null;
+// Версия загруженной библиотеки для запроса только новых треков (?since=)
+let libraryLatest = null;
+let libraryTotal = 0;
 let userData = JSON.parse(localStorage.getItem('userData') || 'null');
 const audioPlayer = document.getElementById('audioPlayer');
 
@@ -190,30 +194,90 @@ async function syncLibrary() {
     }
 }
 
-async function loadLibrary() {
+async function loadLibrary(cursor = null) {
+    // Библиотека уже на странице - запрашиваем только новые треки
+    if (!cursor && libraryLatest && libraryData.length && await refreshLibrary()) {
+        return;
+    }
     try {
-        const response = await fetch('/api/library');
+        const url = cursor ? `/api/library?cursor=${encodeURIComponent(cursor)}` : '/api/library';
+        const response = await fetch(url);
         const data = await response.json();
         const libraryGrid = document.getElementById('libraryGrid');
 
-        if (!data.tracks || data.tracks.length === 0) {
+        if (!cursor && (!data.tracks || data.tracks.length === 0)) {
             document.getElementById('librarySection').style.display = 'none';
             return;
         }
 
         document.getElementById('librarySection').style.display = 'block';
-        libraryGrid.innerHTML = '';
-        libraryData = data.tracks;
+        if (!cursor) {
+            libraryGrid.innerHTML = '';
+            libraryData = [];
+        }
 
-        data.tracks.forEach((track, index) => {
-            const card = renderTrackCard(track, index, 'library');
-            libraryGrid.innerHTML += card;
-        });
+        // Следующая страница дописывается в конец, индексы карточек продолжаются
+        const offset = libraryData.length;
+        libraryData = libraryData.concat(data.tracks || []);
+        libraryGrid.insertAdjacentHTML('beforeend',
+            (data.tracks || []).map((track, i) => renderTrackCard(track, offset + i, 'library')).join(''));
+
+        libraryNextCursor = data.next_cursor || null;
+        if (!cursor) {
+            libraryLatest = data.latest || null;
+            libraryTotal = data.total || 0;
+        }
+        renderLibraryMoreButton();
     } catch (error) {
         console.error('Load library error:', error);
     }
 }
 
+async function refreshLibrary() {
+    // true - дельта применена; false - нужно перечитать библиотеку целиком
+    try {
+        const response = await fetch(`/api/library?since=${encodeURIComponent(libraryLatest)}`);
+        if (!response.ok) return false;
+        const data = await response.json();
+        const newTracks = data.tracks || [];
+        const newIds = new Set(newTracks.map(track => track.id));
+        const kept = libraryData.filter(track => !newIds.has(track.id));
+        const added = newTracks.length - (libraryData.length - kept.length);
+        // Неполная дельта, удаления или треки со старой датой - число треков не сходится
+        if (!data.complete || libraryTotal + added !== data.total) {
+            return false;
+        }
+        if (newTracks.length) {
+            libraryData = newTracks.concat(kept);
+            document.getElementById('libraryGrid').innerHTML =
+                libraryData.map((track, i) => renderTrackCard(track, i, 'library')).join('');
+        }
+        libraryLatest = data.latest || libraryLatest;
+        libraryTotal = data.total;
+        return true;
+    } catch (error) {
+        console.error('Refresh library error:', error);
+        return false;
+    }
+}
+
+function renderLibraryMoreButton() {
+    let button = document.getElementById('libraryMoreBtn');
+    if (!libraryNextCursor) {
+        if (button) button.remove();
+        return;
+    }
+    if (!button) {
+        button = document.createElement('button');
+        button.id = 'libraryMoreBtn';
+        button.className = 'sync-btn';
+        button.style.margin = '24px auto 0';
+        button.innerHTML = '<span>Load more</span>';
+        button.onclick = () => loadLibrary(libraryNextCursor);
+        document.getElementById('librarySection').appendChild(button);
+    }
+}
+
 function displayResults(tracks) {
     const resultsGrid = document.getElementById('resultsGrid');
     resultsData = tracks;
@@ -234,7 +298,7 @@ function renderTrackCard(track, index, type = 'search') {
             `<svg viewBox="0 0 24 24" fill="currentColor"><path d="M12 3v10.55c-.59-.34-1.27-.55-2-.55-2.21 0-4 1.79-4 4s1.79 4 4 4 4-1.79 4-4V7h4V3h-6z"/></svg>`}
             </div>
             <div class="track-info">
-                <div class="track-name" title="${track.name}">${track.name}</div>
+                <div class="track-name" title="${track.name}">${track.cached ? '<span title="Instant: already in Telegram">⚡</span> ' : ''}${track.name}</div>
                 <div class="track-artist" title="${track.artist}">${track.artist}</div>
             </div>
             <div class="track-actions">
@@ -306,9 +370,17 @@ async function playFromYouTube(track) {
             })
         });
 
-        const data = await response.json();
+        let data = await response.json();
+
+        // Трека нет в кэше - сервер готовит его фоновым заданием
+        if (response.status === 202) {
+            const job = await waitForJob(data, phase => {
+                if (PHASE_LABELS[phase]) showNotification(PHASE_LABELS[phase], 'info');
+            });
+            data = job.phase === 'ready' ? job.result : { error: job.error };
+        }
 
-        if (response.ok && data.stream_url) {
+        if (data.stream_url) {
             currentTrack = track;
             // Используем прямую ссылку из Telegram
             audioPlayer.src = data.stream_url;
@@ -334,6 +406,57 @@ async function playFromYouTube(track) {
     }
 }
 
+// Background jobs (prepare-stream, download)
+const PHASE_LABELS = {
+    searching: 'Searching on YouTube...',
+    downloading: 'Downloading...',
+    transcoding: 'Converting...',
+    uploading: 'Uploading to Telegram...'
+};
+
+// Follow a job via Server-Sent Events (falls back to polling); resolves with the final state
+function waitForJob(accepted, onPhase = () => {}) {
+    return new Promise(resolve => {
+        let lastPhase = null;
+        const handle = state => {
+            if (state.phase !== lastPhase) {
+                lastPhase = state.phase;
+                onPhase(state.phase, state);
+            }
+            return state.done;
+        };
+
+        const poll = async () => {
+            try {
+                const response = await fetch(accepted.status_url);
+                const state = await response.json();
+                if (!response.ok) return resolve({ phase: 'failed', error: state.error });
+                if (handle(state)) return resolve(state);
+            } catch (error) {
+                console.error('Job status error:', error);
+            }
+            setTimeout(poll, 2000);
+        };
+
+        if (!window.EventSource) return poll();
+
+        const source = new EventSource(accepted.events_url);
+        const onEvent = event => {
+            const state = JSON.parse(event.data);
+            if (handle(state)) {
+                source.close();
+                resolve(state);
+            }
+        };
+        ['queued', 'searching', 'downloading', 'transcoding', 'uploading', 'ready', 'failed']
+            .forEach(phase => source.addEventListener(phase, onEvent));
+        source.onerror = () => {
+            source.close();
+            poll();
+        };
+    });
+}
+
 function updatePlayerUI(track) {
     const playerTrackInfo = document.querySelector('.player-track-info');
     playerTrackInfo.querySelector('.track-image').innerHTML = track.image ?
@@ -514,10 +637,21 @@ async function viewPlaylist(playlistId, playlistName) {
     if (!userData) return;
 
     try {
-        const response = await fetch(`/api/playlists/${playlistId}/tracks`, {
-            headers: { 'X-User-ID': userData.id.toString() }
-        });
-        const data = await response.json();
+        // Треки приходят страницами: проходим по курсорам до конца плейлиста
+        let response, data;
+        let tracks = [];
+        let cursor = null;
+        do {
+            const url = `/api/playlists/${playlistId}/tracks` + (cursor ? `?cursor=${encodeURIComponent(cursor)}` : '');
+            response = await fetch(url, {
+                headers: { 'X-User-ID': userData.id.toString() }
+            });
+            data = await response.json();
+            if (!response.ok) break;
+            tracks = tracks.concat(data.tracks || []);
+            cursor = data.next_cursor;
+        } while (cursor);
+        data.tracks = tracks;
 
         if (response.ok) {
             // Переключаемся на раздел поиска и показываем треки плейлиста
@@ -660,6 +794,8 @@ function closeDownloadModal() {
 
 async function startDownload() {
     if (!currentTrack) return;
+    // Пока идет задание, пользователь может переключить трек
+    const track = currentTrack;
     const format = document.querySelector('input[name="format"]:checked').value;
     const quality = document.getElementById('qualitySelect').value;
 
@@ -669,29 +805,37 @@ async function startDownload() {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
-                track_id: currentTrack.id || '',
-                track_name: currentTrack.name,
-                track_artist: currentTrack.artist,
+                track_id: track.id || '',
+                track_name: track.name,
+                track_artist: track.artist,
                 quality: quality,
                 format: format
             })
         });
 
-        if (response.ok) {
-            const blob = await response.blob();
-            const url = window.URL.createObjectURL(blob);
-            const a = document.createElement('a');
-            a.href = url;
-            a.download = `${currentTrack.artist} - ${currentTrack.name}.${format}`;
-            document.body.appendChild(a);
-            a.click();
-            window.URL.revokeObjectURL(url);
-            document.body.removeChild(a);
-            showNotification('Download completed!', 'success');
-            closeDownloadModal();
-        } else {
-            showNotification('Download failed', 'error');
+        const data = await response.json();
+        if (response.status !== 202) {
+            showNotification(data.error || 'Download failed', 'error');
+            return;
         }
+
+        closeDownloadModal();
+        const job = await waitForJob(data, phase => {
+            if (PHASE_LABELS[phase]) showNotification(PHASE_LABELS[phase], 'info');
+        });
+        if (job.phase !== 'ready') {
+            showNotification(job.error || 'Download failed', 'error');
+            return;
+        }
+
+        // Файл отдается сервером по ссылке задания
+        const a = document.createElement('a');
+        a.href = job.result.download_url;
+        a.download = `${track.artist} - ${track.name}.${format}`;
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+        showNotification('Download completed!', 'success');
     } catch (error) {
         showNotification('Download error', 'error');
     }